@@ -0,0 +1,467 @@
+from SemanticAnalysis import SemanticAnalyzer
+from Lexer import Lexer
+from Parser import Parser
+from Interpreter import Interpreter
+from Token import TokenType
+from Optimizer import PassManager, count_nodes, DEFAULT_LEVEL
+from Output import OutputStream
+from Nodes import STATEMENTS
+from SPI import ENGINES
+import Regression
+import argparse
+import contextlib
+import io
+import json
+import logging
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+
+###################
+#  BENCHMARKS     #
+###################
+
+FORMAT_VERSION = 1
+
+# Corpus: every function returns the source of a program, scale multiplies its work
+
+def arithmetic(scale):
+    """ Integer and real arithmetic in a WHILE loop """
+    return f'''PROGRAM Arithmetic;
+VAR
+i, s, d : INTEGER;
+r : REAL;
+BEGIN
+    i := 0;
+    s := 0;
+    r := 0.0;
+    WHILE i < {int(20000 * scale)} DO
+    BEGIN
+        s := s + i * 3 - (i DIV 7);
+        d := s DIV 13;
+        r := r + i / 4 + 0.5;
+        i := i + 1;
+    END;
+    writeln(s, " ", d, " ", r);
+END.
+'''
+
+
+def recursion(scale):
+    """ Deep chains of procedure calls """
+    return f'''PROGRAM Recursion;
+VAR
+n, total : INTEGER;
+
+PROCEDURE Count(k : INTEGER);
+VAR
+m : INTEGER;
+BEGIN
+    total := total + 1;
+    m := k - 1;
+    IF m > 0 THEN Count(m);
+END;
+
+BEGIN
+    n := 0;
+    total := 0;
+    WHILE n < {int(400 * scale)} DO
+    BEGIN
+        Count(40);
+        n := n + 1;
+    END;
+    writeln("calls ", total);
+END.
+'''
+
+
+def arrays(scale):
+    """ Sweeps filling and summing a static array """
+    size = int(5000 * scale)
+    return f'''PROGRAM Arrays;
+VAR
+i, pass, sum : INTEGER;
+data : ARRAY [0..{size}] OF INTEGER;
+BEGIN
+    pass := 0;
+    sum := 0;
+    WHILE pass < 4 DO
+    BEGIN
+        i := 0;
+        WHILE i <= {size} DO
+        BEGIN
+            data[i] := i * pass + 1;
+            i := i + 1;
+        END;
+        i := 0;
+        WHILE i <= {size} DO
+        BEGIN
+            sum := sum + data[i];
+            i := i + 1;
+        END;
+        pass := pass + 1;
+    END;
+    writeln("sum ", sum);
+END.
+'''
+
+
+def strings(scale):
+    """ writeln of strings and numbers """
+    return f'''PROGRAM Strings;
+VAR
+i : INTEGER;
+r : REAL;
+name, greeting : STRING;
+BEGIN
+    i := 0;
+    name := "Pascal";
+    WHILE i < {int(5000 * scale)} DO
+    BEGIN
+        greeting := "Hello ";
+        r := i / 3;
+        writeln(greeting, name, " line ", i, " of the output, value ", r);
+        writeln("a constant line of text written at every iteration");
+        i := i + 1;
+    END;
+END.
+'''
+
+
+def generated(scale):
+    """ A large machine generated source, mostly front end work """
+    lines = ['PROGRAM Generated;', 'VAR', 'a, b, c : INTEGER;', 'BEGIN', '    a := 0;', '    b := 1;',
+             '    c := 0;']
+    for i in range(int(4000 * scale)):
+        lines.append(f'    a := a + {i} * b - (c DIV 3);  {{ statement {i} }}')
+        lines.append(f'    IF a > {i * 7} THEN c := a - b;')
+    lines.extend(['    writeln(a, " ", c);', 'END.'])
+    return '\n'.join(lines) + '\n'
+
+
+CORPUS = {
+    'arithmetic': arithmetic,
+    'recursion': recursion,
+    'arrays': arrays,
+    'strings': strings,
+    'generated': generated,
+}
+
+
+class StatementCounter(Interpreter):
+    """ Tree walking interpreter counting the statements it executes """
+
+    def __init__(self, tree, output=None, input=None):
+        super().__init__(tree, output, input)
+        self.statements = 0
+
+    def visit(self, node):
+        if type(node).__name__ in STATEMENTS:
+            self.statements += 1
+        return super().visit(node)
+
+
+class ReplayLexer(object):
+    """ Returns again the tokens of a Lexer, recorded with the state the parser reads
+    after each of them (start, current_char), so Parser.parse is timed without lexing """
+
+    def __init__(self, source):
+        lexer = Lexer(source)
+        self.lines = lexer.lines
+        self.recorded = []
+        while True:
+            token = lexer.get_next_token()
+            self.recorded.append((token, lexer.start, lexer.current_char))
+            if token.type is TokenType.EOF:
+                break
+        self.rewind()
+
+    def rewind(self):
+        self.index = 0
+        self.start = 0
+        self.current_char = None
+
+    def get_next_token(self):
+        token, self.start, self.current_char = self.recorded[self.index]
+        if self.index < len(self.recorded) - 1:
+            self.index += 1  # EOF forever, like the Lexer
+        return token
+
+    def close(self):
+        pass
+
+
+def discard_output():
+    # The output is formatted and buffered as usual, then dropped
+    return OutputStream(lambda text: None)
+
+
+@contextlib.contextmanager
+def quiet():
+    # The parser prints debug lines on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class Benchmark(object):
+    """ Times the phases of running one program of the corpus.
+
+    Every repeat lexes the source (lex), parses it (parse: Parser.parse alone, fed
+    the tokens of a ReplayLexer recorded before the phase), analyses it
+    (analyze), runs the optimization passes (optimize) and runs the tree with each
+    engine (interpret:ENGINE, compilation included). Times are kept for every
+    repeat, after warmup runs that are not timed. One more run under tracemalloc measures the peak memory allocated
+    by each phase on top of what it started with.
+    """
+
+    def __init__(self, name, source, engines=('tree',), optimization_level=DEFAULT_LEVEL):
+        self.name = name
+        self.source = source
+        self.engines = engines
+        self.optimization_level = optimization_level
+        self.times = {}         # phase -> seconds of each repeat
+        self.peak_memory = {}   # phase -> bytes
+        self.size = {'characters': len(source)}
+
+    def lex(self):
+        lexer = Lexer(self.source)
+        tokens = 0
+        while lexer.get_next_token().type is not TokenType.EOF:
+            tokens += 1
+        return tokens
+
+    def phases(self):
+        """ Yields (phase, function) in order, every function runs one phase """
+        tree = None
+        replay = None
+
+        def parse():
+            nonlocal tree
+            replay.rewind()
+            tree = Parser(replay).parse()
+
+        def analyze():
+            SemanticAnalyzer().visit(tree)
+
+        def optimize():
+            nonlocal tree
+            tree = PassManager(self.optimization_level).run(tree)
+
+        yield 'lex', self.lex
+        # Lexed between the timed phases, the parser only pulls the recorded tokens
+        replay = ReplayLexer(self.source)
+        yield 'parse', parse
+        yield 'analyze', analyze
+        yield 'optimize', optimize
+        for engine in self.engines:
+            yield f'interpret:{engine}', lambda engine=engine: self.interpret(engine, tree)
+
+    def interpret(self, engine, tree):
+        engine_class = ENGINES[engine]
+        interpreter = engine_class(tree, output=discard_output())
+        interpreter.interpret()
+
+    def measure_size(self):
+        with quiet():
+            self.size['tokens'] = self.lex()
+            tree = Parser(Lexer(self.source)).parse()
+            self.size['nodes'] = count_nodes(tree)
+            SemanticAnalyzer().visit(tree)
+            tree = PassManager(self.optimization_level).run(tree)
+            counter = StatementCounter(tree, output=discard_output())
+            counter.interpret()
+        self.size['statements'] = counter.statements
+
+    def run(self, repeat=5, memory=True, warmup=1):
+        self.measure_size()
+        for run in range(warmup + repeat):
+            with quiet():
+                for phase, function in self.phases():
+                    start = time.perf_counter()
+                    function()
+                    elapsed = time.perf_counter() - start
+                    if run >= warmup:
+                        self.times.setdefault(phase, []).append(elapsed)
+        if memory:
+            self.measure_memory()
+        return self
+
+    def measure_memory(self):
+        tracemalloc.start()
+        try:
+            with quiet():
+                for phase, function in self.phases():
+                    tracemalloc.reset_peak()
+                    current, _ = tracemalloc.get_traced_memory()
+                    function()
+                    _, peak = tracemalloc.get_traced_memory()
+                    self.peak_memory[phase] = peak - current
+        finally:
+            tracemalloc.stop()
+
+    def median(self, phase):
+        return statistics.median(self.times[phase])
+
+    def throughput(self):
+        """ tokens/s of the lexer, nodes/s of the parser and statements/s of every engine """
+        def rate(count, phase):
+            elapsed = self.median(phase)
+            return count / elapsed if elapsed > 0 else None
+
+        throughput = {
+            'tokens_per_s': rate(self.size['tokens'], 'lex'),
+            'nodes_per_s': rate(self.size['nodes'], 'parse'),
+        }
+        for engine in self.engines:
+            throughput[f'statements_per_s:{engine}'] = rate(self.size['statements'], f'interpret:{engine}')
+        return throughput
+
+    def to_json(self):
+        return {
+            'size': self.size,
+            'times': self.times,
+            'throughput': self.throughput(),
+            'peak_memory': self.peak_memory,
+        }
+
+    def report(self):
+        size = self.size
+        lines = [
+            '{name}: {characters} characters, {tokens} tokens, {nodes} nodes, {statements} statements run'.format(
+                name=self.name, **size),
+            '    {:<20} {:>12} {:>12} {:>14} {:>14}'.format('phase', 'median ms', 'best ms', 'rate', 'peak memory'),
+        ]
+        throughput = self.throughput()
+        rates = {'lex': ('tokens_per_s', 'tokens/s'), 'parse': ('nodes_per_s', 'nodes/s')}
+        for engine in self.engines:
+            rates[f'interpret:{engine}'] = (f'statements_per_s:{engine}', 'stmts/s')
+        for phase, times in self.times.items():
+            rate = ''
+            if phase in rates and throughput[rates[phase][0]] is not None:
+                rate = f'{throughput[rates[phase][0]]:,.0f} {rates[phase][1]}'
+            memory = ''
+            if phase in self.peak_memory:
+                memory = f'{self.peak_memory[phase] / 2 ** 20:.2f} MB'
+            lines.append('    {:<20} {:>12.3f} {:>12.3f} {:>14} {:>14}'.format(
+                phase, self.median(phase) * 1000, min(times) * 1000, rate, memory))
+        return '\n'.join(lines)
+
+
+def run_suite(names=None, engines=('tree',), repeat=5, scale=1.0, optimization_level=DEFAULT_LEVEL,
+              memory=True, progress=None, warmup=1):
+    """ Runs the benchmarks of the corpus named in names (all by default),
+    returns {name: Benchmark} """
+    results = {}
+    for name in names or CORPUS:
+        benchmark = Benchmark(name, CORPUS[name](scale), engines, optimization_level)
+        results[name] = benchmark.run(repeat, memory, warmup)
+        if progress is not None:
+            progress(benchmark)
+    return results
+
+
+def suite_json(results, repeat, scale, optimization_level):
+    return {
+        'version': FORMAT_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'scale': scale,
+        'optimization_level': optimization_level,
+        # kB on Linux, bytes on macOS
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'benchmarks': {name: benchmark.to_json() for name, benchmark in results.items()},
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmarks of the Pascal interpreter')
+    arg_parser.add_argument('names', nargs='*', metavar='NAME',
+                            help=f"programs of the corpus to run ({', '.join(CORPUS)}; default: all, "
+                                 f"or those of the baseline)")
+    arg_parser.add_argument('--engine', action='append', choices=sorted(ENGINES), dest='engines',
+                            help='engine running the programs, can be repeated (default: tree, '
+                                 'or those of the baseline)')
+    arg_parser.add_argument('--repeat', type=int, default=5, metavar='N',
+                            help='times every phase is run (default: 5)')
+    arg_parser.add_argument('--warmup', type=int, default=1, metavar='N',
+                            help='runs of every phase before the timed ones (default: 1)')
+    arg_parser.add_argument('--scale', type=float,
+                            help='multiplies the work of every program (default: 1, or that of the baseline)')
+    arg_parser.add_argument('-O', dest='optimization_level', type=int, choices=[0, 1, 2],
+                            help=f'optimization level of the AST passes (default: {DEFAULT_LEVEL}, '
+                                 f'or that of the baseline)')
+    arg_parser.add_argument('--no-memory', action='store_true',
+                            help='skip the run measuring the peak memory of every phase')
+    arg_parser.add_argument('--json', metavar='FILE',
+                            help="write the results to FILE as JSON, '-' for stdout")
+    arg_parser.add_argument('--baseline', metavar='FILE',
+                            help='compare the results to those saved in FILE with --json, '
+                                 'exit with status 1 when a phase regressed')
+    arg_parser.add_argument('--results', metavar='FILE',
+                            help='compare the results saved in FILE to the baseline instead of running the benchmarks')
+    arg_parser.add_argument('--threshold', type=float, default=Regression.DEFAULT_THRESHOLD * 100, metavar='PCT',
+                            help=f'slowdown of the median time of a phase counted as a regression '
+                                 f'(default: {Regression.DEFAULT_THRESHOLD * 100:g})')
+    arg_parser.add_argument('--confidence', type=float, default=Regression.DEFAULT_CONFIDENCE * 100, metavar='PCT',
+                            help=f'confidence level of the interval of the change '
+                                 f'(default: {Regression.DEFAULT_CONFIDENCE * 100:g})')
+    arg_parser.add_argument('--min-time', type=float, default=Regression.DEFAULT_MIN_TIME * 1000, metavar='MS',
+                            help=f'phases faster than this in the baseline are not checked '
+                                 f'(default: {Regression.DEFAULT_MIN_TIME * 1000:g})')
+    args = arg_parser.parse_args()
+    unknown = [name for name in args.names if name not in CORPUS]
+    if unknown:
+        arg_parser.error(f"unknown benchmarks {', '.join(unknown)}")
+    if args.results is not None and args.baseline is None:
+        arg_parser.error('--results needs a --baseline to compare to')
+
+    baseline = Regression.load(args.baseline) if args.baseline is not None else {}
+    # Without options the run measures what the baseline measured
+    names = args.names or list(baseline.get('benchmarks', ())) or None
+    engines = args.engines or sorted({
+        phase.split(':', 1)[1]
+        for benchmark in baseline.get('benchmarks', {}).values()
+        for phase in benchmark['times'] if phase.startswith('interpret:')
+    }) or ['tree']
+    scale = args.scale if args.scale is not None else baseline.get('scale', 1.0)
+    optimization_level = args.optimization_level
+    if optimization_level is None:
+        optimization_level = baseline.get('optimization_level', DEFAULT_LEVEL)
+    to_stdout = args.json == '-'
+
+    def progress(benchmark):
+        if not to_stdout:
+            print(benchmark.report(), flush=True)
+
+    if args.results is not None:
+        current = Regression.load(args.results)
+    else:
+        logging.disable(logging.WARNING)  # fallback warnings would be printed at every repeat
+        results = run_suite(names, tuple(engines), args.repeat, scale, optimization_level,
+                            memory=not args.no_memory, progress=progress, warmup=args.warmup)
+        current = suite_json(results, args.repeat, scale, optimization_level)
+        if args.json is not None:
+            data = json.dumps(current, indent=2)
+            if to_stdout:
+                print(data)
+            else:
+                with open(args.json, 'w') as f:
+                    f.write(data + '\n')
+
+    if args.baseline is not None:
+        threshold = args.threshold / 100
+        confidence = args.confidence / 100
+        comparisons = Regression.compare(baseline, current, threshold, confidence, args.min_time / 1000)
+        print(Regression.report(comparisons, baseline, current, threshold, confidence),
+              file=sys.stderr if to_stdout else sys.stdout)
+        if Regression.regressed(comparisons):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
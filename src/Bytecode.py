@@ -0,0 +1,471 @@
+from SemanticAnalysis import NodeVisitor
+from Errors import ErrorCode, CompilerError
+from Token import TokenType
+from Nodes import *
+from Input import READ_ARRAY
+from array import array
+from enum import IntEnum
+
+
+##########################
+#  BYTECODE COMPILER     #
+##########################
+
+
+class Opcode(IntEnum):
+    LOAD_CONST = 1         # push consts[arg]
+    LOAD_VAR = 2           # push the variable in slot arg of the current frame
+    STORE_VAR = 3          # pop a value into slot arg
+    LOAD_INDEX = 4         # pop an index, push slot[arg][index]
+    STORE_INDEX = 5        # pop an index and a value, slot[arg][index] := value
+    BINARY_ADD = 6
+    BINARY_SUB = 7
+    BINARY_MUL = 8
+    BINARY_INT_DIV = 9
+    BINARY_FLOAT_DIV = 10
+    COMPARE_EQ = 11
+    COMPARE_NE = 12
+    COMPARE_LT = 13
+    COMPARE_GT = 14
+    COMPARE_LE = 15
+    COMPARE_GE = 16
+    UNARY_POS = 17
+    UNARY_NEG = 18
+    UNARY_NOT = 19
+    JUMP = 20              # pc := arg
+    JUMP_IF_NOT_TRUE = 21  # pop a value, jump unless it is True (IF, WHILE)
+    JUMP_IF_FALSE = 22     # pop a value, jump if it is False (REPEAT ... UNTIL)
+    JUMP_IF_FALSY_OR_POP = 23   # AND: keep the left operand and jump if it is falsy
+    JUMP_IF_TRUTHY_OR_POP = 24  # OR: keep the left operand and jump if it is truthy
+    WRITELN = 25           # pop arg values and print them on one line
+    PRINT_CONST = 26       # print consts[arg] without a newline (readln prompts)
+    READ_VAR = 27          # consts[arg] is (slot, read type), read a value into the slot
+    READ_INDEX = 28        # pop an index and read a value into slot[arg][index]
+    DECLARE_ARRAY = 29     # consts[arg] is (slot, min_range, max_range, element_type, path or None)
+    SET_LENGTH = 30        # consts[arg] is (scope distance, slot, length)
+    CALL = 31              # call_sites[arg], the arguments are on the stack
+    RETURN = 32
+    LABEL = 33             # jump target, only exists before assembly
+    # Superinstructions produced by the peephole pass: LOAD_CONST followed by a binary operation
+    BINARY_ADD_CONST = 34
+    BINARY_SUB_CONST = 35
+    BINARY_MUL_CONST = 36
+    # Variables of enclosing scopes, consts[arg] is (scope distance, slot)
+    LOAD_OUTER = 37
+    STORE_OUTER = 38
+    READ_OUTER = 39        # consts[arg] is (scope distance, slot, read type)
+    GET_ITEM = 40          # pop an index and an array, push array[index]
+    SET_ITEM = 41          # pop an index, an array and a value, array[index] := value
+    READ_ITEM = 42         # pop an index and an array, read a value into array[index]
+    READ_ARRAY = 43        # consts[arg] is (scope distance, slot), read every element of the array
+
+
+_BINARY_OPCODES = {
+    TokenType.PLUS: Opcode.BINARY_ADD,
+    TokenType.MINUS: Opcode.BINARY_SUB,
+    TokenType.MUL: Opcode.BINARY_MUL,
+    TokenType.INTEGER_DIV: Opcode.BINARY_INT_DIV,
+    TokenType.FLOAT_DIV: Opcode.BINARY_FLOAT_DIV,
+    TokenType.EQUAL: Opcode.COMPARE_EQ,
+    TokenType.NOT_EQ: Opcode.COMPARE_NE,
+    TokenType.LESSER: Opcode.COMPARE_LT,
+    TokenType.GREATER: Opcode.COMPARE_GT,
+    TokenType.LESS_EQ: Opcode.COMPARE_LE,
+    TokenType.GREAT_EQ: Opcode.COMPARE_GE,
+}
+
+_UNARY_OPCODES = {
+    TokenType.PLUS: Opcode.UNARY_POS,
+    TokenType.MINUS: Opcode.UNARY_NEG,
+    TokenType.NOT: Opcode.UNARY_NOT,
+}
+
+_CONST_OPCODES = {
+    Opcode.BINARY_ADD: Opcode.BINARY_ADD_CONST,
+    Opcode.BINARY_SUB: Opcode.BINARY_SUB_CONST,
+    Opcode.BINARY_MUL: Opcode.BINARY_MUL_CONST,
+}
+
+_JUMPS = (
+    Opcode.JUMP,
+    Opcode.JUMP_IF_NOT_TRUE,
+    Opcode.JUMP_IF_FALSE,
+    Opcode.JUMP_IF_FALSY_OR_POP,
+    Opcode.JUMP_IF_TRUTHY_OR_POP,
+)
+
+
+class CallSite(object):
+    def __init__(self, name, params, slot_names, nesting_level, entry=None):
+        self.name = name
+        self.params = params  # slots of the parameters bound by this call, in order
+        self.slot_names = slot_names  # sizes the frame of the procedure
+        self.nesting_level = nesting_level
+        self.entry = entry    # pc of the first instruction of the procedure body
+
+
+class Bytecode(object):
+    """ A whole compiled program: the main block starts at pc 0, procedure bodies follow.
+
+    Every instruction is an opcode in 'ops' and an operand at the same position in 'args'.
+    """
+
+    def __init__(self, name, slot_names, scope_levels, ops, args, consts, call_sites):
+        self.name = name
+        self.slot_names = slot_names  # sizes the frame of the main block
+        self.scope_levels = scope_levels
+        self.ops = ops
+        self.args = args
+        self.consts = consts
+        self.call_sites = call_sites
+
+    def disassemble(self):
+        lines = []
+        for pc, (op, arg) in enumerate(zip(self.ops, self.args)):
+            op = Opcode(op)
+            if op in (Opcode.LOAD_CONST, Opcode.PRINT_CONST, Opcode.DECLARE_ARRAY, Opcode.SET_LENGTH,
+                      Opcode.BINARY_ADD_CONST, Opcode.BINARY_SUB_CONST, Opcode.BINARY_MUL_CONST,
+                      Opcode.LOAD_OUTER, Opcode.STORE_OUTER, Opcode.READ_OUTER, Opcode.READ_VAR,
+                      Opcode.READ_ARRAY):
+                detail = repr(self.consts[arg])
+            elif op in (Opcode.LOAD_VAR, Opcode.STORE_VAR, Opcode.LOAD_INDEX, Opcode.STORE_INDEX,
+                        Opcode.READ_INDEX):
+                detail = 'slot'
+            elif op == Opcode.CALL:
+                detail = self.call_sites[arg].name
+            else:
+                detail = ''
+            lines.append(f'{pc:>6} {op.name:<22} {arg:>6} {detail}')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.disassemble()
+
+
+class BytecodeCompiler(NodeVisitor):
+    """ Lowers the analysed AST into a flat instruction stream for the VirtualMachine """
+
+    def __init__(self):
+        self.code = []          # (opcode, operand) pairs, jump operands are label numbers
+        self.consts = []
+        self.const_index = {}
+        self.call_sites = []
+        self.procedures = {}    # block_ast id -> label of the procedure body
+        self.pending = []       # procedure bodies still to be compiled
+        self.labels = 0
+
+    def generic_visit(self, node):
+        raise CompilerError(
+            error_code=ErrorCode.UNSUPPORTED_NODE,
+            message=f'{ErrorCode.UNSUPPORTED_NODE.value} -> {type(node).__name__}',
+        )
+
+    def compile(self, tree: Program) -> Bytecode:
+        self.visit(tree)
+        self.emit(Opcode.RETURN)
+
+        while self.pending:
+            label, block_ast = self.pending.pop()
+            self.emit(Opcode.LABEL, label)
+            self.visit(block_ast)
+            self.emit(Opcode.RETURN)
+
+        code = self.peephole(self.code)
+        return self.assemble(tree, code)
+
+    def peephole(self, code):
+        """ Simplifies the instruction list before assembly:
+        folds unary operators applied to numeric constants, merges a constant operand
+        into the following binary operation, retargets jumps landing on an unconditional
+        JUMP and drops jumps to the instruction that follows them
+        """
+        folded = []
+        for op, arg in code:
+            if folded and folded[-1][0] == Opcode.LOAD_CONST:
+                value = self.consts[folded[-1][1]]
+                if op in (Opcode.UNARY_NEG, Opcode.UNARY_POS) and type(value) in (int, float):
+                    folded[-1] = (Opcode.LOAD_CONST, self.const(-value if op == Opcode.UNARY_NEG else +value))
+                    continue
+                if op in _CONST_OPCODES:
+                    folded[-1] = (_CONST_OPCODES[op], folded[-1][1])
+                    continue
+            folded.append((op, arg))
+
+        targets = {}  # label -> position of the label in the list
+        for position, (op, arg) in enumerate(folded):
+            if op == Opcode.LABEL:
+                targets[arg] = position
+
+        def resolve(label):
+            seen = set()
+            while label not in seen:  # guards against jump cycles
+                seen.add(label)
+                position = targets[label]
+                while folded[position][0] == Opcode.LABEL:
+                    position += 1
+                op, arg = folded[position]
+                if op != Opcode.JUMP:
+                    break
+                label = arg
+            return label
+
+        threaded = [(op, resolve(arg) if op in _JUMPS else arg) for op, arg in folded]
+
+        optimized = []
+        for position, (op, arg) in enumerate(threaded):
+            if op == Opcode.JUMP and _jumps_to_next(threaded, position, arg):
+                continue
+            optimized.append((op, arg))
+        return optimized
+
+    def assemble(self, tree, code) -> Bytecode:
+        positions = {}
+        pc = 0
+        for op, arg in code:
+            if op == Opcode.LABEL:
+                positions[arg] = pc
+            else:
+                pc += 1
+
+        ops = array('B')
+        args = array('i')
+        for op, arg in code:
+            if op == Opcode.LABEL:
+                continue
+            if op in _JUMPS:
+                arg = positions[arg]
+            ops.append(op)
+            args.append(arg)
+
+        for call_site in self.call_sites:
+            call_site.entry = positions[call_site.entry]
+
+        return Bytecode(tree.name, tree.slot_names, tree.scope_levels, ops, args, self.consts, self.call_sites)
+
+    def emit(self, op, arg=0):
+        self.code.append((op, arg))
+
+    def new_label(self):
+        self.labels += 1
+        return self.labels
+
+    def const(self, value):
+        key = (type(value), value)
+        index = self.const_index.get(key)
+        if index is None:
+            index = len(self.consts)
+            self.consts.append(value)
+            self.const_index[key] = index
+        return index
+
+    # Statements
+
+    def visit_Program(self, node):
+        self.visit(node.block)
+
+    def visit_Block(self, node):
+        for declaration in node.declarations:
+            self.visit(declaration)
+        self.visit(node.compound_statement)
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_NoOp(self, node):
+        pass
+
+    def visit_VarDecl(self, node):
+        if hasattr(node.type_node, 'low_range'):
+            type_node = node.type_node
+            declaration = (node.var_node.slot, type_node.low_range, type_node.high_range, type_node.token.value,
+                           type_node.path)
+            self.emit(Opcode.DECLARE_ARRAY, self.const(declaration))
+
+    def visit_ProcedureDecl(self, node):
+        pass
+
+    def visit_Setlength(self, node):
+        var_node = node.var_node
+        self.emit(Opcode.SET_LENGTH, self.const((var_node.scope_distance, var_node.slot, node.length_node.value)))
+
+    def visit_Assign(self, node):
+        left = node.left
+        self.visit(node.right)
+        if hasattr(left, 'index'):
+            if left.scope_distance:
+                self.load_outer(left)
+                self.visit(left.index)
+                self.emit(Opcode.SET_ITEM)
+            else:
+                self.visit(left.index)
+                self.emit(Opcode.STORE_INDEX, left.slot)
+        elif left.scope_distance:
+            self.emit(Opcode.STORE_OUTER, self.const((left.scope_distance, left.slot)))
+        else:
+            self.emit(Opcode.STORE_VAR, left.slot)
+
+    def load_outer(self, node):
+        self.emit(Opcode.LOAD_OUTER, self.const((node.scope_distance, node.slot)))
+
+    def visit_Condition(self, node):
+        else_label = self.new_label()
+        self.visit(node.condition_node)
+        self.emit(Opcode.JUMP_IF_NOT_TRUE, else_label)
+        self.visit(node.then_node)
+
+        if node.else_node is None:
+            self.emit(Opcode.LABEL, else_label)
+        else:
+            end_label = self.new_label()
+            self.emit(Opcode.JUMP, end_label)
+            self.emit(Opcode.LABEL, else_label)
+            self.visit(node.else_node)
+            self.emit(Opcode.LABEL, end_label)
+
+    def visit_While(self, node):
+        start_label = self.new_label()
+        end_label = self.new_label()
+        self.emit(Opcode.LABEL, start_label)
+        self.visit(node.condition_node)
+        self.emit(Opcode.JUMP_IF_NOT_TRUE, end_label)
+        self.visit(node.do_node)
+        self.emit(Opcode.JUMP, start_label)
+        self.emit(Opcode.LABEL, end_label)
+
+    def visit_Repeat(self, node):
+        start_label = self.new_label()
+        self.emit(Opcode.LABEL, start_label)
+        self.visit(node.repeat_node)
+        self.visit(node.condition_node)
+        self.emit(Opcode.JUMP_IF_FALSE, start_label)
+
+    def visit_Do(self, node):
+        self.visit(node.child)
+
+    def visit_Then(self, node):
+        self.visit(node.child)
+
+    def visit_Else(self, node):
+        self.visit(node.child)
+
+    def unsupported_file(self, node):
+        # Text files are not compiled, their programs run in the tree walking interpreter
+        raise CompilerError(
+            error_code=ErrorCode.UNSUPPORTED_NODE,
+            message=f'{ErrorCode.UNSUPPORTED_NODE.value} -> {type(node).__name__} with a file',
+        )
+
+    def visit_Writeln(self, node):
+        if node.has_file:
+            self.unsupported_file(node)
+        for subnode in node.node_list:
+            self.visit(subnode)
+        self.emit(Opcode.WRITELN, len(node.node_list))
+
+    def visit_Readln(self, node):
+        if node.has_file:
+            self.unsupported_file(node)
+        # Array elements are read as the element type of the array
+        for subnode, read_type in zip(node.node_list, node.read_types):
+            if subnode.token.type == TokenType.STRING:
+                self.emit(Opcode.PRINT_CONST, self.const(subnode.value))
+            elif hasattr(subnode, 'index'):
+                if subnode.scope_distance:
+                    self.load_outer(subnode)
+                    self.visit(subnode.index)
+                    self.emit(Opcode.READ_ITEM)
+                else:
+                    self.visit(subnode.index)
+                    self.emit(Opcode.READ_INDEX, subnode.slot)
+            elif read_type == READ_ARRAY:
+                self.emit(Opcode.READ_ARRAY, self.const((subnode.scope_distance, subnode.slot)))
+            elif subnode.scope_distance:
+                self.emit(Opcode.READ_OUTER, self.const((subnode.scope_distance, subnode.slot, read_type)))
+            else:
+                self.emit(Opcode.READ_VAR, self.const((subnode.slot, read_type)))
+
+    def visit_ProcedureCall(self, node):
+        proc_symbol = node.proc_symbol
+        if proc_symbol is None:
+            raise CompilerError(
+                error_code=ErrorCode.ID_NOT_FOUND,
+                token=node.token,
+                message=f'{ErrorCode.ID_NOT_FOUND.value} -> {node.token}',
+            )
+
+        # Like the interpreter, only the arguments matched by a formal parameter are evaluated
+        params = []
+        for param_symbol, argument_node in zip(proc_symbol.formal_params, node.actual_params):
+            self.visit(argument_node)
+            params.append(param_symbol.slot)
+
+        key = id(proc_symbol.block_ast)
+        label = self.procedures.get(key)
+        if label is None:
+            label = self.new_label()
+            self.procedures[key] = label
+            self.pending.append((label, proc_symbol.block_ast))
+
+        call_site = CallSite(
+            node.proc_name, tuple(params), proc_symbol.slot_names, proc_symbol.scope_level + 1, entry=label,
+        )
+        self.call_sites.append(call_site)
+        self.emit(Opcode.CALL, len(self.call_sites) - 1)
+
+    # Expressions
+
+    def visit_BinOp(self, node):
+        op = node.op.type
+        self.visit(node.left)
+
+        if op == TokenType.AND or op == TokenType.OR:
+            end_label = self.new_label()
+            jump = Opcode.JUMP_IF_FALSY_OR_POP if op == TokenType.AND else Opcode.JUMP_IF_TRUTHY_OR_POP
+            self.emit(jump, end_label)
+            self.visit(node.right)
+            self.emit(Opcode.LABEL, end_label)
+            return
+
+        self.visit(node.right)
+        self.emit(_BINARY_OPCODES[op])
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+        self.emit(_UNARY_OPCODES[node.op.type])
+
+    def visit_Num(self, node):
+        self.emit(Opcode.LOAD_CONST, self.const(node.value))
+
+    def visit_Boolean(self, node):
+        self.emit(Opcode.LOAD_CONST, self.const(node.value))
+
+    def visit_String(self, node):
+        self.emit(Opcode.LOAD_CONST, self.const(node.value))
+
+    def visit_Var(self, node):
+        if node.token.type is TokenType.STRING:  # Used by the print function
+            self.emit(Opcode.LOAD_CONST, self.const(node.value))
+        elif node.scope_distance:
+            self.load_outer(node)
+        else:
+            self.emit(Opcode.LOAD_VAR, node.slot)
+
+    def visit_IndexVar(self, node):
+        if node.scope_distance:
+            self.load_outer(node)
+            self.visit(node.index)
+            self.emit(Opcode.GET_ITEM)
+        else:
+            self.visit(node.index)
+            self.emit(Opcode.LOAD_INDEX, node.slot)
+
+
+def _jumps_to_next(code, position, label):
+    # True when only labels separate the jump at 'position' from its target
+    position += 1
+    while position < len(code) and code[position][0] == Opcode.LABEL:
+        if code[position][1] == label:
+            return True
+        position += 1
+    return False
@@ -0,0 +1,255 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+
+
+###################
+#  DISK CACHES    #
+###################
+
+# Modules whose code shapes the analysed tree, their source is part of the AST cache keys:
+# the front end and every module it imports
+FRONT_END_MODULES = ('Token.py', 'Lexer.py', 'Nodes.py', 'Parser.py', 'SemanticAnalysis.py', 'Optimizer.py',
+                     'Cache.py', 'Errors.py', 'Trace.py', 'Input.py', 'ConstraintDict.py')
+
+FILE_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+_versions = {}
+
+
+def interpreter_version(modules=None):
+    """ Digest of the sources of modules (all the interpreter modules by default),
+    entries cached by another version of them are never loaded """
+    if modules is None:
+        modules = tuple(sorted(name for name in os.listdir(_SOURCE_DIRECTORY) if name.endswith('.py')))
+    if modules not in _versions:
+        digest = hashlib.sha256()
+        for module in modules:
+            with open(os.path.join(_SOURCE_DIRECTORY, module), 'rb') as f:
+                digest.update(f.read())
+        _versions[modules] = digest.hexdigest()
+    return _versions[modules]
+
+
+def source_digest(source):
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    return hashlib.sha256(source).hexdigest()
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_directory():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'pascal-interpreter')
+
+
+class DiskCache(ABC):
+    """ Directory of entries with a size bound and least recently used eviction.
+
+    Keys are digests of the source, the interpreter version and options. Loading an
+    entry refreshes the modification time of its file; when the directory grows past
+    max_bytes the least recently used entries are removed. Entries are written to a
+    temporary file and renamed, so concurrent runs never read a partial entry.
+    Subclasses define the suffix of their files, read() and write().
+    """
+
+    suffix = None
+    modules = None  # modules of the interpreter version, None for all of them
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = default_directory() if directory is None else directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def key(self, digest, *options):
+        key = hashlib.sha256(interpreter_version(self.modules).encode())
+        key.update(digest.encode())
+        key.update(repr(options).encode())
+        return key.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    @abstractmethod
+    def read(self, f):
+        pass
+
+    @abstractmethod
+    def write(self, f, value):
+        pass
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = self.read(f)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            # Truncated or unreadable entry, it is rebuilt
+            logging.warning(f"Removing the unreadable cache entry {path}: {e}")
+            self.misses += 1
+            self.remove(path)
+            return None
+        self.hits += 1
+        logging.info(f"Loaded the cache entry {path}")
+        return value
+
+    def store(self, key, value):
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.write(f, value)
+            os.replace(temporary, self.path(key))
+        except (pickle.PicklingError, RecursionError, OSError) as e:
+            logging.warning(f"The cache entry could not be stored: {e}")
+            self.remove(temporary)
+            return
+        self.stores += 1
+        self.evict()
+
+    def entries(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(self.suffix):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # removed by another process
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            logging.info(f"Evicting the cache entry {path}")
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self.remove(path)
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def statistics(self):
+        return dict(hits=self.hits, misses=self.misses, stores=self.stores, bytes=self.size())
+
+    def report(self):
+        statistics = ', '.join(f'{value} {name}' for name, value in self.statistics().items())
+        return f'{type(self).__name__} {self.directory}: {statistics}'
+
+
+class ASTCache(DiskCache):
+    """ Analysed (and optimized) ASTs, pickled with their symbols.
+
+    A hit replaces lexing, parsing, analysis and optimization by one load. Pickles
+    run code when loaded: the directory must only be writable by its user.
+    """
+
+    suffix = '.ast'
+    modules = FRONT_END_MODULES
+
+    def read(self, f):
+        return pickle.load(f)
+
+    def write(self, f, tree):
+        pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class OutputCache(DiskCache):
+    """ Complete output of the programs without readln, replayed instead of running them.
+
+    Such a program only depends on its source, so its output is stored under the
+    digest of the source and the version of every interpreter module. Runs ending
+    with an error or sys.exit are not stored. With bypass the programs are run
+    anyway (their output is stored again), for benchmarks.
+    """
+
+    suffix = '.out'
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, bypass=False):
+        super().__init__(directory, max_bytes)
+        self.bypass = bypass
+        self.bypasses = 0
+
+    def read(self, f):
+        return f.read().decode('utf-8')
+
+    def write(self, f, output):
+        f.write(output.encode('utf-8'))
+
+    def replay(self, key):
+        """ Writes the stored output of key, returns False when the program must run """
+        if self.bypass:
+            self.bypasses += 1
+            return False
+        output = self.load(key)
+        if output is None:
+            return False
+        sys.stdout.write(output)
+        return True
+
+    @contextmanager
+    def recording(self, key):
+        # Everything printed while the program runs is stored if it ends normally
+        stdout = sys.stdout
+        tee = _Tee(stdout)
+        sys.stdout = tee
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+        self.store(key, ''.join(tee.parts))
+
+    def statistics(self):
+        statistics = super().statistics()
+        statistics['bypasses'] = self.bypasses
+        return statistics
+
+
+class _Tee(object):
+    # Stream writing to another stream and keeping a copy
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
@@ -0,0 +1,485 @@
+from Interpreter import Interpreter
+from Errors import ErrorCode, CompilerError
+from Token import TokenType
+from Stack import Frame, ARType
+from Nodes import Num
+from Input import READ_ARRAY
+from Files import TextFile, close_files
+from Trace import tracer, FRAME
+from src.ConstraintDict import CDict
+
+
+##########################
+#  CLOSURE COMPILER      #
+##########################
+
+# Every factory takes the compiled operands and returns a closure evaluating the
+# operation on a frame, so the operator is resolved once at compile time instead
+# of on every evaluation like in Interpreter.visit_BinOp
+
+_BINARY_OPS = {
+    TokenType.PLUS:        lambda left, right: lambda ar: left(ar) + right(ar),
+    TokenType.MINUS:       lambda left, right: lambda ar: left(ar) - right(ar),
+    TokenType.MUL:         lambda left, right: lambda ar: left(ar) * right(ar),
+    TokenType.INTEGER_DIV: lambda left, right: lambda ar: left(ar) // right(ar),
+    TokenType.FLOAT_DIV:   lambda left, right: lambda ar: float(left(ar)) / float(right(ar)),
+    TokenType.AND:         lambda left, right: lambda ar: left(ar) and right(ar),
+    TokenType.OR:          lambda left, right: lambda ar: left(ar) or right(ar),
+    TokenType.EQUAL:       lambda left, right: lambda ar: left(ar) == right(ar),
+    TokenType.NOT_EQ:      lambda left, right: lambda ar: left(ar) != right(ar),
+    TokenType.LESSER:      lambda left, right: lambda ar: left(ar) < right(ar),
+    TokenType.GREATER:     lambda left, right: lambda ar: left(ar) > right(ar),
+    TokenType.LESS_EQ:     lambda left, right: lambda ar: left(ar) <= right(ar),
+    TokenType.GREAT_EQ:    lambda left, right: lambda ar: left(ar) >= right(ar),
+}
+
+# Same operations with a literal right operand, the most common shape in loops (i := i + 1, i < 10)
+_BINARY_CONST_OPS = {
+    TokenType.PLUS:        lambda left, value: lambda ar: left(ar) + value,
+    TokenType.MINUS:       lambda left, value: lambda ar: left(ar) - value,
+    TokenType.MUL:         lambda left, value: lambda ar: left(ar) * value,
+    TokenType.INTEGER_DIV: lambda left, value: lambda ar: left(ar) // value,
+    TokenType.EQUAL:       lambda left, value: lambda ar: left(ar) == value,
+    TokenType.NOT_EQ:      lambda left, value: lambda ar: left(ar) != value,
+    TokenType.LESSER:      lambda left, value: lambda ar: left(ar) < value,
+    TokenType.GREATER:     lambda left, value: lambda ar: left(ar) > value,
+    TokenType.LESS_EQ:     lambda left, value: lambda ar: left(ar) <= value,
+    TokenType.GREAT_EQ:    lambda left, value: lambda ar: left(ar) >= value,
+}
+
+_UNARY_OPS = {
+    TokenType.PLUS:  lambda expr: lambda ar: +expr(ar),
+    TokenType.MINUS: lambda expr: lambda ar: -expr(ar),
+    TokenType.NOT:   lambda expr: lambda ar: not expr(ar),
+}
+
+# File procedures taking only the file, Assign also takes the name
+_FILE_PROCEDURES = {
+    TokenType.RESET:   TextFile.reset,
+    TokenType.REWRITE: TextFile.rewrite,
+    TokenType.CLOSE:   TextFile.close,
+}
+
+
+class ClosureCompiler(Interpreter):
+    """ Execution engine that compiles the analysed AST once into a tree of closures.
+
+    Every node becomes a Python closure taking the current Frame, with operators and
+    child nodes already bound, so running the program involves no per-node method
+    lookup. The semantics are the same as the tree walking Interpreter.
+    """
+
+    def __init__(self, tree, output=None, input=None):
+        super().__init__(tree, output, input)
+        self.procedures = {}  # block_ast id -> one element list holding the compiled body
+        self.program = None
+
+    def compile(self, node):
+        method_name = 'compile_' + type(node).__name__
+        compiler = getattr(self, method_name, self.generic_compile)
+        return compiler(node)
+
+    def generic_compile(self, node):
+        raise CompilerError(
+            error_code=ErrorCode.UNSUPPORTED_NODE,
+            message=f'{ErrorCode.UNSUPPORTED_NODE.value} -> {type(node).__name__}',
+        )
+
+    # Statements
+
+    def compile_Program(self, node):
+        program_name = node.name
+        slot_names = node.slot_names
+        scope_levels = node.scope_levels
+        block = self.compile(node.block)
+        call_stack = self.call_stack
+        display = self.display
+
+        def program():
+            ar = Frame(
+                name=program_name,
+                type=ARType.PROGRAM,
+                nesting_level=1,
+                slot_names=slot_names,
+            )
+            call_stack.push(ar)
+            display[:] = [None] * (scope_levels + 1)
+            display[ar.nesting_level] = ar
+            if tracer.frame:
+                tracer.record(FRAME, 'push', program_name, 1, 1)
+            block(ar)
+            if tracer.frame:
+                tracer.record(FRAME, 'pop', program_name, 1, 1)
+            call_stack.pop()
+
+        return program
+
+    def compile_Block(self, node):
+        statements = [self.compile(declaration) for declaration in node.declarations]
+        statements.append(self.compile(node.compound_statement))
+        return self._sequence(statements)
+
+    def compile_Compound(self, node):
+        return self._sequence([self.compile(child) for child in node.children])
+
+    @staticmethod
+    def _sequence(statements):
+        statements = tuple(statement for statement in statements if statement is not None)
+
+        if not statements:
+            return lambda ar: None
+        if len(statements) == 1:
+            return statements[0]
+
+        def sequence(ar):
+            for statement in statements:
+                statement(ar)
+
+        return sequence
+
+    def compile_NoOp(self, node):
+        return None
+
+    def compile_VarDecl(self, node):
+        if not hasattr(node.type_node, 'low_range'):
+            if node.type_node.value == 'TEXT':
+                return self._compile_file_declaration(node)
+            return None
+
+        slot = node.var_node.slot
+        min_range = node.type_node.low_range
+        max_range = node.type_node.high_range
+        element_type = node.type_node.token.value
+
+        if node.type_node.path is not None:
+            path = node.type_node.path
+            mapped_array = self.mapped_array
+
+            def declare_mapped(ar):
+                ar.slots[slot] = mapped_array(path, min_range, max_range, element_type)
+
+            return declare_mapped
+
+        def declare(ar):
+            ar.slots[slot] = CDict(min_range, max_range, element_type)
+
+        return declare
+
+    def _compile_file_declaration(self, node):
+        slot = node.var_node.slot
+        open_files = self.open_files
+
+        def declare_file(ar):
+            ar.slots[slot] = TextFile(open_files)
+
+        return declare_file
+
+    def compile_ProcedureDecl(self, node):
+        return None
+
+    def compile_Setlength(self, node):
+        slot = node.var_node.slot
+        length = node.length_node.value
+        frame = self._frame_of(node.var_node)
+
+        def set_length(ar):
+            frame(ar).slots[slot].set_length(length)
+
+        return set_length
+
+    def compile_Assign(self, node):
+        slot = node.left.slot
+        distance = node.left.scope_distance
+        display = self.display
+        right = self.compile(node.right)
+
+        if hasattr(node.left, 'index'):
+            index = self.compile(node.left.index)
+            frame = self._frame_of(node.left)
+
+            def assign_index(ar):
+                var_value = right(ar)
+                var_index = index(ar)
+                frame(ar).slots[slot].add(var_index, var_value)
+
+            return assign_index
+
+        if distance:
+            def assign_outer(ar):
+                var_value = right(ar)
+                display[ar.nesting_level - distance].slots[slot] = var_value
+
+            return assign_outer
+
+        def assign(ar):
+            ar.slots[slot] = right(ar)
+
+        return assign
+
+    def compile_Condition(self, node):
+        condition = self.compile(node.condition_node)
+        then_branch = self.compile(node.then_node) or (lambda ar: None)
+
+        if node.else_node is None:
+            def condition_then(ar):
+                if condition(ar) is True:
+                    then_branch(ar)
+
+            return condition_then
+
+        else_branch = self.compile(node.else_node) or (lambda ar: None)
+
+        def condition_then_else(ar):
+            if condition(ar) is True:
+                then_branch(ar)
+            else:
+                else_branch(ar)
+
+        return condition_then_else
+
+    def compile_While(self, node):
+        condition = self.compile(node.condition_node)
+        body = self.compile(node.do_node) or (lambda ar: None)
+
+        def while_loop(ar):
+            while condition(ar) is True:
+                body(ar)
+
+        return while_loop
+
+    def compile_Repeat(self, node):
+        body = self.compile(node.repeat_node) or (lambda ar: None)
+        condition = self.compile(node.condition_node)
+
+        def repeat_loop(ar):
+            body(ar)
+            while condition(ar) is False:
+                body(ar)
+
+        return repeat_loop
+
+    # Do, Then and Else only wrap a statement, the wrapper disappears once compiled
+
+    def compile_Do(self, node):
+        return self.compile(node.child)
+
+    def compile_Then(self, node):
+        return self.compile(node.child)
+
+    def compile_Else(self, node):
+        return self.compile(node.child)
+
+    def compile_Writeln(self, node):
+        if node.has_file:
+            return self._compile_file_writeln(node)
+
+        values = tuple(self.compile(subnode) for subnode in node.node_list)
+        write = self.output.write
+        newline = self.output.newline
+
+        def writeln(ar):
+            for value in values:
+                write(str(value(ar)))
+            newline()
+
+        return writeln
+
+    def _compile_file_writeln(self, node):
+        text_file = self.compile(node.node_list[0])
+        values = tuple(self.compile(subnode) for subnode in node.node_list[1:])
+
+        def writeln_file(ar):
+            output = text_file(ar).writing()
+            write = output.write
+            for value in values:
+                write(str(value(ar)))
+            output.newline()
+
+        return writeln_file
+
+    def compile_Readln(self, node):
+        node_list = node.node_list
+        read_types = node.read_types
+        text_file = None
+        if node.has_file:
+            text_file = self.compile(node_list[0])
+            node_list = node_list[1:]
+            read_types = read_types[1:]
+
+        targets = []
+        for subnode, read_type in zip(node_list, read_types):
+            if subnode.token.type == TokenType.STRING:
+                targets.append((subnode.value, None, None, None, None))
+            elif hasattr(subnode, 'index'):
+                targets.append((None, self._frame_of(subnode), subnode.slot, self.compile(subnode.index), read_type))
+            else:
+                targets.append((None, self._frame_of(subnode), subnode.slot, None, read_type))
+
+        write = self.output.write
+        console = self.input
+
+        def readln(ar):
+            input = console if text_file is None else text_file(ar).reading()
+            read = input.read
+            for prompt, frame, slot, index, read_type in targets:
+                if prompt is not None:
+                    write(prompt)
+                elif index is not None:
+                    var_index = index(ar)
+                    frame(ar).slots[slot].add(var_index, read(read_type))
+                elif read_type == READ_ARRAY:
+                    input.fill(frame(ar).slots[slot])
+                else:
+                    frame(ar).slots[slot] = read(read_type)
+
+        return readln
+
+    def compile_FileProcedure(self, node):
+        text_file = self.compile(node.var_node)
+        if node.token.type == TokenType.ASSIGN_FILE:
+            name = self.compile(node.name_node)
+            return lambda ar: text_file(ar).assign(name(ar))
+        procedure = _FILE_PROCEDURES[node.token.type]
+        return lambda ar: procedure(text_file(ar))
+
+    def compile_ProcedureCall(self, node):
+        proc_name = node.proc_name
+        proc_symbol = node.proc_symbol
+        if proc_symbol is None:
+            raise CompilerError(
+                error_code=ErrorCode.ID_NOT_FOUND,
+                token=node.token,
+                message=f'{ErrorCode.ID_NOT_FOUND.value} -> {node.token}',
+            )
+
+        nesting_level = proc_symbol.scope_level + 1
+        slot_names = proc_symbol.slot_names
+        arguments = tuple(
+            (param_symbol.slot, self.compile(argument_node))
+            for param_symbol, argument_node in zip(proc_symbol.formal_params, node.actual_params)
+        )
+        body = self._compile_procedure(proc_symbol)
+        call_stack = self.call_stack
+        display = self.display
+
+        def call(ar):
+            frame = Frame(
+                name=proc_name,
+                type=ARType.PROCEDURE,
+                nesting_level=nesting_level,
+                slot_names=slot_names,
+            )
+            slots = frame.slots
+            for slot, argument in arguments:
+                slots[slot] = argument(ar)
+
+            call_stack.push(frame)
+            enclosing_frame = display[nesting_level]
+            display[nesting_level] = frame
+            body[0](frame)
+            display[nesting_level] = enclosing_frame
+            call_stack.pop()
+
+        if not tracer.frame:
+            return call
+
+        # Chosen at compile time, calls compiled without tracing do not test the flag
+        frames = call_stack.frames
+        record = tracer.record
+
+        def traced_call(ar):
+            record(FRAME, 'push', proc_name, nesting_level, len(frames) + 1)
+            call(ar)
+            record(FRAME, 'pop', proc_name, nesting_level, len(frames) + 1)
+
+        return traced_call
+
+    def _compile_procedure(self, proc_symbol):
+        # The body is shared by all the call sites; the cell is registered before compiling
+        # so that recursive calls inside the body find it
+        key = id(proc_symbol.block_ast)
+        body = self.procedures.get(key)
+        if body is None:
+            body = [None]
+            self.procedures[key] = body
+            body[0] = self.compile(proc_symbol.block_ast)
+        return body
+
+    # Expressions
+
+    def compile_BinOp(self, node):
+        op = node.op.type
+        left = self.compile(node.left)
+
+        if isinstance(node.right, Num) and op in _BINARY_CONST_OPS:
+            return _BINARY_CONST_OPS[op](left, node.right.value)
+
+        right = self.compile(node.right)
+        return _BINARY_OPS[op](left, right)
+
+    def compile_UnaryOp(self, node):
+        return _UNARY_OPS[node.op.type](self.compile(node.expr))
+
+    def compile_Num(self, node):
+        value = node.value
+        return lambda ar: value
+
+    def compile_Boolean(self, node):
+        value = node.value
+        return lambda ar: value
+
+    def compile_String(self, node):
+        value = node.value
+        return lambda ar: value
+
+    def compile_Var(self, node):
+        if node.token.type is TokenType.STRING:  # Used by the print function
+            value = node.value
+            return lambda ar: value
+
+        slot = node.slot
+        distance = node.scope_distance
+        if distance:
+            display = self.display
+            return lambda ar: display[ar.nesting_level - distance].slots[slot]
+        return lambda ar: ar.slots[slot]
+
+    def compile_Eof(self, node):
+        text_file = self.compile(node.var_node)
+        return lambda ar: text_file(ar).eof()
+
+    def compile_IndexVar(self, node):
+        slot = node.slot
+        distance = node.scope_distance
+        index = self.compile(node.index)
+        if distance:
+            display = self.display
+
+            def index_outer(ar):
+                var_index = index(ar)
+                return display[ar.nesting_level - distance].slots[slot].get(var_index)
+
+            return index_outer
+        return lambda ar: ar.slots[slot].get(index(ar))
+
+    def _frame_of(self, node):
+        # Returns a function finding the frame that holds the variable referenced by node
+        distance = node.scope_distance
+        if not distance:
+            return lambda ar: ar
+        display = self.display
+        return lambda ar: display[ar.nesting_level - distance]
+
+    def prepare(self):
+        if self.program is None and self.tree is not None:
+            self.program = self.compile(self.tree)
+
+    def interpret(self):
+        if self.tree is None:
+            return ''
+        self.prepare()
+        try:
+            return self.program()
+        finally:
+            close_files(self.open_files)
+            self.output.flush()
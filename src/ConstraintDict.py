@@ -1,48 +1,226 @@
 # Used to represent static arrays in the stack
+from array import array
+import mmap
+import os
 import sys
 import logging
 
 
+# Storage of the element types: array typecode (None for a list) and value of a new element
+ELEMENT_STORAGE = {
+    'INTEGER': ('q', 0),
+    'REAL': ('d', 0.0),
+    'BOOL': (None, False),
+    'STRING': (None, ''),
+}
+
+_ITEM_TYPES = {'q': int, 'd': float}
+_TYPECODES = {int: 'q', float: 'd'}
+
+# Format of the elements of the arrays mapped on a file, as raw machine values
+MAPPED_TYPECODES = {
+    'INTEGER': 'q',
+    'REAL': 'd',
+    'BOOL': '?',
+}
+
+
 class CDict:
+    """ Array with bounds checking, elements are stored contiguously from min_range.
+
+    INTEGER and REAL arrays use an array.array (8 bytes per element) and only hold
+    values of their element type: INTEGER values are stored in REAL arrays as REAL,
+    other values are an error. An INTEGER array switches to a list of Python ints
+    the first time a value does not fit in 64 bits. BOOL arrays use a list as well:
+    an array('b') would give back 0 and 1 instead of False and True, converting them
+    on every read costs more than the memory saved. STRING and untyped arrays hold
+    any value in a list.
+    """
+
+    __slots__ = ('min_range', 'max_range', 'element_type', 'item_type', 'zero', 'data')
 
-    def __init__(self, min_range = 0, max_range = 0):
+    def __init__(self, min_range = 0, max_range = 0, element_type = None):
         self.min_range = min_range
         self.max_range = max_range
-        self.data = {}
+        self.element_type = element_type
+        typecode, self.zero = ELEMENT_STORAGE.get(element_type, (None, 0))
+        self.item_type = _ITEM_TYPES.get(typecode)
+        self.data = self.allocate(max(max_range - min_range + 1, 0))
+
+    def allocate(self, size):
+        if self.item_type is None:
+            return [self.zero] * size
+        return array(_TYPECODES[self.item_type], bytes(8 * size))
+
+    def pack(self, values):
+        try:
+            return array(_TYPECODES[self.item_type], values)
+        except OverflowError:
+            return list(values)
+
+    def convert(self, value):
+        if self.item_type is float and type(value) is int:
+            return float(value)
+        logging.error("Attempted to store {value!r} in an array of {type}".format(
+            value=value, type=self.element_type))
+        sys.exit()
 
     def error(self):
         print("Error: array index out of bounds")
         sys.exit()
 
+    def resize(self, min_range, max_range):
+        # Elements keep their index, the ones outside the new bounds are dropped
+        data = self.allocate(max(max_range - min_range + 1, 0))
+        if self.item_type is not None and isinstance(self.data, list):
+            data = list(data)  # the INTEGER array holds values past 64 bits
+        low = max(min_range, self.min_range)
+        high = min(max_range, self.max_range)
+        if low <= high:
+            data[low - min_range:high - min_range + 1] = self.data[low - self.min_range:high - self.min_range + 1]
+        self.min_range = min_range
+        self.max_range = max_range
+        self.data = data
+
     def reshape(self, min_range, max_range):
         if min_range < 0 or max_range < 0:
             logging.error("Array bounds are not valid")
             sys.exit()
-        self.min_range = min_range
-        self.max_range = max_range
+        self.resize(min_range, max_range)
         logging.debug("Array resized with bounds {b1}:{b2}".format(b1=min_range, b2=max_range))
 
     def set_length(self, length):
-        self.min_range = 0
-        self.max_range = length
-        if not self.data:
-            self.data = dict.fromkeys(range(length),0)
-            logging.debug("Array initialised to size {length}".format(length=length))
+        self.resize(0, length)
+        logging.debug("Array initialised to size {length}".format(length=length))
 
     def add(self, key, value):
         if self.max_range >= key >= self.min_range and isinstance(key, int):
-            self.data[key] = value
+            if self.item_type is not None and type(value) is not self.item_type:
+                value = self.convert(value)
+            try:
+                self.data[key - self.min_range] = value
+            except OverflowError:
+                logging.debug("Array of INTEGER holds values past 64 bits, stored as a list")
+                self.data = list(self.data)
+                self.data[key - self.min_range] = value
         else:
             logging.error("Attempted to assign to an array value out of bounds")
             sys.exit()
 
     def get(self, key):
         if self.max_range >= key >= self.min_range and isinstance(key, int):
-            return self.data[key]
+            return self.data[key - self.min_range]
         else:
             logging.error("Attempted to access an array value out of bounds")
             sys.exit()
 
+    def fill(self, values):
+        # Replaces every element, values holds one value per index from min_range
+        if len(values) != len(self.data):
+            logging.error("Attempted to fill an array with {count} values".format(count=len(values)))
+            sys.exit()
+        if self.item_type is None:
+            self.data = list(values)
+            return
+        item_type = self.item_type
+        self.data = self.pack([value if type(value) is item_type else self.convert(value) for value in values])
+
+    def __len__(self):
+        return len(self.data)
+
     def __str__(self):
-        return str(self.data)
+        return str(dict(zip(range(self.min_range, self.max_range + 1), self.data)))
+
+
+class MappedArray(CDict):
+    """ Array whose elements are stored in a file mapped in memory.
+
+    The file holds the elements from min_range in the format of MAPPED_TYPECODES; it
+    is created, or extended with zeros, to the size of the array and its contents are
+    the initial values of the elements. Elements are read and written through a
+    memoryview of the mapping and the OS pages the file in and out, so the array can
+    be larger than the memory. Bounds are checked like in CDict, the array cannot be
+    resized and only holds values of its element type (INTEGER values are stored in
+    REAL arrays as REAL). close() flushes the mapping to the file.
+    """
 
+    __slots__ = ('path', 'view')
+
+    def __init__(self, path, min_range, max_range, element_type):
+        self.path = path
+        self.min_range = min_range
+        self.max_range = max_range
+        self.element_type = element_type
+        self.zero = ELEMENT_STORAGE[element_type][1]
+        self.item_type = None
+        typecode = MAPPED_TYPECODES[element_type]
+        length = max(max_range - min_range + 1, 0)
+        size = length * memoryview(b'').cast(typecode).itemsize
+        if size:
+            self.view = memoryview(self.map(size))
+        else:
+            self.view = memoryview(bytearray())
+        self.data = self.view.cast(typecode)
+
+    def map(self, size):
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logging.error("Cannot map the array file {path}: {error}".format(path=self.path, error=e.strerror))
+            sys.exit()
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            return mmap.mmap(fd, size)
+        finally:
+            os.close(fd)  # the mapping keeps the file open
+
+    @property
+    def closed(self):
+        return self.view is None
+
+    def resize(self, min_range, max_range):
+        logging.error("Arrays mapped on a file cannot be resized")
+        sys.exit()
+
+    def add(self, key, value):
+        if self.max_range >= key >= self.min_range and isinstance(key, int):
+            try:
+                self.data[key - self.min_range] = value
+            except (TypeError, OverflowError):
+                logging.error("Attempted to store {value!r} in a mapped array of {type}".format(
+                    value=value, type=self.element_type))
+                sys.exit()
+        else:
+            logging.error("Attempted to assign to an array value out of bounds")
+            sys.exit()
+
+    def fill(self, values):
+        if len(values) != len(self.data):
+            logging.error("Attempted to fill an array with {count} values".format(count=len(values)))
+            sys.exit()
+        typecode = self.data.format
+        try:
+            packed = array('B' if typecode == '?' else typecode, values)
+        except (TypeError, OverflowError):
+            logging.error("Attempted to fill a mapped array of {type} with values of another type".format(
+                type=self.element_type))
+            sys.exit()
+        with self.view.cast('B') as raw:
+            raw[:] = packed.tobytes()
+
+    def close(self):
+        if self.view is None:
+            return
+        mapping = self.view.obj
+        self.data.release()
+        self.view.release()
+        self.view = None
+        if isinstance(mapping, mmap.mmap):
+            mapping.flush()
+            mapping.close()
+
+    def __str__(self):
+        # The elements may not fit in memory
+        return "<array [{low}..{high}] of {type} mapped on {path}>".format(
+            low=self.min_range, high=self.max_range, type=self.element_type, path=self.path)
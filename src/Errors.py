@@ -6,6 +6,9 @@ class ErrorCode(Enum):
     ID_NOT_FOUND     = 'Identifier not found'
     DUPLICATE_ID     = 'Duplicate id found'
     WRONG_PARAMS_NUM = 'Wrong number of arguments'
+    UNSUPPORTED_NODE = 'Unsupported node'
+    FILE_EXPECTED    = 'TEXT file variable expected'
+    UNSUPPORTED_TYPE = 'Unsupported type'
 
 
 class Error(Exception):
@@ -26,3 +29,15 @@ class ParserError(Error):
 
 class SemanticError(Error):
     pass
+
+
+class CompilerError(Error):
+    pass
+
+
+class InputError(Error):
+    pass
+
+
+class FileError(Error):
+    pass
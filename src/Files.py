@@ -0,0 +1,88 @@
+from Errors import FileError
+from Input import InputStream
+from Output import OutputStream, FLUSH_FULL
+
+
+###################
+#  TEXT FILES     #
+###################
+
+# Text files are read and written in large chunks, a data file is read in a few calls
+FILE_BUFFER_SIZE = 1024 * 1024
+
+
+class TextFile(object):
+    """ Value of a TEXT variable.
+
+    Assign gives it a path, Reset opens it for readln through an InputStream and
+    Rewrite for writeln through an OutputStream, both buffering FILE_BUFFER_SIZE
+    characters. Values are read as from the console, whitespace separated, and eof()
+    is true when no value is left. Open files are kept in open_files, a set owned
+    by the engine, which closes the files still open at the end of the program.
+    """
+
+    def __init__(self, open_files):
+        self.open_files = open_files
+        self.path = None
+        self.input = None
+        self.output = None
+
+    def error(self, message):
+        raise FileError(message=message)
+
+    def assign(self, path):
+        if self.input is not None or self.output is not None:
+            self.error(f'Assign to the open file {self.path}')
+        self.path = str(path)
+
+    def open(self, make_stream):
+        if self.path is None:
+            self.error('The file has not been assigned a name')
+        self.close()
+        try:
+            stream = make_stream(self.path)
+        except OSError as e:
+            self.error(f'Cannot open {self.path}: {e.strerror}')
+        self.open_files.add(self)
+        return stream
+
+    def reset(self):
+        self.input = self.open(lambda path: InputStream(path, chunk_size=FILE_BUFFER_SIZE))
+
+    def rewrite(self):
+        self.output = self.open(lambda path: OutputStream(path, buffer_size=FILE_BUFFER_SIZE,
+                                                          flush_policy=FLUSH_FULL))
+
+    def close(self):
+        if self.input is not None:
+            self.input.close()
+            self.input = None
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+        self.open_files.discard(self)
+
+    def reading(self):
+        # Stream of a readln from the file
+        if self.input is None:
+            self.error(f'The file {self.path} is not open for reading')
+        return self.input
+
+    def writing(self):
+        # Stream of a writeln to the file
+        if self.output is None:
+            self.error(f'The file {self.path} is not open for writing')
+        return self.output
+
+    def eof(self):
+        return self.reading().at_end()
+
+    def __str__(self):
+        return f'TEXT({self.path})'
+
+
+def close_files(open_files):
+    # Text files and arrays mapped on a file
+    for open_file in list(open_files):
+        open_file.close()
+    open_files.clear()
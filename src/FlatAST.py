@@ -0,0 +1,347 @@
+from Token import Token, TokenType, LineIndex, shared_token
+from Parser import Parser
+from array import array
+import Nodes
+import inspect
+import json
+import struct
+import sys
+
+
+#######################################
+#  FLAT (STRUCT OF ARRAYS) AST        #
+#######################################
+
+# How the constructor arguments of the Nodes classes are stored
+NODE = 'node'      # index of a child node, -1 for None
+NODES = 'nodes'    # list of child nodes, stored after the other fields
+TOKEN = 'token'    # token type and offset columns, token value in the literals
+VALUE = 'value'    # literal: name, number or range bound
+
+FIELD_KINDS = {
+    'left': NODE, 'right': NODE, 'expr': NODE, 'index': NODE, 'block': NODE,
+    'compound_statement': NODE, 'var_node': NODE, 'type_node': NODE, 'block_node': NODE,
+    'child': NODE, 'condition_node': NODE, 'then_node': NODE, 'else_node': NODE,
+    'do_node': NODE, 'repeat_node': NODE, 'length_node': NODE, 'name_node': NODE,
+    'children': NODES, 'declarations': NODES, 'formal_params': NODES, 'actual_params': NODES,
+    'node_list': NODES,
+    'token': TOKEN, 'op': TOKEN,
+    'name': VALUE, 'proc_name': VALUE, 'low_range': VALUE, 'high_range': VALUE, 'path': VALUE,
+}
+
+# Attributes set by the semantic analyzer and their value before the analysis,
+# slot and scope_distance have their own columns
+ANNOTATIONS = {'slot': None, 'scope_distance': 0, 'slot_names': None, 'scope_levels': 1, 'proc_symbol': None,
+               'read_types': None, 'has_file': False}
+
+TOKEN_TYPES = list(TokenType)
+TOKEN_TYPE_INDEX = {token_type: index for index, token_type in enumerate(TOKEN_TYPES)}
+NO_TOKEN = 255
+
+FORMAT_VERSION = 3
+MAGIC = b'PASFLAT'
+
+
+def _node_schema(node_class):
+    # Constructor arguments of a Nodes class, the list of children last
+    parameters = [
+        parameter.name for parameter in inspect.signature(node_class.__init__).parameters.values()
+        if parameter.name != 'self' and parameter.kind is parameter.POSITIONAL_OR_KEYWORD
+    ]
+    fields = tuple((name, FIELD_KINDS[name]) for name in parameters)
+    return tuple(sorted(fields, key=lambda field: field[1] == NODES)), tuple(parameters)
+
+
+# Node kinds by kind number, with their stored fields and constructor arguments
+KINDS = tuple(
+    node_class.__name__ for node_class in vars(Nodes).values()
+    if isinstance(node_class, type) and issubclass(node_class, Nodes.AST) and node_class is not Nodes.AST
+)
+SCHEMAS = {kind: _node_schema(getattr(Nodes, kind)) for kind in KINDS}
+KIND_INDEX = {kind: index for index, kind in enumerate(KINDS)}
+
+
+class FlatBuilder(object):
+    """ Node constructors for the Parser encoding the AST in parallel arrays.
+
+    Has a method per Nodes class, with the same arguments, returning the index of the
+    new node instead of an object. Children are built before their parent, so every
+    node is appended once and never changed. Literals (names, numbers, strings) are
+    stored once in a side table however often they appear.
+    """
+
+    def __init__(self):
+        self.kinds = array('B')
+        self.token_types = array('B')
+        self.offsets = array('q')
+        self.first = array('i', [0])
+        self.fields = array('i')
+        self.literals = []
+        self.literal_index = {}
+        self.lines = None
+
+    def __getattr__(self, kind):
+        if kind not in KIND_INDEX:
+            raise AttributeError(kind)
+        fields, parameters = SCHEMAS[kind]
+
+        def build(*args, **kwargs):
+            values = dict(zip(parameters, args), **kwargs)
+            return self.append(kind, fields, values)
+
+        setattr(self, kind, build)
+        return build
+
+    def literal(self, value):
+        # 1, 1.0 and True are equal but different literals
+        key = (type(value), value)
+        index = self.literal_index.get(key)
+        if index is None:
+            index = self.literal_index[key] = len(self.literals)
+            self.literals.append(value)
+        return index
+
+    def append(self, kind, fields, values):
+        token_type = NO_TOKEN
+        offset = -1
+        for name, field_kind in fields:
+            value = values.get(name)
+            if field_kind is NODE:
+                self.fields.append(-1 if value is None else value)
+            elif field_kind is NODES:
+                self.fields.extend(value or ())
+            elif field_kind is TOKEN:
+                token_type = TOKEN_TYPE_INDEX[value.type]
+                if value.offset is not None:
+                    offset = value.offset
+                    if self.lines is None:
+                        self.lines = value.lines
+                self.fields.append(self.literal(value.value))
+            else:
+                self.fields.append(self.literal(value))
+
+        self.kinds.append(KIND_INDEX[kind])
+        self.token_types.append(token_type)
+        self.offsets.append(offset)
+        self.first.append(len(self.fields))
+        return len(self.kinds) - 1
+
+    def finish(self, root):
+        return FlatAST(self.kinds, self.token_types, self.offsets, self.first, self.fields,
+                       self.literals, root, self.lines)
+
+
+class FlatAST(object):
+    """ AST stored as columns: one entry per node in kinds, token_types and offsets,
+    the fields of node i in fields[first[i]:first[i + 1]] (child node indexes and
+    literal indexes, in the order of the Nodes constructor, lists last).
+
+    A node costs a few dozen bytes whatever its kind. view(i) (and root) give
+    NodeView objects with the attributes of the Nodes classes, so NodeVisitor
+    subclasses such as SemanticAnalyzer and Interpreter walk it unchanged.
+    Views are created on access and hold no state: the annotations of the semantic
+    analysis are stored in the slots and scope_distances columns and in annotations.
+    """
+
+    def __init__(self, kinds, token_types, offsets, first, fields, literals, root, lines=None):
+        self.kinds = kinds
+        self.token_types = token_types
+        self.offsets = offsets
+        self.first = first
+        self.fields = fields
+        self.literals = literals
+        self.root_index = root
+        self.lines = lines
+        self.slots = array('i', [-1]) * len(kinds)
+        self.scope_distances = array('i', [0]) * len(kinds)
+        self.annotations = {}  # (node index, name): value
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def root(self):
+        return self.view(self.root_index)
+
+    def view(self, index):
+        if index < 0:
+            return None
+        return VIEW_CLASSES[self.kinds[index]](self, index)
+
+    def token(self, index, literal):
+        token_type = TOKEN_TYPES[self.token_types[index]]
+        offset = self.offsets[index]
+        if offset < 0:
+            return shared_token(token_type)
+        return Token(token_type, self.literals[literal], offset, self.lines)
+
+    def nbytes(self):
+        """ Size of the columns in bytes, the literals excluded """
+        columns = (self.kinds, self.token_types, self.offsets, self.first, self.fields,
+                   self.slots, self.scope_distances)
+        return sum(len(column) * column.itemsize for column in columns)
+
+    # Serialization: a JSON header (literals, column lengths and line starts) followed
+    # by the raw bytes of the syntax columns. Analysis annotations are not saved.
+
+    COLUMNS = ('kinds', 'token_types', 'offsets', 'first', 'fields')
+
+    def dumps(self) -> bytes:
+        columns = [getattr(self, name) for name in self.COLUMNS]
+        lines = self.lines.starts if self.lines is not None else None
+        header = json.dumps({
+            'version': FORMAT_VERSION,
+            'byteorder': sys.byteorder,
+            'root': self.root_index,
+            'literals': self.literals,
+            'columns': [[column.typecode, len(column)] for column in columns],
+            'lines': None if lines is None else len(lines),
+        }).encode()
+        parts = [MAGIC, struct.pack('<Q', len(header)), header]
+        parts.extend(column.tobytes() for column in columns)
+        if lines is not None:
+            parts.append(lines.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def loads(cls, data: bytes):
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a flat AST')
+        position = len(MAGIC) + 8
+        header_length, = struct.unpack('<Q', data[len(MAGIC):position])
+        header = json.loads(data[position:position + header_length])
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError(f"Flat AST format version {header['version']} is not supported")
+        position += header_length
+
+        def read(typecode, length):
+            nonlocal position
+            column = array(typecode)
+            size = length * column.itemsize
+            column.frombytes(data[position:position + size])
+            position += size
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+            return column
+
+        columns = [read(typecode, length) for typecode, length in header['columns']]
+        lines = None
+        if header['lines'] is not None:
+            lines = LineIndex('')
+            lines.starts = read('q', header['lines'])
+        return cls(*columns, header['literals'], header['root'], lines)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.loads(f.read())
+
+
+def parse(lexer) -> FlatAST:
+    """ Parses the tokens of lexer into a FlatAST, no Nodes object is created """
+    builder = FlatBuilder()
+    root = Parser(lexer, nodes=builder).parse()
+    return builder.finish(root)
+
+
+###################
+#  VIEWS          #
+###################
+
+
+class NodeView(object):
+    """ Node index of a FlatAST with the attributes of the matching Nodes class """
+
+    __slots__ = ('ast', 'node_index')  # not 'index', a field of IndexVar
+
+    def __init__(self, ast, node_index):
+        self.ast = ast
+        self.node_index = node_index
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.ast is self.ast and other.node_index == self.node_index
+
+    def __hash__(self):
+        return hash(self.node_index)
+
+    def __repr__(self):
+        return f'<{type(self).__name__} view of node {self.node_index}>'
+
+
+def _node_property(position):
+    def get(self):
+        ast = self.ast
+        return ast.view(ast.fields[ast.first[self.node_index] + position])
+    return property(get)
+
+
+def _nodes_property(position):
+    def get(self):
+        ast = self.ast
+        index = self.node_index
+        return [ast.view(child) for child in ast.fields[ast.first[index] + position:ast.first[index + 1]]]
+    return property(get)
+
+
+def _token_property(position):
+    def get(self):
+        ast = self.ast
+        return ast.token(self.node_index, ast.fields[ast.first[self.node_index] + position])
+    return property(get)
+
+
+def _literal_property(position, convert=None):
+    def get(self):
+        ast = self.ast
+        value = ast.literals[ast.fields[ast.first[self.node_index] + position]]
+        return value if convert is None else convert(value)
+    return property(get)
+
+
+def _column_property(column, default):
+    def get(self):
+        value = getattr(self.ast, column)[self.node_index]
+        return default if value == -1 else value
+
+    def set(self, value):
+        getattr(self.ast, column)[self.node_index] = -1 if value is None else value
+    return property(get, set)
+
+
+def _annotation_property(name, default):
+    def get(self):
+        return self.ast.annotations.get((self.node_index, name), default)
+
+    def set(self, value):
+        self.ast.annotations[(self.node_index, name)] = value
+    return property(get, set)
+
+
+_FIELD_PROPERTIES = {NODE: _node_property, NODES: _nodes_property, TOKEN: _token_property, VALUE: _literal_property}
+
+
+def _view_class(kind):
+    fields, _ = SCHEMAS[kind]
+    namespace = {'__slots__': ()}
+    for position, (name, field_kind) in enumerate(fields):
+        namespace[name] = _FIELD_PROPERTIES[field_kind](position)
+        if name == 'token' and 'value' in getattr(Nodes, kind).__slots__:
+            # value is a copy of the token value
+            convert = (lambda value: value == 'TRUE') if kind == 'Boolean' else None
+            namespace['value'] = _literal_property(position, convert)
+    for name in getattr(Nodes, kind).__slots__:
+        if name == 'slot':
+            namespace[name] = _column_property('slots', None)
+        elif name == 'scope_distance':
+            namespace[name] = _column_property('scope_distances', 0)
+        elif name in ANNOTATIONS:
+            namespace[name] = _annotation_property(name, ANNOTATIONS[name])
+    # Same name as the node class, NodeVisitor dispatches on the class name
+    return type(kind, (NodeView,), namespace)
+
+
+VIEW_CLASSES = [_view_class(kind) for kind in KINDS]
@@ -0,0 +1,187 @@
+from Errors import InputError
+import codecs
+import os
+import re
+import sys
+
+
+###################
+#  INPUT          #
+###################
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Read type of a readln target that is a whole array, filled in one pass
+READ_ARRAY = 'ARRAY'
+
+_VALUE = re.compile(r'\S+')
+_NON_SPACE = re.compile(r'\S')
+
+
+def _boolean(text):
+    value = text.upper()
+    if value not in ('TRUE', 'FALSE'):
+        raise ValueError(text)
+    return value == 'TRUE'
+
+
+# Conversion of a value read into a variable of each type, untyped targets read REAL values
+CONVERSIONS = {
+    'INTEGER': int,
+    'REAL': float,
+    'BOOL': _boolean,
+}
+
+
+class StdinSource(object):
+    # Reads what is available on stdin (a line on a terminal), never waits for a full chunk
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self, size):
+        stdin = sys.stdin
+        if not hasattr(stdin, 'buffer'):
+            return stdin.read(size)  # replaced by a text stream
+        data = stdin.buffer.read1(size)
+        return self.decoder.decode(data, final=not data)
+
+
+def make_source(target):
+    """ Source reading from target: None for stdin, a path, or any object with
+    a read method (an open file, an io.StringIO) """
+    if target is None:
+        return StdinSource()
+    if isinstance(target, (str, os.PathLike)):
+        return open(target, encoding='utf-8')
+    return target
+
+
+class InputStream(object):
+    """ Buffered reader of the values of readln.
+
+    The source is read in chunks of chunk_size characters and values are split on
+    whitespace only when they are read, so lines do not matter: a value per line
+    and many values on a line are read the same way. Values are converted to the
+    type of the variable they are read into; a STRING variable reads the rest of
+    the line. fill() reads a whole array in one pass. tied, the output of the
+    engine, is flushed before waiting for the source, so prompts are visible.
+    """
+
+    def __init__(self, source=None, chunk_size=DEFAULT_CHUNK_SIZE, tied=None):
+        self.source = make_source(source)
+        self.owns_source = isinstance(source, (str, os.PathLike))
+        self.chunk_size = chunk_size
+        self.tied = tied
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def error(self, expected, found=None):
+        if found is None:
+            message = f'Expected {expected}, found the end of the input'
+        else:
+            message = f'Expected {expected}, found {found!r}'
+        raise InputError(message=message)
+
+    def refill(self):
+        # Keeps the unread text and appends the next chunk of the source
+        if self.tied is not None:
+            self.tied.flush()
+        chunk = self.source.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def token(self):
+        while True:
+            match = _VALUE.search(self.buffer, self.pos)
+            # A value touching the end of the buffer may go on in the next chunk
+            if match is not None and (match.end() < len(self.buffer) or self.eof):
+                self.pos = match.end()
+                return match.group()
+            if self.eof:
+                self.error('a value')
+            self.refill()
+
+    def tokens(self, count):
+        tokens = []
+        while True:
+            buffer = self.buffer
+            for match in _VALUE.finditer(buffer, self.pos):
+                if match.end() == len(buffer) and not self.eof:
+                    break
+                tokens.append(match.group())
+                self.pos = match.end()
+                if len(tokens) == count:
+                    return tokens
+            if self.eof:
+                self.error(f'{count} values')
+            self.refill()
+
+    def line(self):
+        # Rest of the line starting at the next non blank character
+        while True:
+            match = _NON_SPACE.search(self.buffer, self.pos)
+            if match is not None:
+                self.pos = match.start()
+                break
+            if self.eof:
+                self.error('a line')
+            self.refill()
+        while True:
+            end = self.buffer.find('\n', self.pos)
+            if end >= 0 or self.eof:
+                break
+            self.refill()
+        if end < 0:
+            end = len(self.buffer)
+        value = self.buffer[self.pos:end].rstrip('\r')
+        self.pos = end
+        return value
+
+    def at_end(self):
+        """ Whether no value is left, only whitespace """
+        while _NON_SPACE.search(self.buffer, self.pos) is None:
+            if self.eof:
+                return True
+            self.refill()
+        return False
+
+    def read(self, read_type=None):
+        """ Next value, converted to read_type (a type name, REAL when None) """
+        if read_type == 'STRING':
+            return self.line()
+        token = self.token()
+        try:
+            return CONVERSIONS.get(read_type, float)(token)
+        except ValueError:
+            self.error(f"a {read_type or 'REAL'} value", token)
+
+    def read_many(self, count, read_type=None):
+        if read_type == 'STRING':
+            return [self.line() for _ in range(count)]
+        tokens = self.tokens(count) if count else []
+        convert = CONVERSIONS.get(read_type, float)
+        try:
+            return list(map(convert, tokens))
+        except ValueError:
+            found = next(token for token in tokens if not _converts(convert, token))
+            self.error(f"a {read_type or 'REAL'} value", found)
+
+    def fill(self, array):
+        """ Reads a value for every element of a CDict """
+        array.fill(self.read_many(len(array), array.element_type))
+
+    def close(self):
+        if self.owns_source:
+            self.source.close()
+
+
+def _converts(convert, token):
+    try:
+        convert(token)
+    except ValueError:
+        return False
+    return True
@@ -2,8 +2,13 @@ from SemanticAnalysis import NodeVisitor
 from Parser import *
 from Token import *
 from Stack import *
-from src.ConstraintDict import CDict
-import logging
+from src.ConstraintDict import CDict, MappedArray
+from Output import OutputStream
+from Input import InputStream, READ_ARRAY
+from Files import TextFile, close_files
+from Trace import tracer, FRAME
+from Sampler import Sampler, DEFAULT_INTERVAL
+import os
 
 
 ###################
@@ -12,9 +17,36 @@ import logging
 
 
 class Interpreter(NodeVisitor):
-    def __init__(self, tree):
+    def __init__(self, tree, output=None, input=None):
         self.tree = tree
+        # Buffered writer of writeln and reader of readln, stdout and stdin by default
+        self.output = OutputStream() if output is None else output
+        self.input = InputStream() if input is None else input
+        if self.input.tied is None:
+            self.input.tied = self.output  # prompts are written before waiting for input
+        # Files closed at the end of the program: TextFiles opened by Reset or Rewrite and MappedArrays
+        self.open_files = set()
+        self.mapped_arrays = {}  # (path, bounds, element type) -> MappedArray
         self.call_stack = CallStack()
+        # display[level] is the active frame of the scope at that nesting level,
+        # it gives O(1) access to the variables of enclosing scopes
+        self.display = []
+        self.sampler = None
+
+    def start_sampling(self, interval=DEFAULT_INTERVAL):
+        """ Starts sampling the call stack of the program run by the calling thread,
+        returns the Sampler. The samples of a sampler stopped before are kept. """
+        if self.sampler is None:
+            self.sampler = Sampler(self, interval)
+        if not self.sampler.running:
+            self.sampler.interval = interval
+            self.sampler.start()
+        return self.sampler
+
+    def stop_sampling(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+        return self.sampler
 
     ''' GLOBAL_MEMORY (dictionary) stores the values of the variables declared in the program
 
@@ -26,21 +58,23 @@ class Interpreter(NodeVisitor):
 
     def visit_Program(self, node):
         program_name = node.name
-        logging.info(f"Entered program: {program_name}")
 
         ar = Frame(
             name=program_name,
             type=ARType.PROGRAM,
             nesting_level=1,
+            slot_names=node.slot_names,
         )
         self.call_stack.push(ar)
-
-        logging.info(self.call_stack)
+        self.display[:] = [None] * (node.scope_levels + 1)
+        self.display[ar.nesting_level] = ar
+        if tracer.frame:
+            tracer.record(FRAME, 'push', program_name, ar.nesting_level, 1)
 
         self.visit(node.block)
 
-        logging.info(f"Left program: {program_name}")
-        logging.info(self.call_stack)
+        if tracer.frame:
+            tracer.record(FRAME, 'pop', program_name, ar.nesting_level, 1)
         self.call_stack.pop()
 
 
@@ -50,20 +84,26 @@ class Interpreter(NodeVisitor):
         self.visit(node.compound_statement)
 
     def visit_Setlength(self, node):
-        name = node.var_node.value
         length = node.length_node.value
-        ar = self.call_stack.peek()
-        ar[name].set_length(length)
+        ar = self.frame_of(node.var_node)
+        ar.slots[node.var_node.slot].set_length(length)
 
     def visit_VarDecl(self, node):
 
         if hasattr(node.type_node, 'low_range'):
-            name = node.var_node.token.value
             ar = self.call_stack.peek()
             min_range = node.type_node.low_range
             max_range = node.type_node.high_range
-            ar[name] = CDict(min_range, max_range)
+            element_type = node.type_node.token.value
+            if node.type_node.path is not None:
+                ar.slots[node.var_node.slot] = self.mapped_array(node.type_node.path, min_range, max_range,
+                                                                 element_type)
+            else:
+                ar.slots[node.var_node.slot] = CDict(min_range, max_range, element_type)
 
+        elif node.type_node.value == 'TEXT':
+            ar = self.call_stack.peek()
+            ar.slots[node.var_node.slot] = TextFile(self.open_files)
 
     def visit_Type(self, node: Type):
         pass
@@ -122,22 +162,50 @@ class Interpreter(NodeVisitor):
             self.visit(child)
 
     def visit_Writeln(self, node: Writeln):
-        for subnode in node.node_list:
-            print(self.visit(subnode), end = "")
-        print("\n")
-
-    def visit_Readln(self, node: Readln):   # Change to accept int and float values
-        for node in node.node_list:
-            if node.token.type == TokenType.STRING:
-                print(self.visit(node), end = "")
-            elif hasattr(node, 'index'):
-                var_index = self.visit(node.index)
-                var_value = float(input())
-                ar = self.call_stack.peek()
-                ar[node.token.value].add(var_index, var_value)
+        output = self.output
+        node_list = node.node_list
+        if node.has_file:
+            output = self.visit(node_list[0]).writing()
+            node_list = node_list[1:]
+        write = output.write
+        for subnode in node_list:
+            write(str(self.visit(subnode)))
+        output.newline()
+
+    def visit_Readln(self, node: Readln):
+        input = self.input
+        targets = zip(node.node_list, node.read_types)
+        if node.has_file:
+            input = self.visit(node.node_list[0]).reading()
+            next(targets)
+        for subnode, read_type in targets:
+            if subnode.token.type == TokenType.STRING:
+                self.output.write(self.visit(subnode))
+            elif hasattr(subnode, 'index'):
+                var_index = self.visit(subnode.index)
+                var_value = input.read(read_type)
+                ar = self.frame_of(subnode)
+                ar.slots[subnode.slot].add(var_index, var_value)
+            elif read_type == READ_ARRAY:
+                ar = self.frame_of(subnode)
+                input.fill(ar.slots[subnode.slot])
             else:
-                ar = self.call_stack.peek()
-                ar[node.token.value] = float(input())
+                ar = self.frame_of(subnode)
+                ar.slots[subnode.slot] = input.read(read_type)
+
+    def visit_FileProcedure(self, node: FileProcedure):
+        text_file = self.visit(node.var_node)
+        if node.token.type == TokenType.ASSIGN_FILE:
+            text_file.assign(self.visit(node.name_node))
+        elif node.token.type == TokenType.RESET:
+            text_file.reset()
+        elif node.token.type == TokenType.REWRITE:
+            text_file.rewrite()
+        elif node.token.type == TokenType.CLOSE:
+            text_file.close()
+
+    def visit_Eof(self, node: Eof):
+        return self.visit(node.var_node).eof()
 
     def visit_Condition(self, node: Condition):
         if self.visit(node.condition_node) is True:
@@ -177,66 +245,88 @@ class Interpreter(NodeVisitor):
             name=proc_name,
             type=ARType.PROCEDURE,
             nesting_level=proc_symbol.scope_level + 1,
+            slot_names=proc_symbol.slot_names,
         )
 
         formal_params = proc_symbol.formal_params
         actual_params = node.actual_params
 
         for param_symbol, argument_node in zip(formal_params, actual_params):
-            ar[param_symbol.name] = self.visit(argument_node)
+            ar.slots[param_symbol.slot] = self.visit(argument_node)
 
         self.call_stack.push(ar)
-
-
-        logging.info(f"Entering procedure {proc_name}")
-        logging.info(self.call_stack)
+        level = ar.nesting_level
+        enclosing_ar = self.display[level]
+        self.display[level] = ar
+        if tracer.frame:
+            tracer.record(FRAME, 'push', proc_name, level, len(self.call_stack.frames))
 
         # evaluate procedure body
         self.visit(proc_symbol.block_ast)
 
-        logging.info(f"Exiting procedure {proc_name}")
-        logging.info(self.call_stack)
-
-
+        if tracer.frame:
+            tracer.record(FRAME, 'pop', proc_name, level, len(self.call_stack.frames))
+        self.display[level] = enclosing_ar
         self.call_stack.pop()
 
     def visit_Assign(self, node):
 
         if hasattr(node.left, 'index'):
-            var_name = node.left.value
             var_value = self.visit(node.right)
             var_index = self.visit(node.left.index)
-            ar = self.call_stack.peek()
-            ar[var_name].add(var_index, var_value)
+            ar = self.frame_of(node.left)
+            ar.slots[node.left.slot].add(var_index, var_value)
 
         else:
-            var_name = node.left.value
             var_value = self.visit(node.right)
-            ar = self.call_stack.peek()
-            ar[var_name] = var_value
+            ar = self.frame_of(node.left)
+            ar.slots[node.left.slot] = var_value
 
     def visit_Var(self, node: Var):
 
         if node.token.type is TokenType.STRING:  # Used by the print function
-            return node.token.value
+            return node.value
 
-        var_name = node.value
-        ar = self.call_stack.peek()
-        var_value = ar.get(var_name)
+        ar = self.frame_of(node)
+        var_value = ar.slots[node.slot]
 
         return var_value
 
     def visit_IndexVar(self, node: IndexVar):
-        var_name = node.value
         index_value = self.visit(node.index)
-        ar = self.call_stack.peek()
-        var_value = ar.get(var_name).get(index_value)
+        ar = self.frame_of(node)
+        var_value = ar.slots[node.slot].get(index_value)
 
         return var_value
 
+    def mapped_array(self, path, min_range, max_range, element_type):
+        # Every declaration of the same mapped array (a local array of a procedure at
+        # every call) shares one mapping, its elements are the contents of the file
+        key = (os.path.abspath(path), min_range, max_range, element_type)
+        array = self.mapped_arrays.get(key)
+        if array is None or array.closed:
+            array = self.mapped_arrays[key] = MappedArray(path, min_range, max_range, element_type)
+            self.open_files.add(array)
+        return array
+
+    def frame_of(self, node):
+        # Frame holding the variable referenced by a Var or IndexVar node
+        ar = self.call_stack.peek()
+        if node.scope_distance:
+            return self.display[ar.nesting_level - node.scope_distance]
+        return ar
+
+    def prepare(self):
+        # Engines compiling the program before running it do it here, a CompilerError
+        # raised by prepare means nothing has run yet
+        pass
 
     def interpret(self):
         tree = self.tree
         if tree is None:
             return ''
-        return self.visit(tree)
+        try:
+            return self.visit(tree)
+        finally:
+            close_files(self.open_files)
+            self.output.flush()
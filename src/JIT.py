@@ -0,0 +1,166 @@
+from ClosureCompiler import ClosureCompiler
+from Errors import CompilerError
+from Interpreter import Interpreter
+from Nodes import ProcedureCall, While, statement_line
+from Stack import Frame, ARType
+from Trace import tracer, FRAME
+import logging
+import time
+
+
+##########################
+#  TIERED INTERPRETER    #
+##########################
+
+
+class Promotion(object):
+    def __init__(self, kind, name, count, compile_time):
+        self.kind = kind            # 'procedure' or 'loop'
+        self.name = name
+        self.count = count          # calls or iterations seen before compiling
+        self.compile_time = compile_time
+
+    def __str__(self):
+        return '{kind:<10} {name:<20} after {count} {unit}, compiled in {time:.3f} ms'.format(
+            kind=self.kind,
+            name=self.name,
+            count=self.count,
+            unit='calls' if self.kind == 'procedure' else 'iterations',
+            time=self.compile_time * 1000,
+        )
+
+    __repr__ = __str__
+
+
+class TieredInterpreter(ClosureCompiler):
+    """ Tree walking interpreter that compiles hot code to closures while running.
+
+    Every ProcedureSymbol counts its calls and every WHILE loop its iterations; once a
+    counter reaches its threshold the procedure body (or the loop) is compiled by the
+    ClosureCompiler and later executions run the compiled version. Both tiers share
+    the same call stack and frames, so a loop can switch tier in the middle of running.
+    Code the compiler does not support (a call of an undeclared procedure in a branch
+    never taken) stays in the tree walking tier, the program has already started.
+    """
+
+    CALL_THRESHOLD = 10
+    LOOP_THRESHOLD = 1000
+
+    def __init__(self, tree, output=None, input=None, *, call_threshold=None, loop_threshold=None):
+        super().__init__(tree, output, input)
+        self.call_threshold = self.CALL_THRESHOLD if call_threshold is None else call_threshold
+        self.loop_threshold = self.LOOP_THRESHOLD if loop_threshold is None else loop_threshold
+        self.call_counts = {}       # ProcedureSymbol -> calls made by the tree walker
+        self.loop_counts = {}       # While node id -> iterations run by the tree walker
+        self.compiled_procedures = {}  # ProcedureSymbol -> compiled body cell
+        self.compiled_loops = {}    # While node id -> compiled loop
+        self.uncompiled = set()     # ProcedureSymbols and While node ids the compiler rejected
+        self.promoted = []
+
+    def prepare(self):
+        # Start in the tree walking tier, compilation only happens on promotion
+        pass
+
+    def interpret(self):
+        return Interpreter.interpret(self)
+
+    def visit_ProcedureCall(self, node: ProcedureCall):
+        proc_symbol = node.proc_symbol
+        body = self.compiled_procedures.get(proc_symbol)
+
+        if body is None:
+            count = self.call_counts.get(proc_symbol, 0) + 1
+            self.call_counts[proc_symbol] = count
+            if count < self.call_threshold or proc_symbol in self.uncompiled:
+                return super().visit_ProcedureCall(node)
+            body = self.promote_procedure(proc_symbol, count)
+            if body is None:
+                return super().visit_ProcedureCall(node)
+
+        ar = Frame(
+            name=node.proc_name,
+            type=ARType.PROCEDURE,
+            nesting_level=proc_symbol.scope_level + 1,
+            slot_names=proc_symbol.slot_names,
+        )
+        for param_symbol, argument_node in zip(proc_symbol.formal_params, node.actual_params):
+            ar.slots[param_symbol.slot] = self.visit(argument_node)
+
+        self.call_stack.push(ar)
+        level = ar.nesting_level
+        enclosing_ar = self.display[level]
+        self.display[level] = ar
+        if tracer.frame:
+            tracer.record(FRAME, 'push', node.proc_name, level, len(self.call_stack.frames))
+        body[0](ar)
+        if tracer.frame:
+            tracer.record(FRAME, 'pop', node.proc_name, level, len(self.call_stack.frames))
+        self.display[level] = enclosing_ar
+        self.call_stack.pop()
+
+    def visit_While(self, node: While):
+        key = id(node)
+        loop = self.compiled_loops.get(key)
+        if loop is not None:
+            return loop(self.call_stack.peek())
+
+        count = self.loop_counts.get(key, 0)
+        while self.visit(node.condition_node) is True:
+            self.visit(node.do_node)
+            count += 1
+            if count >= self.loop_threshold and key not in self.uncompiled:
+                self.loop_counts[key] = count
+                # The compiled loop checks the condition again and carries on from here
+                loop = self.promote_loop(node, count)
+                if loop is not None:
+                    return loop(self.call_stack.peek())
+        self.loop_counts[key] = count
+
+    def promote_procedure(self, proc_symbol, count):
+        start = time.perf_counter()
+        try:
+            body = self._compile_procedure(proc_symbol)
+        except CompilerError as e:
+            self.reject(proc_symbol, proc_symbol.name, e)
+            return None
+        self.compiled_procedures[proc_symbol] = body
+        self._record('procedure', proc_symbol.name, count, time.perf_counter() - start)
+        return body
+
+    def promote_loop(self, node, count):
+        start = time.perf_counter()
+        lineno = statement_line(node)
+        # Without tokens (--drop-tokens) the line is unknown
+        name = f"WHILE@{lineno if lineno is not None else '?'}"
+        try:
+            loop = self.compile(node)
+        except CompilerError as e:
+            self.reject(id(node), name, e)
+            return None
+        self.compiled_loops[id(node)] = loop
+        self._record('loop', name, count, time.perf_counter() - start)
+        return loop
+
+    def reject(self, key, name, error):
+        self.uncompiled.add(key)
+        # Procedures whose compilation was interrupted keep an empty cell, compiled
+        # code must not call it
+        for block_id, body in list(self.procedures.items()):
+            if body[0] is None:
+                del self.procedures[block_id]
+        logging.info(f"JIT keeps {name} in the tree walking tier: {error.message}")
+
+    def _record(self, kind, name, count, compile_time):
+        promotion = Promotion(kind, name, count, compile_time)
+        self.promoted.append(promotion)
+        logging.info(f"JIT promoted {promotion}")
+
+    def report(self):
+        lines = [
+            'JIT REPORT',
+            f'call threshold: {self.call_threshold}, loop threshold: {self.loop_threshold}',
+        ]
+        if not self.promoted:
+            lines.append('nothing promoted')
+        lines.extend(str(promotion) for promotion in self.promoted)
+        return '\n'.join(lines)
@@ -1,181 +1,193 @@
-from Token import TokenType, Token, RESERVED_KEYWORDS
+from Token import TokenType, Token, LineIndex, RESERVED_KEYWORDS, SHARED_TOKENS
 from src.Errors import LexerError
+import mmap
+import os
+import re
 
 
-class Lexer(object):
-
-    def __init__(self, text: str):
-        self.text = text
-        self.pos = 0    # Position in the text/ Posizione nel testo
-        self.current_char = self.text[self.pos]
-        self.lineno = 1
-        self.column = 1
+def _build_operators():
+    # Token types written with symbols, the quotes start strings and are matched apart
+    return {
+        token_type.value: token_type
+        for token_type in TokenType
+        if not token_type.value[0].isalnum() and token_type not in (TokenType.QUOTE, TokenType.S_QUOTE)
+    }
 
-    def error(self):
-        s = "Lexer error on '{lexeme}' line: {lineno} column: {column}".format(
-            lexeme=self.current_char,
-            lineno=self.lineno,
-            column=self.column,
-        )
-        raise LexerError(message=s)
 
-    def advance(self, steps: int = 1) -> None:
-        # Method to advance in the text, setting current_char to the new character
-        # Metodo per avanzare di un carattere nel testo, current_char viene assegnato al nuovo carattere
+OPERATORS = _build_operators()
+BYTE_OPERATORS = {operator.encode(): token_type for operator, token_type in OPERATORS.items()}
 
-        if self.current_char == '\n':
-            self.lineno += 1
-            self.column = 0
-        self.pos += steps
-        if self.pos > len(self.text) - 1:
-            self.current_char = None  # Reached the EOF
-        else:
-            self.current_char = self.text[self.pos]
-            self.column += steps
+# Whitespace, {comment blocks} and // single line comments
+SKIP_PATTERN = re.compile(r'(?:\s+|\{[^}]*\}|//[^\n]*\n?)*')
+BYTE_SKIP_PATTERN = re.compile(SKIP_PATTERN.pattern.encode())
 
-    def peek(self) -> None | str:
-        peek_pos = self.pos + 1
-        if peek_pos > len(self.text) - 1:
-            return None
-        else:
-            return self.text[peek_pos]
-
-    def skip_whitespace(self) -> None:
-        while self.current_char is not None and self.current_char.isspace():
-            self.advance()
-
-    def skip_comment(self) -> None:
-        # Method called if the char { is found, skips until a } is found
-        # Metodo per saltare i commenti (tipo: { .... })
-
-        while self.current_char != '}':
-            self.advance()
-        self.advance()  # the closing curly brace
-
-    def skip_single_line_comment(self) -> None:
-        while self.current_char != '\n':
-            self.advance()
-        self.advance()
-
-    def string(self) -> Token:
-        token = Token(type=None, value=None, lineno=self.lineno, column=self.column)
-        result = ''
-
-        while self.current_char != '"' and self.current_char != '\'':
-            result += self.current_char
-            self.advance()
-        self.advance()
-
-        token.type = TokenType.STRING
-        token.value = str(result)
-        return token
-
-    def number(self) -> Token:
-        # Returns an integer or a float
-
-        token = Token(type=None, value=None, lineno=self.lineno, column=self.column)
-        result = ''
-        while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
-            self.advance()
-
-        if self.current_char == '.' and self.peek().isdigit():
-            result += self.current_char
-            self.advance()
-            while self.current_char is not None and self.current_char.isdigit():
-                result += self.current_char
-                self.advance()
-            token.type = TokenType.REAL_CONST
-            token.value = float(result)
-        else:
-            token.type = TokenType.INTEGER_CONST
-            token.value = int(result)
-        return token
 
-    def _id(self) -> Token:
-        # Finds reserved keywords and identifiers
-        token = Token(type=None, value=None, lineno=self.lineno, column=self.column)
+def _build_master_pattern(skip, letter, word):
+    # Longest operators first, so that ':=' is not read as ':' followed by '='
+    operators = '|'.join(re.escape(operator) for operator in sorted(OPERATORS, key=len, reverse=True))
+    return skip.pattern + '(?:' + '|'.join([
+        r'''["'](?P<STRING>[^"']*)["']''',  # a string ends at either quote
+        f'(?P<ID>{letter}{word}*)',
+        r'(?P<REAL_CONST>\d+\.\d+)',
+        r'(?P<INTEGER_CONST>\d+)',
+        f'(?P<OPERATOR>{operators})',
+    ]) + ')'
 
-        result = ''
-        while self.current_char is not None and (self.current_char.isalnum() or self.current_char == '_'):
-            result += self.current_char
-            self.advance()
 
-        token_type = RESERVED_KEYWORDS.get(result.upper())
+MASTER_PATTERN = re.compile(_build_master_pattern(SKIP_PATTERN, r'[^\W\d]', r'\w'))
+# Bytes patterns only know ASCII letters, any non ASCII byte can be part of a UTF-8 identifier
+BYTE_MASTER_PATTERN = re.compile(_build_master_pattern(
+    SKIP_PATTERN, r'(?:[^\W\d]|[\x80-\xff])', r'(?:\w|[\x80-\xff])').encode('latin-1'))
 
-        if token_type is None:
-            token.type = TokenType.ID
-            token.value = result
 
-        elif token_type == TokenType.ARRAY:
-            token.type = token_type
-            token.value = result.upper()
+class Lexer(object):
+    """ Splits the source text into Tokens with one compiled regular expression.
 
-        else:   # Found a reserved keyword
-            token.type = token_type
-            token.value = result.upper()
+    Each match of MASTER_PATTERN skips the whitespace and comments before a token and
+    matches the token in a named group, so the group name gives its kind; keywords and
+    operators are then looked up in the RESERVED_KEYWORDS and OPERATORS tables.
+    Tokens store their offset in the text, lines is the LineIndex turning it into
+    a line and a column. Keywords and operators are the same shared Token every time
+    they appear (see SHARED_TOKENS), start is the offset of the last token returned.
+    """
 
-        return token
+    pattern = MASTER_PATTERN
+    skip_pattern = SKIP_PATTERN
+    operators = OPERATORS
 
-    def get_next_token(self) -> Token:
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0    # Position in the text/ Posizione nel testo
+        self.start = 0
+        self.current_char = self.char(0)  # first character after the last token
+        self.lines = LineIndex(text)
+        self.tokens = self.tokenize()
 
-        # Main function to identify tokens / Funzione principale per identificare i token
+    def char(self, pos):
+        return self.text[pos] if pos < len(self.text) else None
 
-        while self.current_char is not None:
+    @staticmethod
+    def decode(lexeme):
+        return lexeme
 
-            if self.current_char.isspace():
-                self.skip_whitespace()
-                continue
+    def close(self):
+        pass
 
-            if self.current_char == '{':
-                self.advance()
-                self.skip_comment()
-                continue
+    @property
+    def lineno(self):
+        return self.lines.lineno(self.pos)
 
-            if self.current_char == '/' and self.peek() == '/':
-                self.skip_single_line_comment()
-                continue
+    @property
+    def column(self):
+        return self.lines.column(self.pos)
 
-            if self.current_char == '"' or self.current_char == '\'':  # For the print function
-                self.advance()
-                return self.string()
+    def error(self):
+        s = "Lexer error on '{lexeme}' line: {lineno} column: {column}".format(
+            lexeme=self.current_char,
+            lineno=self.lineno,
+            column=self.column,
+        )
+        raise LexerError(message=s)
 
-            if self.current_char.isalpha() or self.current_char == '_':
-                return self._id()
+    def get_next_token(self) -> Token:
 
-            if self.current_char.isdigit():
-                return self.number()
+        # Main function to identify tokens / Funzione principale per identificare i token
 
-            # for two character tokens
-            try:
-                token_type = TokenType(self.current_char + self.peek())
-            except ValueError:
-                pass
+        return next(self.tokens)
+
+    def tokenize(self):
+        """ Generator of the tokens of the text, followed by EOF tokens forever """
+        text = self.text
+        lines = self.lines
+        length = len(text)
+        match = self.pattern.match
+        char = self.char
+        decode = self.decode
+        reserved_keywords = RESERVED_KEYWORDS
+        operators = self.operators
+        shared_tokens = SHARED_TOKENS
+        ID = TokenType.ID
+        STRING = TokenType.STRING
+        INTEGER_CONST = TokenType.INTEGER_CONST
+        REAL_CONST = TokenType.REAL_CONST
+
+        pos = 0
+        while True:
+            found = match(text, pos)
+            if found is None:
+                break
+            kind = found.lastgroup
+            start = found.start(kind)
+            end = found.end()
+
+            value = found.group(kind)
+            if kind == 'ID':
+                value = decode(value)
+                token_type = reserved_keywords.get(value.upper())
+                if token_type is None:
+                    token = Token(ID, value, start, lines)
+                else:
+                    token = shared_tokens[token_type]
+            elif kind == 'OPERATOR':
+                token = shared_tokens[operators[value]]
+            elif kind == 'INTEGER_CONST':
+                token = Token(INTEGER_CONST, int(value), start, lines)
+            elif kind == 'REAL_CONST':
+                token = Token(REAL_CONST, float(value), start, lines)
             else:
-                token = Token(
-                    type=token_type,
-                    value=token_type.value,  # e.g. ':=', '<=', etc
-                    lineno=self.lineno,
-                    column=self.column,
-                )
-                self.advance(steps=2)
-                return token
-
-            # for single character tokens
-            try:
-                token_type = TokenType(self.current_char)
-            except ValueError:
-                # no enum member with value equal to self.current_char
-                self.error()
-            else:
-                # create a token with a single-character lexeme as its value
-                token = Token(
-                    type=token_type,
-                    value=token_type.value,  # e.g. ';', '.', etc
-                    lineno=self.lineno,
-                    column=self.column,
-                )
-                self.advance()
-                return token
-
-        return Token(type=TokenType.EOF, value=None)
+                token = Token(STRING, decode(value), start, lines)
+
+            self.start = start
+            pos = self.pos = end
+            self.current_char = char(end)
+            yield token
+
+        # Only whitespace and comments can follow the last token
+        pos = self.skip_pattern.match(text, pos).end()
+        if pos < length:
+            self.pos = pos
+            self.current_char = char(pos)
+            self.error()
+
+        self.start = self.pos = length
+        self.current_char = None
+        self.close()
+        eof = Token(type=TokenType.EOF, value=None)
+        while True:
+            yield eof
+
+
+class FileLexer(Lexer):
+    """ Lexer reading a source file through a memory map.
+
+    The file is never loaded as a string: the master pattern runs on the mapped bytes
+    and only the lexemes of identifiers and strings are decoded, one token at a time.
+    Offsets (and so columns) count bytes. The map is closed after the last token.
+    """
+
+    pattern = BYTE_MASTER_PATTERN
+    skip_pattern = BYTE_SKIP_PATTERN
+    operators = BYTE_OPERATORS
+
+    def __init__(self, path, encoding='utf-8'):
+        self.encoding = encoding
+        self.file = open(path, 'rb')
+        if os.fstat(self.file.fileno()).st_size:
+            source = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            source = b''  # empty files cannot be mapped
+        super().__init__(source)
+
+    def char(self, pos):
+        if pos < len(self.text):
+            return self.text[pos:pos + 1].decode(self.encoding, errors='replace')
+        return None
+
+    def decode(self, lexeme):
+        return lexeme.decode(self.encoding)
+
+    def close(self):
+        if isinstance(self.text, mmap.mmap):
+            self.text.close()
+            self.text = b''
+        self.file.close()
@@ -1,8 +1,16 @@
-from SPI import build
+from SPI import build_file, ENGINES
+from JIT import TieredInterpreter
+from Optimizer import PassManager, DEFAULT_LEVEL
+from Cache import ASTCache, OutputCache, DEFAULT_MAX_BYTES
+from Output import OutputStream, DEFAULT_BUFFER_SIZE, FLUSH_POLICIES
+from Input import InputStream, DEFAULT_CHUNK_SIZE
+from Trace import tracer, CATEGORIES, DEFAULT_CAPACITY
+from Sampler import DEFAULT_INTERVAL
+import argparse
 import os
 import logging
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
 
 # Add functions
 # Add typechecking
@@ -10,12 +18,168 @@ logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
 
 def main():
 
-    path = "program2.txt"
+    arg_parser = argparse.ArgumentParser(description='Pascal interpreter')
+    arg_parser.add_argument('path', nargs='?', default='program2.txt', help='Pascal source file')
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES), default='tree',
+                            help='execution engine (default: tree)')
+    arg_parser.add_argument('-O', dest='optimization_level', type=int, choices=[0, 1, 2],
+                            help=f'optimization level of the AST passes (default: {DEFAULT_LEVEL})')
+    arg_parser.add_argument('--pass-report', action='store_true',
+                            help='print the time and node count change of every optimization pass')
+    arg_parser.add_argument('--drop-tokens', action='store_true',
+                            help='release the tokens of the AST after the semantic analysis to save memory')
+    arg_parser.add_argument('--flat-ast', action='store_true',
+                            help='store the AST in arrays instead of node objects, for very large programs')
+    arg_parser.add_argument('--cache', action='store_true',
+                            help='load the analysed AST from the AST cache, or store it there')
+    arg_parser.add_argument('--cache-dir', metavar='DIR',
+                            help='directory of the caches, implies --cache (default: ~/.cache/pascal-interpreter)')
+    arg_parser.add_argument('--cache-size', type=int, metavar='MB', default=DEFAULT_MAX_BYTES // 2 ** 20,
+                            help='size of each cache, the least recently used entries are removed past it')
+    arg_parser.add_argument('--memoize-output', action='store_true',
+                            help='replay the stored output of programs without readln instead of running them')
+    arg_parser.add_argument('--force-run', action='store_true',
+                            help='run the program even if its output is memoized')
+    arg_parser.add_argument('--cache-stats', action='store_true',
+                            help='print the hits and misses of the caches')
+    arg_parser.add_argument('--output', metavar='FILE',
+                            help='write the output of the program to FILE instead of stdout')
+    arg_parser.add_argument('--output-buffer', type=int, metavar='N', default=DEFAULT_BUFFER_SIZE,
+                            help=f'characters of output buffered before a write (default: {DEFAULT_BUFFER_SIZE})')
+    arg_parser.add_argument('--flush', choices=FLUSH_POLICIES,
+                            help='when the output is written: when the buffer is full, at every line or every write '
+                                 '(default: line for terminals, full otherwise)')
+    arg_parser.add_argument('--input', metavar='FILE',
+                            help='read the values of readln from FILE instead of stdin')
+    arg_parser.add_argument('--input-chunk', type=int, metavar='N', default=DEFAULT_CHUNK_SIZE,
+                            help=f'characters of input read at once (default: {DEFAULT_CHUNK_SIZE})')
+    arg_parser.add_argument('--dump-source', metavar='FILE',
+                            help='write the Python code generated by the python engine to FILE')
+    arg_parser.add_argument('--jit-call-threshold', type=int, metavar='N',
+                            help='calls before the jit engine compiles a procedure')
+    arg_parser.add_argument('--jit-loop-threshold', type=int, metavar='N',
+                            help='iterations before the jit engine compiles a WHILE loop')
+    arg_parser.add_argument('--jit-report', action='store_true',
+                            help='print the procedures and loops compiled by the jit engine')
+    arg_parser.add_argument('--profile', action='store_true',
+                            help='run with the profile engine and print the time spent in every procedure and line')
+    arg_parser.add_argument('--profile-lines', type=int, metavar='N', default=20,
+                            help='lines listed by --profile and --sample, the slowest first (default: 20)')
+    arg_parser.add_argument('--profile-stacks', metavar='FILE',
+                            help='write the call stacks of the profile to FILE in the collapsed format of '
+                                 'flame graph tools, implies --profile')
+    arg_parser.add_argument('--sample', action='store_true',
+                            help='sample the call stack while the program runs and print where it spent its time')
+    arg_parser.add_argument('--sample-interval', type=float, metavar='MS',
+                            help=f'time between two samples, implies --sample (default: {DEFAULT_INTERVAL * 1000:g})')
+    arg_parser.add_argument('--sample-stacks', metavar='FILE',
+                            help='write the sampled call stacks to FILE in the collapsed format of flame graph tools, '
+                                 'implies --sample')
+    arg_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='log the cache, optimizer and jit activity')
+    arg_parser.add_argument('--trace', metavar='CATEGORIES',
+                            help=f"record the events of the comma separated categories ({', '.join(CATEGORIES)}) "
+                                 f"or 'all', written at the end of the program or after an error")
+    arg_parser.add_argument('--trace-size', type=int, metavar='N', default=DEFAULT_CAPACITY,
+                            help=f'events kept, the older ones are dropped (default: {DEFAULT_CAPACITY})')
+    arg_parser.add_argument('--trace-output', metavar='FILE',
+                            help='write the trace to FILE instead of stderr')
+    args = arg_parser.parse_args()
+
+    if args.flat_ast:
+        # Flat ASTs are not optimized (-O0 is accepted), cached or dumped, they have no node objects
+        ignored = [option for option, used in (
+            ('-O', args.optimization_level),
+            ('--pass-report', args.pass_report),
+            ('--drop-tokens', args.drop_tokens),
+            ('--cache', args.cache),
+            ('--cache-dir', args.cache_dir),
+            ('--memoize-output', args.memoize_output),
+            ('--dump-source', args.dump_source),
+        ) if used]
+        if ignored:
+            arg_parser.error(f"--flat-ast cannot be combined with {', '.join(ignored)}")
+    if args.optimization_level is None:
+        args.optimization_level = DEFAULT_LEVEL
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+    if args.trace:
+        categories = CATEGORIES if args.trace == 'all' else args.trace.split(',')
+        try:
+            tracer.enable(categories, capacity=args.trace_size)
+        except ValueError as e:
+            arg_parser.error(str(e))
+
+    if args.profile or args.profile_stacks:
+        args.engine = 'profile'
+
+    sample_interval = None
+    if args.sample_interval is not None:
+        sample_interval = args.sample_interval / 1000
+    elif args.sample or args.sample_stacks:
+        sample_interval = DEFAULT_INTERVAL
+
+    engine_options = {}
+    if args.engine == 'jit':
+        engine_options = dict(call_threshold=args.jit_call_threshold, loop_threshold=args.jit_loop_threshold)
+
+    pass_manager = None if args.flat_ast else PassManager(args.optimization_level)
+
+    cache = None
+    if args.cache or args.cache_dir:
+        cache = ASTCache(args.cache_dir, max_bytes=args.cache_size * 2 ** 20)
+    output_cache = None
+    if args.memoize_output:
+        output_cache = OutputCache(args.cache_dir, max_bytes=args.cache_size * 2 ** 20, bypass=args.force_run)
+
+    path = args.path
     if os.path.isfile(path):
-        with open(path) as f:
-            program = f.read()
-            build(program)
+        output = OutputStream(args.output, buffer_size=args.output_buffer, flush_policy=args.flush)
+        input = InputStream(args.input, chunk_size=args.input_chunk, tied=output)
+        try:
+            interpreter = build_file(path, engine=args.engine, dump_source=args.dump_source,
+                                     pass_manager=pass_manager, drop_tokens=args.drop_tokens, flat=args.flat_ast,
+                                     cache=cache, output_cache=output_cache, output=output, input=input,
+                                     sample_interval=sample_interval, **engine_options)
+        finally:
+            output.close()
+            input.close()
+            if tracer.enabled:
+                dump_trace(args.trace_output)
+        # The output replayed from the output cache comes without a run to report on
+        replayed = interpreter is None and output_cache is not None and output_cache.hits > 0
+        if replayed and (args.pass_report or args.jit_report or sample_interval is not None
+                         or args.engine == 'profile'):
+            logging.warning("The output was replayed from the output cache, no report is available "
+                            "(--force-run runs the program)")
+        if args.pass_report and not replayed:
+            print(pass_manager.report())
+        if args.jit_report and isinstance(interpreter, TieredInterpreter):
+            print(interpreter.report())
+        elif args.jit_report and interpreter is not None:
+            logging.warning(f"--jit-report needs the jit engine, the program ran with the {args.engine} engine")
+        if sample_interval is not None and interpreter is not None:
+            print(interpreter.sampler.report(path, limit=args.profile_lines))
+            if args.sample_stacks:
+                interpreter.sampler.save_collapsed(args.sample_stacks)
+        if args.engine == 'profile' and interpreter is not None:
+            print(interpreter.report(path, limit=args.profile_lines))
+            if args.profile_stacks:
+                interpreter.profile.save_collapsed(args.profile_stacks)
+        if args.cache_stats:
+            for used_cache in (cache, output_cache):
+                if used_cache is not None:
+                    print(used_cache.report())
+
+
+def dump_trace(path):
+    if path is None:
+        tracer.dump()
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        tracer.dump(f)
+
 
 if __name__ == '__main__':
     main()
-
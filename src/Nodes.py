@@ -1,12 +1,69 @@
-from Token import Token
+from Token import Token, shared_token
 
 # Types of AST (abstract syntax trees) nodes / tipi di nodi AST
 
 class AST(object):
-    pass
+    # Nodes only hold the attributes listed in __slots__, the fields of the node
+    __slots__ = ()
+
+
+def iter_fields(node):
+    """ Yields (name, value) for every field of node """
+    for name in type(node).__slots__:
+        yield name, getattr(node, name)
+
+
+def drop_tokens(tree):
+    """ Replaces every token of the tree by the shared token of its type.
+
+    After the semantic analysis the engines only look at token types, names and values
+    are copied in the nodes, so the lexemes and positions can be released.
+    Error messages raised later (at run time) have no line numbers.
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        for name, value in iter_fields(node):
+            if isinstance(value, Token):
+                setattr(node, name, shared_token(value.type))
+            elif isinstance(value, AST):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(item for item in value if isinstance(item, AST))
+    return tree
+
+
+def contains(tree, node_class, predicate=None):
+    """ Whether a node of the tree is a node_class (for which predicate is true) """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, node_class) and (predicate is None or predicate(node)):
+            return True
+        for name, value in iter_fields(node):
+            if isinstance(value, AST):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(item for item in value if isinstance(item, AST))
+    return False
+
+
+# Node kinds executed as a statement of a source line
+STATEMENTS = frozenset((
+    'Assign', 'ProcedureCall', 'Setlength', 'FileProcedure', 'Writeln', 'Readln',
+    'Condition', 'While', 'Repeat',
+))
+
+
+def statement_line(node):
+    """ Source line of a statement node (or node view), None without tokens """
+    token = node.left.token if type(node).__name__ == 'Assign' else node.token
+    return token.lineno
 
 
 class BinOp(AST):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left: AST, op: Token, right: AST):
         self.left = left
         self.op = op
@@ -14,18 +71,24 @@ class BinOp(AST):
 
 
 class UnaryOp(AST):
+    __slots__ = ('op', 'expr')
+
     def __init__(self, op: Token, expr: AST):
         self.op = op
         self.expr = expr
 
 
 class Num(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token: Token):
         self.token = token
         self.value = token.value
 
 
 class Boolean(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token: Token):
         self.token = token
         if token.value == 'TRUE':
@@ -35,6 +98,8 @@ class Boolean(AST):
 
 
 class String(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token: Token):
         self.token = token
         self.value = token.value
@@ -42,11 +107,15 @@ class String(AST):
 
 class Compound(AST):
     # Represents a 'BEGIN ... END' block
-    def __init__(self):
-        self.children = []
+    __slots__ = ('children',)
+
+    def __init__(self, children=None):
+        self.children = [] if children is None else children
 
 
 class Assign(AST):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left: AST, op: Token, right: AST):
         self.left = left
         self.op = op
@@ -55,63 +124,96 @@ class Assign(AST):
 
 class Var(AST):
     # Built only with ID or string tokens
+    __slots__ = ('token', 'value', 'slot', 'scope_distance')
+
     def __init__(self, token: Token):
         self.token = token
         self.value = token.value
+        # index of the variable in its Frame and number of scope levels between
+        # the reference and the declaration, set by the semantic analyzer
+        self.slot = None
+        self.scope_distance = 0
 
 
 class IndexVar(AST):
+    __slots__ = ('token', 'value', 'index', 'slot', 'scope_distance')
+
     def __init__(self, token: Token, index: AST):
         self.token = token
         self.value = token.value
         self.index = index  # This is an ast variable, not a token variable
+        self.slot = None
+        self.scope_distance = 0
 
 
 class Type(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token: Token):
         self.token = token
         self.value = token.value
 
 
 class RangeType(AST):
-    def __init__(self, token: Token, low_range, high_range):
+    __slots__ = ('token', 'low_range', 'high_range', 'path')
+
+    def __init__(self, token: Token, low_range, high_range, path=None):
         self.token = token
         self.low_range = low_range
         self.high_range = high_range
+        self.path = path  # file the elements are mapped on, None for arrays in memory
 
 
 class Program(AST):
+    __slots__ = ('name', 'block', 'slot_names', 'scope_levels')
+
     def __init__(self, name: str, block: AST):
         self.name = name
         self.block = block
+        # names of the global variables by slot index and number of nested
+        # scope levels, set by the semantic analyzer
+        self.slot_names = None
+        self.scope_levels = 1
 
 
 class Block(AST):
+    __slots__ = ('declarations', 'compound_statement')
+
     def __init__(self, declarations: list, compound_statement: Compound):
         self.declarations = declarations
         self.compound_statement = compound_statement
 
 
 class VarDecl(AST):
+    __slots__ = ('var_node', 'type_node')
+
     def __init__(self, var_node: AST, type_node: AST):
         self.var_node = var_node
         self.type_node = type_node
 
 
 class Param(AST):
+    __slots__ = ('var_node', 'type_node')
+
     def __init__(self, var_node: AST, type_node: AST):
         self.var_node = var_node
         self.type_node = type_node
 
 
 class ProcedureDecl(AST):
+    __slots__ = ('proc_name', 'formal_params', 'block_node', 'slot_names')
+
     def __init__(self, proc_name, formal_params, block_node: Block):
         self.proc_name = proc_name
         self.formal_params = formal_params  # a list of Param nodes
         self.block_node = block_node
+        # names of the procedure variables by slot index, set by the semantic analyzer
+        self.slot_names = None
 
 
 class ProcedureCall(AST):
+    __slots__ = ('proc_name', 'actual_params', 'token', 'proc_symbol')
+
     def __init__(self, proc_name: str, actual_params: list, token: Token):
         self.proc_name = proc_name
         self.actual_params = actual_params  # a list of AST nodes
@@ -122,18 +224,24 @@ class ProcedureCall(AST):
 
 
 class Then(AST):
+    __slots__ = ('token', 'child')
+
     def __init__(self, token: Token, child: AST):
         self.token = token
         self.child = child
 
 
 class Else(AST):
+    __slots__ = ('token', 'child')
+
     def __init__(self, token: Token, child: AST):
         self.token = token
         self.child = child
 
 
 class Condition(AST):
+    __slots__ = ('token', 'condition_node', 'then_node', 'else_node')
+
     def __init__(self, token: Token, condition_node: AST, then_node: AST, else_node: AST):
         self.token = token
         self.condition_node = condition_node
@@ -142,12 +250,16 @@ class Condition(AST):
 
 
 class Do(AST):
+    __slots__ = ('token', 'child')
+
     def __init__(self, token: Token, child: AST):
         self.token = token
         self.child = child
 
 
 class While(AST):
+    __slots__ = ('token', 'condition_node', 'do_node')
+
     def __init__(self, token: Token, condition_node: AST, do_node: AST):
         self.token = token
         self.condition_node = condition_node
@@ -155,28 +267,60 @@ class While(AST):
 
 
 class Repeat(AST):
+    __slots__ = ('token', 'repeat_node', 'condition_node')
+
     def __init__(self, token: Token, repeat_node: AST, condition_node: AST):
         self.token = token
         self.repeat_node = repeat_node
         self.condition_node = condition_node
 
 class Setlength(AST):
+    __slots__ = ('token', 'var_node', 'length_node')
+
     def __init__(self, token: Token, var_node: AST, length_node: AST):
         self.token = token
         self.var_node = var_node
         self.length_node = length_node
 
 class Writeln(AST):
+    __slots__ = ('token', 'node_list', 'has_file')
+
     def __init__(self, token: Token, node_list: list):
         self.token = token
         self.node_list = node_list
+        # whether node_list[0] is the TEXT file written to, set by the semantic analyzer
+        self.has_file = False
 
 
 class Readln(AST):
+    __slots__ = ('token', 'node_list', 'read_types', 'has_file')
+
     def __init__(self, token: Token, node_list: list):
         self.token = token
         self.node_list = node_list
+        # type name each node is read as (None for prompts), set by the semantic analyzer
+        self.read_types = None
+        # whether node_list[0] is the TEXT file read from, set by the semantic analyzer
+        self.has_file = False
+
+
+class FileProcedure(AST):
+    # Assign(f, name), Reset(f), Rewrite(f) and Close(f), told apart by the token type
+    __slots__ = ('token', 'var_node', 'name_node')
+
+    def __init__(self, token: Token, var_node: AST, name_node: AST = None):
+        self.token = token
+        self.var_node = var_node
+        self.name_node = name_node
+
+
+class Eof(AST):
+    __slots__ = ('token', 'var_node')
+
+    def __init__(self, token: Token, var_node: AST):
+        self.token = token
+        self.var_node = var_node
 
 
 class NoOp(AST):
-    pass
+    __slots__ = ()
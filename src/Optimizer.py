@@ -0,0 +1,620 @@
+from SemanticAnalysis import NodeVisitor
+from Token import Token, TokenType
+from Nodes import *
+import logging
+import time
+
+
+###########################
+#  AST OPTIMIZER          #
+###########################
+
+# Evaluation of the operators on literal operands, matching Interpreter.visit_BinOp
+_BINARY_FOLDS = {
+    TokenType.PLUS: lambda left, right: left + right,
+    TokenType.MINUS: lambda left, right: left - right,
+    TokenType.MUL: lambda left, right: left * right,
+    TokenType.INTEGER_DIV: lambda left, right: left // right,
+    TokenType.FLOAT_DIV: lambda left, right: float(left) / float(right),
+    TokenType.AND: lambda left, right: left and right,
+    TokenType.OR: lambda left, right: left or right,
+    TokenType.EQUAL: lambda left, right: left == right,
+    TokenType.NOT_EQ: lambda left, right: left != right,
+    TokenType.LESSER: lambda left, right: left < right,
+    TokenType.GREATER: lambda left, right: left > right,
+    TokenType.LESS_EQ: lambda left, right: left <= right,
+    TokenType.GREAT_EQ: lambda left, right: left >= right,
+}
+
+_UNARY_FOLDS = {
+    TokenType.PLUS: lambda value: +value,
+    TokenType.MINUS: lambda value: -value,
+    TokenType.NOT: lambda value: not value,
+}
+
+# Operators whose right operand is not always evaluated
+_SHORT_CIRCUIT_OPERATORS = {TokenType.AND, TokenType.OR}
+
+LITERALS = (Num, Boolean, String)
+
+
+def literal(value, token):
+    """ Builds the literal node holding value, reusing the position of token """
+    if isinstance(value, bool):
+        return Boolean(Token(TokenType.TRUE if value else TokenType.FALSE,
+                             'TRUE' if value else 'FALSE', token.offset, token.lines))
+    if isinstance(value, int):
+        return Num(Token(TokenType.INTEGER_CONST, value, token.offset, token.lines))
+    if isinstance(value, float):
+        return Num(Token(TokenType.REAL_CONST, value, token.offset, token.lines))
+    if isinstance(value, str):
+        return String(Token(TokenType.STRING, value, token.offset, token.lines))
+    return None
+
+
+def child_nodes(node):
+    """ Yields the AST children of node, in declaration order """
+    for name, value in iter_fields(node):
+        if isinstance(value, AST):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, AST):
+                    yield item
+
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(child_nodes(node))
+    return count
+
+
+def is_variable(node):
+    # Var nodes also carry the string literals of writeln and readln
+    return isinstance(node, (Var, IndexVar)) and node.token.type is not TokenType.STRING
+
+
+class ASTTransformer(NodeVisitor):
+    """ Base class of the optimization passes.
+
+    Every visit returns the node replacing the visited one (or None to remove a
+    statement). The generic visit rewrites the children of a node in place, so a pass
+    only defines the visit methods of the nodes it changes. The block of each scope is
+    kept on a stack, a variable reference is identified by its declaring block and slot.
+    """
+
+    name = 'pass'
+
+    def __init__(self):
+        self.scopes = []
+        self.changed = 0
+
+    def run(self, tree: Program) -> Program:
+        return self.visit(tree)
+
+    def generic_visit(self, node):
+        for attribute, value in iter_fields(node):
+            if isinstance(value, AST):
+                replacement = self.visit(value)
+                setattr(node, attribute, NoOp() if replacement is None else replacement)
+            elif isinstance(value, list) and value and all(isinstance(item, AST) for item in value):
+                replacements = (self.visit(item) for item in value)
+                setattr(node, attribute, [item for item in replacements if item is not None])
+        return node
+
+    def visit_Program(self, node):
+        self.scopes.append(node.block)
+        self.generic_visit(node)
+        self.scopes.pop()
+        return node
+
+    def visit_ProcedureDecl(self, node):
+        # The Block object is kept: proc_symbol.block_ast refers to it
+        self.scopes.append(node.block_node)
+        self.generic_visit(node)
+        self.scopes.pop()
+        return node
+
+    def key(self, node):
+        return self.scopes[-1 - node.scope_distance], node.slot
+
+
+class References(ASTTransformer):
+    """ Collects the variables read, written and referenced and the procedures called in each scope """
+
+    def __init__(self, scopes=()):
+        super().__init__()
+        self.scopes = list(scopes)
+        self.reads = set()
+        self.writes = set()
+        self.references = {}    # scope block -> variables referenced in it
+        self.calls = {}         # scope block -> blocks of the procedures it calls
+
+    def read(self, node):
+        key = self.key(node)
+        self.reads.add(key)
+        self.references.setdefault(self.scopes[-1], set()).add(key)
+
+    def write(self, node):
+        key = self.key(node)
+        self.writes.add(key)
+        self.references.setdefault(self.scopes[-1], set()).add(key)
+
+    def reachable(self, block):
+        """ Returns the blocks of the program reachable by calls from block """
+        reached = {block}
+        pending = [block]
+        while pending:
+            for callee in self.calls.get(pending.pop(), ()):
+                if callee not in reached:
+                    reached.add(callee)
+                    pending.append(callee)
+        return reached
+
+    def visit_VarDecl(self, node):
+        return node
+
+    def visit_Param(self, node):
+        return node
+
+    def visit_Var(self, node):
+        if is_variable(node):
+            self.read(node)
+        return node
+
+    def visit_IndexVar(self, node):
+        # Array elements are not tracked, any use of an array counts as a read
+        self.read(node)
+        self.visit(node.index)
+        return node
+
+    def visit_Assign(self, node):
+        self.visit(node.right)
+        if isinstance(node.left, IndexVar):
+            self.visit(node.left)
+        else:
+            self.write(node.left)
+        return node
+
+    def visit_Readln(self, node):
+        node_list = node.node_list
+        if node.has_file:
+            self.read(node_list[0])
+            node_list = node_list[1:]
+        for subnode in node_list:
+            if isinstance(subnode, IndexVar):
+                self.visit(subnode)
+            elif is_variable(subnode):
+                self.write(subnode)
+        return node
+
+    def visit_Setlength(self, node):
+        self.read(node.var_node)
+        return node
+
+    def visit_ProcedureCall(self, node):
+        callees = self.calls.setdefault(self.scopes[-1], set())
+        # An undeclared procedure fails at runtime, the call is still recorded as a call
+        if node.proc_symbol is not None:
+            callees.add(node.proc_symbol.block_ast)
+        return self.generic_visit(node)
+
+
+class CollapseWrappers(ASTTransformer):
+    """ Replaces the Do, Then and Else wrappers by the statement they hold """
+
+    name = 'collapse-wrappers'
+
+    def collapse(self, node):
+        self.changed += 1
+        return self.visit(node.child)
+
+    visit_Do = collapse
+    visit_Then = collapse
+    visit_Else = collapse
+
+
+class ConstantFolder(ASTTransformer):
+    """ Folds the constant expressions of an analysed AST.
+
+    Operators over Num, Boolean and String literals are evaluated once here instead of
+    on every execution and IF and WHILE statements with a constant condition are pruned.
+    folded counts the nodes replaced. Operations that fail (division by zero, mixed
+    types) are left for the runtime. Identities such as x * 1 are not simplified: the
+    type of x is unknown here and TRUE * 1 is 1, not TRUE.
+    """
+
+    name = 'constant-folding'
+
+    @property
+    def folded(self):
+        return self.changed
+
+    # Statements
+
+    def visit_Condition(self, node):
+        self.generic_visit(node)
+
+        if isinstance(node.condition_node, LITERALS):
+            self.changed += 1
+            # The interpreter takes the THEN branch only for the value True
+            if node.condition_node.value is True:
+                return node.then_node
+            if node.else_node is not None:
+                return node.else_node
+            return NoOp()
+        return node
+
+    def visit_While(self, node):
+        self.generic_visit(node)
+
+        if isinstance(node.condition_node, LITERALS) and node.condition_node.value is not True:
+            self.changed += 1
+            return NoOp()
+        return node
+
+    # Expressions
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        left, op, right = node.left, node.op.type, node.right
+
+        if isinstance(left, LITERALS) and isinstance(right, LITERALS):
+            try:
+                folded = literal(_BINARY_FOLDS[op](left.value, right.value), node.op)
+            except (ArithmeticError, TypeError, ValueError):
+                return node
+            if folded is not None:
+                self.changed += 1
+                return folded
+            return node
+
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        expr, op = node.expr, node.op.type
+
+        if isinstance(expr, LITERALS):
+            try:
+                folded = literal(_UNARY_FOLDS[op](expr.value), node.op)
+            except (ArithmeticError, TypeError, ValueError):
+                return node
+            if folded is not None:
+                self.changed += 1
+                return folded
+            return node
+
+        return node
+
+
+class DeadStoreElimination(ASTTransformer):
+    """ Removes the assignments whose value can never be read.
+
+    An assignment to a variable that is not read anywhere in the program is removed, and
+    so is an assignment overwritten later in the same BEGIN ... END block before any
+    statement reads the variable or calls a procedure. Only assignments of a literal or
+    of a variable are removed: an operator can fail (DIV by zero, mixed types) and an
+    array element can be out of range, and the error must still be raised. Readln
+    statements are always kept.
+    """
+
+    name = 'dead-store-elimination'
+
+    def run(self, tree):
+        # Removing a store can leave the variable it read unread, repeat until stable
+        while True:
+            changed = self.changed
+            references = References()
+            references.visit(tree)
+            self.reads = references.reads
+            self.visit(tree)
+            if self.changed == changed:
+                return tree
+
+    def visit_Assign(self, node):
+        if self.removable(node) and self.key(node.left) not in self.reads:
+            self.changed += 1
+            return None
+        return node
+
+    @staticmethod
+    def removable(node):
+        return isinstance(node, Assign) and isinstance(node.left, Var) \
+            and isinstance(node.right, LITERALS + (Var,))
+
+    def visit_Compound(self, node):
+        self.generic_visit(node)
+        children = node.children
+        live = []
+        for index, child in enumerate(children):
+            if self.removable(child) and self.overwritten(self.key(child.left), children[index + 1:]):
+                self.changed += 1
+            else:
+                live.append(child)
+        node.children = live
+        return node
+
+    def overwritten(self, key, statements):
+        for statement in statements:
+            references = References(self.scopes)
+            references.visit(statement)
+            if key in references.reads or references.calls:
+                return False
+            if isinstance(statement, Assign) and isinstance(statement.left, Var) \
+                    and self.key(statement.left) == key:
+                return True
+        return False
+
+
+class UnusedDeclarationRemoval(ASTTransformer):
+    """ Removes the variables never referenced and the procedures never called.
+
+    Declarations doing more than reserving a slot are kept: a mapped array creates or
+    sizes its file and a TEXT variable opens files.
+    """
+
+    name = 'unused-declaration-removal'
+
+    def run(self, tree):
+        references = References()
+        references.visit(tree)
+        self.reachable = references.reachable(tree.block)
+        self.referenced = set()
+        for block in self.reachable:
+            self.referenced.update(references.references.get(block, ()))
+        return self.visit(tree)
+
+    def visit_Block(self, node):
+        declarations = []
+        for declaration in node.declarations:
+            if isinstance(declaration, VarDecl) and (node, declaration.var_node.slot) not in self.referenced \
+                    and not self.has_effects(declaration):
+                self.changed += 1
+            elif isinstance(declaration, ProcedureDecl) and declaration.block_node not in self.reachable:
+                self.changed += 1
+            else:
+                declarations.append(self.visit(declaration))
+        node.declarations = declarations
+        node.compound_statement = self.visit(node.compound_statement)
+        return node
+
+    @staticmethod
+    def has_effects(declaration):
+        type_node = declaration.type_node
+        if isinstance(type_node, RangeType):
+            return type_node.path is not None
+        return isinstance(type_node, Type) and type_node.value == 'TEXT'
+
+
+class CommonSubexpressionElimination(ASTTransformer):
+    """ Computes the expressions repeated in a run of assignments only once.
+
+    In a sequence of assignments of a BEGIN ... END block, an operator expression
+    appearing more than once with none of its variables assigned in between is stored
+    in a temporary variable (a new frame slot of the scope) before its first use, and
+    every occurrence reads the temporary. The operands of AND and OR are not hoisted,
+    they are not always evaluated. Any operator or array element can raise (DIV by zero,
+    mixed types, out of bounds), so an expression is only hoisted when nothing its
+    statement evaluates before it can raise: the first error reported stays the same.
+    """
+
+    name = 'common-subexpression-elimination'
+
+    def __init__(self):
+        super().__init__()
+        self.slot_names = []    # slot names of the scopes being visited
+        self.temporaries = 0
+        self.raising = False
+
+    def visit_Program(self, node):
+        self.slot_names.append(node.slot_names)
+        super().visit_Program(node)
+        self.slot_names.pop()
+        return node
+
+    def visit_ProcedureDecl(self, node):
+        self.slot_names.append(node.slot_names)
+        super().visit_ProcedureDecl(node)
+        self.slot_names.pop()
+        return node
+
+    def visit_Compound(self, node):
+        self.generic_visit(node)
+        while True:
+            common = self.find_common(node.children)
+            if common is None:
+                return node
+            self.hoist(node.children, *common)
+
+    def find_common(self, statements):
+        """ Returns (statement index, occurrences) of the largest repeated expression """
+        available = {}  # expression key -> [first statement index, variables used, size, occurrences, hoistable]
+        repeated = []
+
+        def retire(keys):
+            for key in keys:
+                entry = available.pop(key)
+                if len(entry[3]) > 1 and entry[4]:
+                    repeated.append(entry)
+
+        for index, statement in enumerate(statements):
+            if isinstance(statement, Writeln):
+                continue
+            if not isinstance(statement, Assign):
+                retire(list(available))
+                continue
+            # Value first and index second, the order of evaluation of the interpreter
+            self.raising = False  # whether the statement evaluated something that can raise
+            self.scan(statement, 'right', index, available)
+            if isinstance(statement.left, IndexVar):
+                self.scan(statement.left, 'index', index, available)
+            written = (statement.left.slot, statement.left.scope_distance)
+            retire([key for key, entry in available.items() if written in entry[1]])
+        retire(list(available))
+
+        if not repeated:
+            return None
+        index, used, size, occurrences, _ = max(repeated, key=lambda entry: entry[2])
+        return index, occurrences
+
+    def scan(self, parent, attribute, index, available):
+        node = getattr(parent, attribute)
+        if isinstance(node, IndexVar):
+            self.scan(node, 'index', index, available)
+        elif isinstance(node, (BinOp, UnaryOp)):
+            self.scan_operation(parent, attribute, index, available)
+        # Once evaluated, an operator, an array element or Eof may have raised
+        if isinstance(node, IndexVar) or not isinstance(node, LITERALS) and not is_variable(node):
+            self.raising = True
+
+    def scan_operation(self, parent, attribute, index, available):
+        node = getattr(parent, attribute)
+        key, used, size = self.describe(node)
+        entry = available.get(key)
+        if entry is not None:
+            entry[3].append((parent, attribute))
+            return
+        available[key] = [index, used, size, [(parent, attribute)], not self.raising]
+
+        if isinstance(node, UnaryOp):
+            self.scan(node, 'expr', index, available)
+        elif node.op.type not in _SHORT_CIRCUIT_OPERATORS:
+            self.scan(node, 'left', index, available)
+            self.scan(node, 'right', index, available)
+
+    def describe(self, node):
+        """ Returns a key equal for equal expressions, the variables used and the size """
+        if isinstance(node, BinOp):
+            left, left_used, left_size = self.describe(node.left)
+            right, right_used, right_size = self.describe(node.right)
+            return ('BinOp', node.op.type, left, right), left_used | right_used, left_size + right_size + 1
+        if isinstance(node, UnaryOp):
+            expr, used, size = self.describe(node.expr)
+            return ('UnaryOp', node.op.type, expr), used, size + 1
+        if isinstance(node, IndexVar):
+            index, used, size = self.describe(node.index)
+            variable = (node.slot, node.scope_distance)
+            return ('IndexVar', variable, index), used | {variable}, size + 1
+        if is_variable(node):
+            variable = (node.slot, node.scope_distance)
+            return ('Var', variable), {variable}, 1
+        if isinstance(node, Eof):
+            # Depends on the file position, never equal to another expression
+            return ('Eof', id(node)), set(), 1
+        # Literals, the type is part of the key: 1 and 1.0 print differently
+        return (type(node).__name__, type(node.value), node.value), set(), 1
+
+    def hoist(self, statements, index, occurrences):
+        name, slot = self.temporary()
+        parent, attribute = occurrences[0]
+        expression = getattr(parent, attribute)
+        token = Token(TokenType.ID, name, expression.op.offset, expression.op.lines)
+
+        for parent, attribute in occurrences:
+            setattr(parent, attribute, self.variable(token, slot))
+        statements.insert(index, Assign(self.variable(token, slot), Token(TokenType.ASSIGN, ':='), expression))
+        self.changed += len(occurrences) - 1
+
+    @staticmethod
+    def variable(token, slot):
+        node = Var(token)
+        node.slot = slot
+        return node
+
+    def temporary(self):
+        # The name must not hide a variable of an enclosing scope (the python engine uses names)
+        names = set()
+        for slot_names in self.slot_names:
+            names.update(slot_names)
+        while True:
+            self.temporaries += 1
+            name = f'_cse{self.temporaries}'
+            if name not in names:
+                break
+        slot_names = self.slot_names[-1]
+        slot_names.append(name)
+        return name, len(slot_names) - 1
+
+
+##########################
+#  PASS MANAGER          #
+##########################
+
+DEFAULT_LEVEL = 1
+
+# (minimum optimization level, pass) in order of execution
+PASSES = [
+    (1, CollapseWrappers),
+    (1, ConstantFolder),
+    (2, DeadStoreElimination),
+    (2, UnusedDeclarationRemoval),
+    (2, CommonSubexpressionElimination),
+]
+
+
+class PassResult(object):
+    def __init__(self, name, elapsed, nodes_before, nodes_after, changed):
+        self.name = name
+        self.elapsed = elapsed
+        self.nodes_before = nodes_before
+        self.nodes_after = nodes_after
+        self.changed = changed
+
+    def __str__(self):
+        return '{name:<34} {time:8.3f} ms  nodes {before} -> {after} ({delta:+d}), {changed} changes'.format(
+            name=self.name,
+            time=self.elapsed * 1000,
+            before=self.nodes_before,
+            after=self.nodes_after,
+            delta=self.nodes_after - self.nodes_before,
+            changed=self.changed,
+        )
+
+    __repr__ = __str__
+
+
+class PassManager(object):
+    """ Runs the AST optimization passes enabled at an optimization level.
+
+    Level 0 runs the AST as parsed, level 1 (the default) collapses wrappers and folds
+    constants, level 2 also removes dead code and common subexpressions. More passes can
+    be registered with register(); each run is timed and its node count delta recorded.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, passes=None):
+        self.level = level
+        self.passes = list(PASSES if passes is None else passes)
+        self.results = []
+
+    def register(self, optimization_pass, level=1):
+        self.passes.append((level, optimization_pass))
+
+    def enabled(self):
+        # Names of the passes run at the level
+        return [optimization_pass.name for level, optimization_pass in self.passes if level <= self.level]
+
+    def run(self, tree: Program) -> Program:
+        for level, optimization_pass in self.passes:
+            if level > self.level:
+                continue
+            transformer = optimization_pass()
+            nodes_before = count_nodes(tree)
+            start = time.perf_counter()
+            tree = transformer.run(tree)
+            elapsed = time.perf_counter() - start
+            result = PassResult(transformer.name, elapsed, nodes_before, count_nodes(tree), transformer.changed)
+            self.results.append(result)
+            logging.info(f"Optimization pass {result}")
+        return tree
+
+    def report(self):
+        lines = [f'OPTIMIZATION PASSES (level {self.level})']
+        if not self.results:
+            lines.append('no pass run')
+        lines.extend(str(result) for result in self.results)
+        return '\n'.join(lines)
@@ -0,0 +1,107 @@
+import os
+import sys
+
+
+###################
+#  OUTPUT         #
+###################
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# When the buffer is written to the sink
+FLUSH_FULL = 'full'        # when it holds buffer_size characters, and at the end of the program
+FLUSH_LINE = 'line'        # also at the end of every line
+FLUSH_ALWAYS = 'always'    # at every write
+FLUSH_POLICIES = (FLUSH_FULL, FLUSH_LINE, FLUSH_ALWAYS)
+
+
+class StdoutSink(object):
+    # sys.stdout is looked up at every write, so redirections made after the start still apply
+
+    def write(self, text):
+        sys.stdout.write(text)
+
+    def flush(self):
+        sys.stdout.flush()
+
+    def isatty(self):
+        return sys.stdout.isatty()
+
+
+class CallbackSink(object):
+    # Passes every flushed chunk of output to a function
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, text):
+        self.callback(text)
+
+
+def make_sink(target):
+    """ Sink writing to target: None for stdout, a path, a function taking the text,
+    or any object with a write method (an open file, an io.StringIO) """
+    if target is None:
+        return StdoutSink()
+    if isinstance(target, (str, os.PathLike)):
+        return open(target, 'w', encoding='utf-8')
+    if not hasattr(target, 'write') and callable(target):
+        return CallbackSink(target)
+    return target
+
+
+class OutputStream(object):
+    """ Buffered writer the engines print to.
+
+    Text is kept in a list of chunks and written to the sink in one call when
+    buffer_size characters are pending, so a program printing many short lines makes
+    few writes. The flush policy defaults to line for terminals and full otherwise;
+    the engines flush at the end of the program, the InputStream before reading input.
+    Files opened from a path are closed by close().
+    """
+
+    def __init__(self, target=None, buffer_size=DEFAULT_BUFFER_SIZE, flush_policy=None):
+        self.sink = make_sink(target)
+        self.owns_sink = isinstance(target, (str, os.PathLike))
+        if flush_policy is None:
+            isatty = getattr(self.sink, 'isatty', None)
+            flush_policy = FLUSH_LINE if isatty is not None and isatty() else FLUSH_FULL
+        if flush_policy not in FLUSH_POLICIES:
+            raise ValueError(f'Unknown flush policy {flush_policy}')
+        self.flush_policy = flush_policy
+        self.buffer_size = 0 if flush_policy == FLUSH_ALWAYS else buffer_size
+        self.line_buffered = flush_policy != FLUSH_FULL
+        self.chunks = []
+        self.pending = 0
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.pending += len(text)
+        if self.pending >= self.buffer_size:
+            if self.buffer_size:
+                self.drain()
+            else:
+                self.flush()
+
+    def newline(self):
+        self.write('\n')
+        if self.line_buffered:
+            self.flush()
+
+    def drain(self):
+        # Writes the buffer to the sink
+        if self.chunks:
+            self.sink.write(''.join(self.chunks))
+            self.chunks.clear()
+            self.pending = 0
+
+    def flush(self):
+        self.drain()
+        flush = getattr(self.sink, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        self.flush()
+        if self.owns_sink:
+            self.sink.close()
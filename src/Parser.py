@@ -1,7 +1,9 @@
 from Nodes import *
+import Nodes
 from Errors import ErrorCode, ParserError
 from Lexer import Lexer
-from Token import TokenType
+from Token import Token, TokenType
+from Trace import tracer, TOKEN
 import logging
 
 ###############
@@ -10,21 +12,35 @@ import logging
 
 
 class Parser(object):
-    def __init__(self, lexer: Lexer):
+    def __init__(self, lexer: Lexer, nodes=Nodes):
         self.lexer = lexer
+        # Constructors of the AST nodes: the Nodes classes, or a FlatAST.FlatBuilder
+        # encoding the nodes in arrays as they are parsed
+        self.nodes = nodes
         self.current_token = self.lexer.get_next_token()
 
     def error(self, error_code: ErrorCode, token: Token):
+        if token is self.current_token:
+            token = self.located_token()
         raise ParserError(
             error_code=error_code,
             token=token,
             message=f'{error_code.value} -> {token}',
         )
 
+    def located_token(self) -> Token:
+        # Keywords and operators are shared tokens without a position, statement nodes
+        # and errors get a copy located at the current offset of the lexer
+        token = self.current_token
+        if token.offset is None and token.type is not TokenType.EOF:
+            return Token(token.type, token.value, self.lexer.start, self.lexer.lines)
+        return token
+
     def eat(self, token_type):
         # Compare the token_type with the token found, if matched "eat" the token, else raise error
         if self.current_token.type == token_type:
-            logging.debug(f"Token: {token_type}")
+            if tracer.token:
+                tracer.record(TOKEN, 'eat', token_type.name, self.current_token.value)
             self.current_token = self.lexer.get_next_token()
         else:
             logging.error("Expected token {exp}, found {found}"
@@ -40,11 +56,11 @@ class Parser(object):
         It ends with a DOT '.'
          """
         self.eat(TokenType.PROGRAM)
-        var_node = self.variable()
-        prog_name = var_node.value
+        prog_name = self.current_token.value
+        self.variable()
         self.eat(TokenType.SEMI)
         block_node = self.block()
-        program_node = Program(prog_name, block_node)
+        program_node = self.nodes.Program(prog_name, block_node)
         self.eat(TokenType.DOT)
         return program_node
 
@@ -54,7 +70,7 @@ class Parser(object):
         # compound_statement"""
         declaration_nodes = self.declarations()
         compound_statement_node = self.compound_statement()
-        node = Block(declaration_nodes, compound_statement_node)
+        node = self.nodes.Block(declaration_nodes, compound_statement_node)
         return node
 
     def declarations(self) -> list:
@@ -91,7 +107,7 @@ class Parser(object):
 
         self.eat(TokenType.SEMI)
         block_node = self.block()
-        proc_decl = ProcedureDecl(proc_name, params, block_node)
+        proc_decl = self.nodes.ProcedureDecl(proc_name, params, block_node)
         self.eat(TokenType.SEMI)
         return proc_decl
 
@@ -111,7 +127,7 @@ class Parser(object):
         # This calls the type_spec method to assign the parameter to the right type
 
         for param_token in param_tokens:
-            param_node = Param(Var(param_token), type_node)
+            param_node = self.nodes.Param(self.nodes.Var(param_token), type_node)
             param_nodes.append(param_node)
 
         return param_nodes
@@ -133,12 +149,12 @@ class Parser(object):
 
     def variable_declaration(self) -> list:
         """variable_declaration : ID (COMMA ID)* COLON type_spec"""
-        var_nodes = [Var(self.current_token)]  # first ID
+        var_nodes = [self.nodes.Var(self.current_token)]  # first ID
         self.eat(TokenType.ID)
 
         while self.current_token.type == TokenType.COMMA:
             self.eat(TokenType.COMMA)
-            var_nodes.append(Var(self.current_token))
+            var_nodes.append(self.nodes.Var(self.current_token))
             self.eat(TokenType.ID)
 
         self.eat(TokenType.COLON)
@@ -146,7 +162,7 @@ class Parser(object):
         type_node = self.type_spec()  # Type node or RangeType node
         # This calls the type_spec method to assign the parameter to the right type
         var_declarations = [
-            VarDecl(var_node, type_node)  # Types: Var, Type or RangeType
+            self.nodes.VarDecl(var_node, type_node)  # Types: Var, Type or RangeType
             for var_node in var_nodes
         ]
         return var_declarations
@@ -156,10 +172,12 @@ class Parser(object):
                      | REAL    |
                      | BOOLEAN |
                      | STRING  |
-                     | ARRAY    |
+                     | TEXT    |
+                     | ARRAY    | (MAPPED STRING)?
         """
         token = self.current_token
-        if self.current_token.type in (TokenType.INTEGER, TokenType.REAL, TokenType.BOOL, TokenType.STRING):
+        if self.current_token.type in (TokenType.INTEGER, TokenType.REAL, TokenType.BOOL, TokenType.STRING,
+                                       TokenType.TEXT):
             self.eat(self.current_token.type)
 
         elif self.current_token.type == TokenType.ARRAY:
@@ -183,11 +201,16 @@ class Parser(object):
             if self.current_token.type in (TokenType.INTEGER, TokenType.REAL, TokenType.BOOL, TokenType.STRING):
                 token = self.current_token  # Type token
                 self.eat(self.current_token.type)
-                return RangeType(token, range_low, range_high)
+                path = None
+                if self.current_token.type == TokenType.MAPPED:
+                    self.eat(TokenType.MAPPED)
+                    path = self.current_token.value
+                    self.eat(TokenType.STRING)
+                return self.nodes.RangeType(token, range_low, range_high, path)
             else:
                 logging.error("The type of array elements has not been recognised")
 
-        return Type(token)
+        return self.nodes.Type(token)
 
     def compound_statement(self) -> Compound:
         """
@@ -197,10 +220,7 @@ class Parser(object):
         nodes = self.statement_list()
         self.eat(TokenType.END)
 
-        root = Compound()
-        for node in nodes:
-            root.children.append(node)
-
+        root = self.nodes.Compound(nodes)
         return root
 
     def statement_list(self) -> list[AST]:
@@ -228,6 +248,7 @@ class Parser(object):
                   | readln_statement
                   | repeat_statement
                   | setlength_statement
+                  | file_statement
                   | empty
         """
 
@@ -250,6 +271,9 @@ class Parser(object):
             node = self.repeat_statement()
         elif self.current_token.type == TokenType.SETLENGTH:
             node = self.set_length_statement()
+        elif self.current_token.type in (TokenType.ASSIGN_FILE, TokenType.RESET, TokenType.REWRITE,
+                                         TokenType.CLOSE):
+            node = self.file_statement()
         else:
             node = self.empty()
         return node
@@ -275,7 +299,7 @@ class Parser(object):
 
         self.eat(TokenType.RPAREN)
 
-        node = ProcedureCall(
+        node = self.nodes.ProcedureCall(
             proc_name=proc_name,
             actual_params=actual_params,
             token=token,
@@ -284,7 +308,7 @@ class Parser(object):
 
 
     def set_length_statement(self) -> Setlength:
-        token = self.current_token
+        token = self.located_token()
         self.eat(TokenType.SETLENGTH)
         self.eat(TokenType.LPAREN)
         var_node = self.variable()
@@ -292,30 +316,47 @@ class Parser(object):
         length_node = self.expr()
         self.eat(TokenType.RPAREN)
 
-        return Setlength(token=token, var_node=var_node, length_node=length_node)
+        return self.nodes.Setlength(token=token, var_node=var_node, length_node=length_node)
+
+    def file_statement(self) -> FileProcedure:
+        """
+        file_statement : ASSIGN LPAREN variable COMMA expr RPAREN
+                       | (RESET | REWRITE | CLOSE) LPAREN variable RPAREN
+        """
+        token = self.located_token()
+        self.eat(token.type)
+        self.eat(TokenType.LPAREN)
+        var_node = self.variable()
+        name_node = None
+        if token.type == TokenType.ASSIGN_FILE:
+            self.eat(TokenType.COMMA)
+            name_node = self.expr()
+        self.eat(TokenType.RPAREN)
+
+        return self.nodes.FileProcedure(token=token, var_node=var_node, name_node=name_node)
 
     def while_statement(self) -> While:
-        token = self.current_token
+        token = self.located_token()
         self.eat(TokenType.WHILE)
         condition_node = self.expr()
         do_node = self.do_statement()
 
-        return While(token=token, condition_node=condition_node, do_node=do_node)
+        return self.nodes.While(token=token, condition_node=condition_node, do_node=do_node)
 
     def repeat_statement(self) -> Repeat:
-        token = self.current_token
+        token = self.located_token()
         self.eat(TokenType.REPEAT)
         repeat_node = self.statement()
         self.eat(TokenType.UNTIL)
         condition_node = self.expr()
 
-        return Repeat(token=token, repeat_node=repeat_node, condition_node=condition_node)
+        return self.nodes.Repeat(token=token, repeat_node=repeat_node, condition_node=condition_node)
 
     def do_statement(self) -> Do:
         token = self.current_token
         self.eat(TokenType.DO)
         child = self.statement()
-        return Do(token=token, child=child)
+        return self.nodes.Do(token=token, child=child)
 
     def conditional_statement(self) -> Condition:
 
@@ -323,7 +364,7 @@ class Parser(object):
         if_statement : IF condition THEN statement (ELSE statement)?
         """
 
-        token = self.current_token
+        token = self.located_token()
         self.eat(TokenType.IF)
         condition_node = self.expr()
         then_node = self.then_statement()
@@ -333,26 +374,26 @@ class Parser(object):
         if self.current_token.type == TokenType.ELSE:
             else_node = self.else_statement()
 
-        return Condition(token=token, condition_node=condition_node, then_node=then_node, else_node=else_node)
+        return self.nodes.Condition(token=token, condition_node=condition_node, then_node=then_node, else_node=else_node)
 
     def then_statement(self) -> Then:
 
         token = self.current_token
         self.eat(TokenType.THEN)
         child = self.statement()
-        return Then(token=token, child=child)
+        return self.nodes.Then(token=token, child=child)
 
     def else_statement(self) -> Else:
 
         token = self.current_token
         self.eat(TokenType.ELSE)
         child = self.statement()
-        return Else(token=token, child=child)
+        return self.nodes.Else(token=token, child=child)
 
     def writeln_statement(self) -> Writeln:
 
         node_list = []
-        token = self.current_token
+        token = self.located_token()
         self.eat(TokenType.WRITELN)
         self.eat(TokenType.LPAREN)
 
@@ -365,11 +406,11 @@ class Parser(object):
             node_list.append(node)
 
         self.eat(TokenType.RPAREN)
-        return Writeln(token=token, node_list=node_list)
+        return self.nodes.Writeln(token=token, node_list=node_list)
 
     def readln_statement(self) -> Readln:
         node_list = []
-        token = self.current_token
+        token = self.located_token()
         self.eat(TokenType.READLN)
         self.eat(TokenType.LPAREN)
         node = self.variable()
@@ -382,7 +423,7 @@ class Parser(object):
 
         self.eat(TokenType.RPAREN)
 
-        return Readln(token=token, node_list=node_list)
+        return self.nodes.Readln(token=token, node_list=node_list)
 
     def assignment_statement(self) -> Assign:
         """
@@ -392,7 +433,7 @@ class Parser(object):
         token = self.current_token
         self.eat(TokenType.ASSIGN)
         right = self.expr()
-        node = Assign(left, token, right)
+        node = self.nodes.Assign(left, token, right)
         return node
 
     def variable(self) -> Var | IndexVar:
@@ -410,13 +451,12 @@ class Parser(object):
                 self.eat(TokenType.L_SQ_PAREN)
                 index = self.expr()
                 self.eat(TokenType.R_SQ_PAREN)
-                return IndexVar(token, index)
+                return self.nodes.IndexVar(token, index)
 
-        return Var(token)
+        return self.nodes.Var(token)
 
-    @staticmethod
-    def empty() -> AST:
-        return NoOp()
+    def empty(self) -> AST:
+        return self.nodes.NoOp()
 
 ########################################
 #  Mathematical and logical operators  #
@@ -434,7 +474,7 @@ class Parser(object):
         while self.current_token.type is TokenType.OR:
             token = self.current_token
             self.eat(token.type)
-            node = BinOp(left=node, op=token, right=self.sixth_priority())
+            node = self.nodes.BinOp(left=node, op=token, right=self.sixth_priority())
 
         return node
 
@@ -447,7 +487,7 @@ class Parser(object):
         while self.current_token.type is TokenType.AND:
             token = self.current_token
             self.eat(token.type)
-            node = BinOp(left=node, op=token, right=self.fifth_priority())
+            node = self.nodes.BinOp(left=node, op=token, right=self.fifth_priority())
 
         return node
 
@@ -460,7 +500,7 @@ class Parser(object):
         while self.current_token.type in (TokenType.EQUAL, TokenType.NOT_EQ):
             token = self.current_token
             self.eat(token.type)
-            node = BinOp(left=node, op=token, right=self.fourth_priority())
+            node = self.nodes.BinOp(left=node, op=token, right=self.fourth_priority())
 
         return node
 
@@ -473,7 +513,7 @@ class Parser(object):
         while self.current_token.type in (TokenType.GREATER, TokenType.GREAT_EQ, TokenType.LESSER, TokenType.LESS_EQ):
             token = self.current_token
             self.eat(token.type)
-            node = BinOp(left=node, op=token, right=self.expr())
+            node = self.nodes.BinOp(left=node, op=token, right=self.expr())
 
         return node
 
@@ -490,7 +530,7 @@ class Parser(object):
             elif token.type == TokenType.MINUS:
                 self.eat(TokenType.MINUS)
 
-            node = BinOp(left=node, op=token, right=self.second_priority())
+            node = self.nodes.BinOp(left=node, op=token, right=self.second_priority())
 
         return node
 
@@ -507,7 +547,7 @@ class Parser(object):
             elif token.type == TokenType.FLOAT_DIV:
                 self.eat(TokenType.FLOAT_DIV)
 
-            node = BinOp(left=node, op=token, right=self.first_priority())
+            node = self.nodes.BinOp(left=node, op=token, right=self.first_priority())
 
         return node
 
@@ -518,36 +558,43 @@ class Parser(object):
         token = self.current_token
         if token.type == TokenType.PLUS:
             self.eat(TokenType.PLUS)
-            node = UnaryOp(token, self.first_priority())
+            node = self.nodes.UnaryOp(token, self.first_priority())
             return node
         elif token.type == TokenType.MINUS:
             self.eat(TokenType.MINUS)
-            node = UnaryOp(token, self.first_priority())
+            node = self.nodes.UnaryOp(token, self.first_priority())
             return node
         elif token.type == TokenType.NOT:
             self.eat(TokenType.NOT)
-            node = UnaryOp(token, self.first_priority())
+            node = self.nodes.UnaryOp(token, self.first_priority())
             return node
         elif token.type == TokenType.INTEGER_CONST:
             self.eat(TokenType.INTEGER_CONST)
-            return Num(token)
+            return self.nodes.Num(token)
         elif token.type == TokenType.REAL_CONST:
             self.eat(TokenType.REAL_CONST)
-            return Num(token)
+            return self.nodes.Num(token)
         elif token.type == TokenType.TRUE:
             self.eat(TokenType.TRUE)
-            return Boolean(token)
+            return self.nodes.Boolean(token)
         elif token.type == TokenType.FALSE:
             self.eat(TokenType.FALSE)
-            return Boolean(token)
+            return self.nodes.Boolean(token)
         elif token.type == TokenType.STRING:
             self.eat(TokenType.STRING)
-            return String(token)
+            return self.nodes.String(token)
         elif token.type == TokenType.LPAREN:
             self.eat(TokenType.LPAREN)
             node = self.expr()
             self.eat(TokenType.RPAREN)
             return node
+        elif token.type == TokenType.EOF_FUNCTION:
+            token = self.located_token()
+            self.eat(TokenType.EOF_FUNCTION)
+            self.eat(TokenType.LPAREN)
+            var_node = self.variable()
+            self.eat(TokenType.RPAREN)
+            return self.nodes.Eof(token=token, var_node=var_node)
         else:
             node = self.variable()  # Handles array variables (Ex. arr[5])
             return node
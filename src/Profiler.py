@@ -0,0 +1,190 @@
+from Interpreter import Interpreter
+from Nodes import STATEMENTS, statement_line
+import linecache
+import time
+
+
+###################
+#  PROFILER       #
+###################
+
+
+class Stats(object):
+    __slots__ = ('count', 'inclusive', 'exclusive')
+
+    def __init__(self):
+        self.count = 0       # executions of the line, calls of the procedure
+        self.inclusive = 0   # ns, with the nested statements or calls
+        self.exclusive = 0   # ns, without them
+
+
+class Profile(object):
+    """ Counts and times of a run of the ProfilingInterpreter.
+
+    lines maps a line number to the Stats of its statements, procedures a name
+    qualified by the enclosing procedures (Outer.Inner, the program name for the
+    main block) to the Stats of its calls and stacks a tuple of these names,
+    outermost first, to the exclusive time spent there. Nested procedures sharing
+    a name in different scopes are counted apart.
+    Inclusive times do not count again the recursive executions of a line or a
+    procedure already running.
+    """
+
+    def __init__(self):
+        self.lines = {}
+        self.procedures = {}
+        self.stacks = {}
+
+    def report(self, path=None, limit=20):
+        """ Procedures and the limit slowest lines by exclusive time, with their source
+        when path, the source file, is given """
+        lines = ['PROFILE', '{:<20} {:>10} {:>14} {:>14}'.format('procedure', 'calls', 'inclusive ms', 'exclusive ms')]
+        for name, stats in sorted(self.procedures.items(), key=lambda item: -item[1].exclusive):
+            lines.append(_format_row(f'{name:<20}', stats))
+        lines.append('{:<20} {:>10} {:>14} {:>14}'.format('line', 'count', 'inclusive ms', 'exclusive ms'))
+        hottest = sorted(self.lines.items(), key=lambda item: -item[1].exclusive)[:limit]
+        for lineno, stats in hottest:
+            row = _format_row(f"{lineno if lineno is not None else '?':<20}", stats)
+            if path is not None and lineno is not None:
+                row += '  ' + linecache.getline(path, lineno).strip()
+            lines.append(row)
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        """ Call stacks in the collapsed format of flame graph tools: the frames
+        separated by ';' and the exclusive time in microseconds """
+        return ''.join(
+            '{stack} {time}\n'.format(stack=';'.join(stack), time=elapsed // 1000)
+            for stack, elapsed in sorted(self.stacks.items())
+        )
+
+    def save_collapsed(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+
+def _format_row(name, stats):
+    return '{name} {count:>10} {inclusive:>14.3f} {exclusive:>14.3f}'.format(
+        name=name,
+        count=stats.count,
+        inclusive=stats.inclusive / 1e6,
+        exclusive=stats.exclusive / 1e6,
+    )
+
+
+class ProfilingInterpreter(Interpreter):
+    """ Tree walking interpreter measuring every statement and procedure call.
+
+    Statements are attributed to the line of their token (of their variable for
+    assignments), procedures to their ProcedureSymbol. Timing every statement
+    makes the run several times slower, the proportions are what matters.
+    """
+
+    def __init__(self, tree, output=None, input=None):
+        super().__init__(tree, output, input)
+        self.profile = Profile()
+        self.line_numbers = {}   # statement node -> line number
+        self.running_lines = {}  # line number -> executions in progress
+        self.line_stack = []     # line numbers of the running statements, innermost last
+        self.line_children = []  # ns spent in the statements nested in each running statement
+        self.procedure_names = {}     # ProcedureSymbol -> qualified name
+        self.active_procedures = {}  # procedure -> calls in progress
+        self.procedure_stack = []     # names of the running procedures, innermost last
+        self.procedure_children = []  # ns spent in the calls nested in each running procedure
+
+    def report(self, path=None, limit=20):
+        return self.profile.report(path, limit)
+
+    def line_of(self, node):
+        lineno = self.line_numbers.get(node, 0)
+        if lineno == 0:
+            lineno = self.line_numbers[node] = statement_line(node)
+        return lineno
+
+    def visit(self, node):
+        # The dispatch of NodeVisitor.visit is inlined and procedures are timed here,
+        # so profiling adds no Python frame and deep recursion fails at the same depth
+        # as in the tree walking interpreter
+        kind = type(node).__name__
+        visitor = getattr(self, 'visit_' + kind, self.generic_visit)
+        if kind not in STATEMENTS:
+            return visitor(node)
+
+        lineno = self.line_of(node)
+        stats = self.profile.lines.get(lineno)
+        if stats is None:
+            stats = self.profile.lines[lineno] = Stats()
+        line_stack = self.line_stack
+        if not line_stack or line_stack[-1] is None or line_stack[-1] != lineno:
+            stats.count += 1  # a statement nested on the same line is part of the execution
+        line_stack.append(lineno)
+        running = self.running_lines
+        running[lineno] = running.get(lineno, 0) + 1
+        children = self.line_children
+        children.append(0)
+        procedure = None
+        if kind == 'ProcedureCall':
+            procedure = self.enter_procedure(node.proc_symbol, self.procedure_name(node))
+
+        start = time.perf_counter_ns()
+        result = visitor(node)
+        elapsed = time.perf_counter_ns() - start
+
+        if procedure is not None:
+            self.leave_procedure(node.proc_symbol, procedure, elapsed)
+        stats.exclusive += elapsed - children.pop()
+        line_stack.pop()
+        running[lineno] -= 1
+        if not running[lineno]:
+            stats.inclusive += elapsed
+        if children:
+            children[-1] += elapsed
+        return result
+
+    def visit_Program(self, node):
+        procedure = self.enter_procedure(node.name, node.name)
+        start = time.perf_counter_ns()
+        super().visit_Program(node)
+        self.leave_procedure(node.name, procedure, time.perf_counter_ns() - start)
+
+    def procedure_name(self, node):
+        proc_symbol = node.proc_symbol
+        name = self.procedure_names.get(proc_symbol)
+        if name is None:
+            if proc_symbol is None:
+                return node.proc_name
+            # The scopes enclosing the declaration are the active frames of the display
+            # below the level of the procedure
+            display = self.display
+            enclosing = [display[level].name for level in range(2, proc_symbol.scope_level + 1)]
+            name = self.procedure_names[proc_symbol] = '.'.join(enclosing + [proc_symbol.name])
+        return name
+
+    def enter_procedure(self, key, name):
+        profile = self.profile
+        stats = profile.procedures.get(name)
+        if stats is None:
+            stats = profile.procedures[name] = Stats()
+        stats.count += 1
+        active = self.active_procedures
+        active[key] = active.get(key, 0) + 1
+        self.procedure_stack.append(name)
+        self.line_stack.append(None)  # the statements of the body are new executions of their lines
+        self.procedure_children.append(0)
+        return stats
+
+    def leave_procedure(self, key, stats, elapsed):
+        children = self.procedure_children
+        exclusive = elapsed - children.pop()
+        stats.exclusive += exclusive
+        self.line_stack.pop()
+        active = self.active_procedures
+        active[key] -= 1
+        if not active[key]:
+            stats.inclusive += elapsed  # the outermost call of a recursion
+        stack = self.procedure_stack
+        names = tuple(stack)
+        self.profile.stacks[names] = self.profile.stacks.get(names, 0) + exclusive
+        stack.pop()
+        if children:
+            children[-1] += elapsed
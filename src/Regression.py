@@ -0,0 +1,134 @@
+import json
+import random
+import statistics
+
+
+###########################
+#  REGRESSION CHECK       #
+###########################
+
+DEFAULT_THRESHOLD = 0.10    # slowdown of the median tolerated
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MIN_TIME = 0.001    # s, phases faster than this in the baseline are too noisy to check
+RESAMPLES = 2000
+
+# Verdicts
+REGRESSION = 'REGRESSION'
+IMPROVEMENT = 'improvement'
+UNCHANGED = 'ok'
+TOO_SHORT = 'too short'
+MISSING = 'missing'
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def ratio_interval(baseline, current, confidence=DEFAULT_CONFIDENCE, resamples=RESAMPLES, seed=0):
+    """ Bootstrap confidence interval of median(current) / median(baseline): both
+    series of times are resampled with replacement and the ratio of the medians
+    computed for every resample. The seed makes the interval reproducible. """
+    rng = random.Random(seed)
+    ratios = []
+    for _ in range(resamples):
+        base = statistics.median(rng.choices(baseline, k=len(baseline)))
+        if base <= 0:
+            continue
+        ratios.append(statistics.median(rng.choices(current, k=len(current))) / base)
+    if not ratios:
+        return None, None
+    ratios.sort()
+    tail = (1 - confidence) / 2
+    low = ratios[int(tail * (len(ratios) - 1))]
+    high = ratios[int((1 - tail) * (len(ratios) - 1))]
+    return low, high
+
+
+class Comparison(object):
+    """ Times of a phase of a benchmark in the baseline and in the current run.
+
+    The phase regresses when its median is more than threshold slower than in the
+    baseline and the confidence interval of the ratio of the medians is above 1,
+    so the slowdown is not explained by the noise of the runs.
+    """
+
+    def __init__(self, benchmark, phase, baseline, current, threshold=DEFAULT_THRESHOLD,
+                 confidence=DEFAULT_CONFIDENCE, min_time=DEFAULT_MIN_TIME):
+        self.benchmark = benchmark
+        self.phase = phase
+        self.baseline = baseline    # seconds of every run, None when the phase is not in the baseline
+        self.current = current
+        self.ratio = self.low = self.high = None
+        if not baseline or not current:
+            self.verdict = MISSING
+            return
+        base = statistics.median(baseline)
+        if base > 0:
+            self.ratio = statistics.median(current) / base
+            self.low, self.high = ratio_interval(baseline, current, confidence)
+        if base < min_time or self.ratio is None:
+            self.verdict = TOO_SHORT
+        elif self.ratio > 1 + threshold and self.low > 1:
+            self.verdict = REGRESSION
+        elif self.ratio < 1 / (1 + threshold) and self.high < 1:
+            self.verdict = IMPROVEMENT
+        else:
+            self.verdict = UNCHANGED
+
+    def __str__(self):
+        def ms(times):
+            return f'{statistics.median(times) * 1000:.3f}' if times else '-'
+
+        def change(ratio):
+            return f'{(ratio - 1) * 100:+.1f}%' if ratio is not None else '-'
+
+        interval = f'[{change(self.low)}, {change(self.high)}]' if self.low is not None else ''
+        return '{benchmark:<12} {phase:<20} {base:>12} {current:>12} {change:>9} {interval:>20}  {verdict}'.format(
+            benchmark=self.benchmark,
+            phase=self.phase,
+            base=ms(self.baseline),
+            current=ms(self.current),
+            change=change(self.ratio),
+            interval=interval,
+            verdict=self.verdict,
+        )
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, confidence=DEFAULT_CONFIDENCE,
+            min_time=DEFAULT_MIN_TIME):
+    """ Comparisons of every phase of every benchmark in the two results of Benchmark.suite_json """
+    comparisons = []
+    base_benchmarks = baseline['benchmarks']
+    current_benchmarks = current['benchmarks']
+    for name in list(base_benchmarks) + [name for name in current_benchmarks if name not in base_benchmarks]:
+        base_times = base_benchmarks.get(name, {}).get('times', {})
+        current_times = current_benchmarks.get(name, {}).get('times', {})
+        for phase in list(base_times) + [phase for phase in current_times if phase not in base_times]:
+            comparisons.append(Comparison(name, phase, base_times.get(phase), current_times.get(phase),
+                                          threshold, confidence, min_time))
+    return comparisons
+
+
+def report(comparisons, baseline, current, threshold=DEFAULT_THRESHOLD, confidence=DEFAULT_CONFIDENCE):
+    lines = [f'REGRESSION CHECK (threshold {threshold * 100:g}%, {confidence * 100:g}% confidence)']
+    for key in ('python', 'platform', 'scale', 'optimization_level'):
+        if baseline.get(key) != current.get(key):
+            lines.append(f'warning: the baseline was measured with {key} {baseline.get(key)}, '
+                         f'this run with {current.get(key)}')
+    lines.append('{:<12} {:<20} {:>12} {:>12} {:>9} {:>20}'.format(
+        'benchmark', 'phase', 'baseline ms', 'current ms', 'change', f'{confidence * 100:g}% interval'))
+    lines.extend(str(comparison) for comparison in comparisons)
+    regressions = [comparison for comparison in comparisons if comparison.verdict == REGRESSION]
+    if regressions:
+        lines.append('{count} regressed: {phases}'.format(
+            count=len(regressions),
+            phases=', '.join(f'{comparison.benchmark} {comparison.phase}' for comparison in regressions),
+        ))
+    else:
+        lines.append('no regression')
+    return '\n'.join(lines)
+
+
+def regressed(comparisons):
+    return any(comparison.verdict == REGRESSION for comparison in comparisons)
@@ -1,21 +1,189 @@
 from SemanticAnalysis import *
 from Parser import Parser
-from Lexer import Lexer
+from Lexer import Lexer, FileLexer
 from Interpreter import Interpreter
+from ClosureCompiler import ClosureCompiler
+from VM import VirtualMachine
+from Transpiler import PythonInterpreter
+from JIT import TieredInterpreter
+from Profiler import ProfilingInterpreter
+from Optimizer import PassManager, DEFAULT_LEVEL
+from Errors import CompilerError
+from Cache import source_digest, file_digest
+from Output import StdoutSink
+import FlatAST
+import Nodes
+import logging
 
 
-def build(text):
+# Execution engines selectable with build(text, engine=...)
+ENGINES = {
+    'tree': Interpreter,        # Tree walking interpreter
+    'closure': ClosureCompiler,  # AST compiled once into closures
+    'vm': VirtualMachine,       # AST compiled to bytecode run by a stack machine
+    'python': PythonInterpreter,  # AST transpiled to Python source run by CPython
+    'jit': TieredInterpreter,   # Tree walker compiling hot procedures and loops to closures
+    'profile': ProfilingInterpreter,  # Tree walker timing every line and procedure
+}
 
-    lexer = Lexer(text)
-    parser = Parser(lexer)
-    tree = parser.parse()
+# Engines walking the nodes without compiling them, they also run flat ASTs
+TREE_ENGINES = ('tree', 'profile')
+
+
+def build(text, engine='tree', dump_source=None, optimization_level=None, pass_manager=None,
+          drop_tokens=False, flat=False, cache=None, output_cache=None, sample_interval=None, **engine_options):
+    digest = None
+    if cache is not None or output_cache is not None:
+        digest = source_digest(text)
+    return run(lambda: Lexer(text), digest, engine, dump_source, optimization_level, pass_manager, drop_tokens,
+               flat, cache, output_cache, sample_interval, **engine_options)
+
+
+def build_file(path, engine='tree', dump_source=None, optimization_level=None, pass_manager=None,
+               drop_tokens=False, flat=False, cache=None, output_cache=None, sample_interval=None,
+               **engine_options):
+    digest = None
+    if cache is not None or output_cache is not None:
+        digest = file_digest(path)
+    # The source is lexed from a memory map of the file, it is never read into a string
+    return run(lambda: FileLexer(path), digest, engine, dump_source, optimization_level, pass_manager,
+               drop_tokens, flat, cache, output_cache, sample_interval, **engine_options)
+
+
+def run(open_lexer, digest=None, engine='tree', dump_source=None, optimization_level=None,
+        pass_manager=None, drop_tokens=False, flat=False, cache=None, output_cache=None, sample_interval=None,
+        **engine_options):
+    """ Runs the source lexed by open_lexer(). digest, the digest of the source, is only
+    needed with the AST cache or the output cache. With sample_interval the call stack is
+    sampled while the program runs (interpreter.sampler). Returns the interpreter, or None
+    when the program has a semantic error or when its output was replayed from output_cache.
+    optimization_level is DEFAULT_LEVEL when not given, a flat AST is not optimized: flat
+    raises a ValueError with an optimization level above 0, a pass manager, drop_tokens,
+    a cache or dump_source.
+    """
+
+    if flat:
+        ignored = [option for option, used in (
+            ('optimization_level', optimization_level),
+            ('pass_manager', pass_manager is not None),
+            ('drop_tokens', drop_tokens),
+            ('cache', cache is not None),
+            ('output_cache', output_cache is not None),
+            ('dump_source', dump_source is not None),
+        ) if used]
+        if ignored:
+            raise ValueError(f"Flat ASTs cannot be run with {', '.join(ignored)}")
+        # Nodes encoded in arrays (FlatAST.py), walked through views by the
+        # semantic analyzer and the tree walking interpreter only
+        return run_flat(FlatAST.parse(open_lexer()), engine, sample_interval=sample_interval, **engine_options)
+
+    output_key = None
+    output = engine_options.get('output')
+    if output_cache is not None and (output is None or isinstance(output.sink, StdoutSink)):
+        # Only the output printed to stdout by programs without readln or files is stored
+        output_key = output_cache.key(digest)
+        if output_cache.replay(output_key):
+            return None
+
+    tree = front_end(open_lexer, digest, optimization_level, pass_manager, drop_tokens, cache)
+    if tree is None:
+        return None
+
+    if output_key is not None and not depends_on_files(tree):
+        with output_cache.recording(output_key):
+            return execute(tree, engine, dump_source, sample_interval, **engine_options)
+    return execute(tree, engine, dump_source, sample_interval, **engine_options)
+
+
+def front_end(open_lexer, digest=None, optimization_level=None, pass_manager=None, drop_tokens=False,
+              cache=None):
+    """ Analysed and optimized tree of the source, None after a semantic error """
+    if pass_manager is None:
+        pass_manager = PassManager(DEFAULT_LEVEL if optimization_level is None else optimization_level)
+
+    cache_key = None
+    if cache is not None:
+        # The analysed tree depends on the source, the passes run and the tokens kept
+        cache_key = cache.key(digest, pass_manager.enabled(), drop_tokens)
+        tree = cache.load(cache_key)
+        if tree is not None:
+            return tree
+
+    lexer = open_lexer()
+    try:
+        parser = Parser(lexer)
+        tree = parser.parse()
+    finally:
+        lexer.close()
     semantic_analyzer = SemanticAnalyzer()
 
     try:
         semantic_analyzer.visit(tree)
 
-    except Exception as e:
-        print(e)
+    except SemanticError as e:
+        # Without analysis variables have no frame slot, the program cannot run
+        print(e.message)
+        return None
+
+    # AST to AST optimization passes enabled at the optimization level
+    tree = pass_manager.run(tree)
+
+    if drop_tokens:
+        # Positions and lexemes are only needed by the front end error messages
+        Nodes.drop_tokens(tree)
+
+    if cache_key is not None:
+        # Analysed and optimized, the next runs of the source start from here
+        cache.store(cache_key, tree)
+
+    return tree
+
+
+def execute(tree, engine='tree', dump_source=None, sample_interval=None, **engine_options):
+    interpreter = ENGINES[engine](tree, **engine_options)
+    try:
+        interpreter.prepare()
+    except CompilerError as e:
+        # Nothing has run yet, the tree walker can run the program instead
+        logging.warning(f"{e.message}, falling back to the tree walking interpreter")
+        interpreter = Interpreter(tree, interpreter.output, interpreter.input)
+    if dump_source is not None and isinstance(interpreter, PythonInterpreter):
+        with open(dump_source, 'w') as f:
+            f.write(interpreter.source)
+    interpret(interpreter, sample_interval)
+    return interpreter
+
+
+def interpret(interpreter, sample_interval=None):
+    if sample_interval is None:
+        return interpreter.interpret()
+    interpreter.start_sampling(sample_interval)
+    try:
+        return interpreter.interpret()
+    finally:
+        interpreter.stop_sampling()
+
+
+def depends_on_files(tree):
+    """ Whether the output of the program may not only depend on its source: it reads
+    input, uses text files or arrays mapped on a file """
+    return (Nodes.contains(tree, (Nodes.Readln, Nodes.FileProcedure))
+            or Nodes.contains(tree, Nodes.RangeType, lambda node: node.path is not None))
+
+
+def run_flat(flat_ast, engine='tree', output=None, input=None, sample_interval=None, **engine_options):
+    tree = flat_ast.root
+    try:
+        SemanticAnalyzer().visit(tree)
+
+    except SemanticError as e:
+        print(e.message)
+        return None
 
-    interpreter = Interpreter(tree)
-    result = interpreter.interpret()
+    if engine not in TREE_ENGINES:
+        # The other engines key their compiled code on node objects
+        logging.warning(f"The {engine} engine does not run flat ASTs, using the tree walking interpreter")
+        engine = 'tree'
+    interpreter = ENGINES[engine](tree, output, input)
+    interpret(interpreter, sample_interval)
+    return interpreter
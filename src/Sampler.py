@@ -0,0 +1,142 @@
+from Nodes import STATEMENTS, statement_line
+import linecache
+import sys
+import threading
+import time
+
+
+###################
+#  SAMPLER        #
+###################
+
+DEFAULT_INTERVAL = 0.005  # s, the switch interval of the GIL: sampling faster waits for the GIL anyway
+
+# Modules of the code compiled from the program, its frames have no statement node
+COMPILED_MODULES = frozenset(('ClosureCompiler',))
+
+
+class Sampler(object):
+    """ Statistical profiler of the Pascal call stack of an engine.
+
+    A background thread wakes up every interval seconds and records the names of
+    the frames on the call stack of the interpreter and the line of the statement
+    the running thread is executing. The interpreter does no extra work: the
+    cost is the time the sampler holds the GIL, a few microseconds per sample.
+    Lines are found in the tree walking engines (tree, profile, jit before
+    compiling); the compiled engines only give the call stack, the python engine
+    no Pascal frame at all.
+    """
+
+    def __init__(self, interpreter, interval=DEFAULT_INTERVAL, thread_id=None):
+        self.interpreter = interpreter
+        self.interval = interval
+        # Thread running the program, the one starting the sampler by default
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stacks = {}    # (frame names outermost first, line) -> samples
+        self.samples = 0
+        self.busy = 0       # ns spent sampling
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.thread is not None:
+            raise RuntimeError('The sampler is already running')
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='Sampler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        return self
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        start = time.perf_counter_ns()
+        # tuple() copies the list in one step, the program may push or pop meanwhile
+        frames = tuple(self.interpreter.call_stack.frames)
+        key = (tuple(frame.name for frame in frames), self.current_line())
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+        self.busy += time.perf_counter_ns() - start
+
+    def current_line(self):
+        # Innermost statement visited by a NodeVisitor in the running thread, unless
+        # compiled code runs inside it (a procedure promoted by the jit engine)
+        python_frame = sys._current_frames().get(self.thread_id)
+        while python_frame is not None:
+            if python_frame.f_globals.get('__name__') in COMPILED_MODULES:
+                return None
+            if python_frame.f_code.co_name == 'visit':
+                node = python_frame.f_locals.get('node')
+                if type(node).__name__ in STATEMENTS:
+                    return statement_line(node)
+            python_frame = python_frame.f_back
+        return None
+
+    # Results
+
+    def procedures(self):
+        """ name -> (samples in the procedure itself, samples with it on the stack) """
+        procedures = {}
+        for (names, _), count in self.stacks.items():
+            for name in set(names):
+                own, total = procedures.get(name, (0, 0))
+                procedures[name] = (own + count if name == names[-1] else own, total + count)
+        return procedures
+
+    def lines(self):
+        """ line number -> samples """
+        lines = {}
+        for (_, line), count in self.stacks.items():
+            if line is not None:
+                lines[line] = lines.get(line, 0) + count
+        return lines
+
+    def report(self, path=None, limit=20):
+        """ Histogram of the procedures and of the limit most sampled lines, with their
+        source when path, the source file, is given """
+        samples = self.samples or 1
+        lines = [
+            'SAMPLES',
+            '{count} samples every {interval:.1f} ms ({outside} outside a Pascal frame), '
+            '{busy:.3f} ms spent sampling'.format(
+                count=self.samples, interval=self.interval * 1000, busy=self.busy / 1e6,
+                outside=sum(count for (names, _), count in self.stacks.items() if not names)),
+            '{:<20} {:>10} {:>10} {:>10}'.format('procedure', 'self', 'total', 'self %'),
+        ]
+        for name, (own, total) in sorted(self.procedures().items(), key=lambda item: -item[1][0]):
+            lines.append(f'{name:<20} {own:>10} {total:>10} {own * 100 / samples:>10.1f}')
+        lines.append('{:<20} {:>10} {:>10}'.format('line', 'samples', '%'))
+        hottest = sorted(self.lines().items(), key=lambda item: -item[1])[:limit]
+        for lineno, count in hottest:
+            row = f'{lineno:<20} {count:>10} {count * 100 / samples:>10.1f}'
+            if path is not None:
+                row += '  ' + linecache.getline(path, lineno).strip()
+            lines.append(row)
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        """ Samples by call stack in the collapsed format of flame graph tools,
+        the line of the statement as the innermost frame """
+        stacks = {}
+        for (names, line), count in self.stacks.items():
+            if not names:
+                continue
+            stack = ';'.join(names if line is None else names + (f'line {line}',))
+            stacks[stack] = stacks.get(stack, 0) + count
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+
+    def save_collapsed(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
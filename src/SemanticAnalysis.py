@@ -1,4 +1,8 @@
 from src.Errors import SemanticError, ErrorCode
+from Token import TokenType
+from Input import READ_ARRAY
+from src.ConstraintDict import MAPPED_TYPECODES
+from Trace import tracer, SYMBOL, SCOPE
 import logging
 
 
@@ -56,6 +60,8 @@ class VarSymbol(Symbol):
 
     def __init__(self, name, type):
         super().__init__(name, type)
+        self.slot = None  # index in the frame of the scope, set on insertion
+        self.element_type = None  # name of the element type of arrays
 
     def __str__(self):
         return "<{class_name}(name='{name}', type='{type}')>".format(
@@ -74,6 +80,8 @@ class ProcedureSymbol(Symbol):
         self.formal_params = [] if formal_params is None else formal_params
         # a reference to procedure's body (AST sub-tree)
         self.block_ast = None
+        # names of the procedure's variables by slot index, sizes its frames
+        self.slot_names = []
 
     def __str__(self):
         return '<{class_name}(name={name}, parameters={params})>'.format(
@@ -91,6 +99,7 @@ class ScopedSymbolTable(object):
         self.scope_name = scope_name
         self.scope_level = scope_level
         self.enclosing_scope = enclosing_scope
+        self.slot_names = []  # one frame slot per variable, in order of insertion
 
     def _init_builtins(self):
         self.insert(BuiltinTypeSymbol('INTEGER'))
@@ -98,6 +107,7 @@ class ScopedSymbolTable(object):
         self.insert(BuiltinTypeSymbol('BOOL'))
         self.insert(BuiltinTypeSymbol('STRING'))
         self.insert(BuiltinTypeSymbol('ARRAY'))
+        self.insert(BuiltinTypeSymbol('TEXT'))
 
     def __str__(self):
         h1 = 'SCOPE (SCOPED SYMBOL TABLE)'
@@ -122,12 +132,20 @@ class ScopedSymbolTable(object):
     __repr__ = __str__
 
     def insert(self, symbol):
-        logging.info(f"Inserted symbol {symbol.name}")
+        if tracer.symbol:
+            tracer.record(SYMBOL, 'insert', symbol.name, self.scope_name)
         symbol.scope_level = self.scope_level
         self._symbols[symbol.name] = symbol
+        if isinstance(symbol, VarSymbol):
+            symbol.slot = self.allocate_slot(symbol.name)
+
+    def allocate_slot(self, name):
+        self.slot_names.append(name)
+        return len(self.slot_names) - 1
 
     def lookup(self, name, current_scope_only=False):
-        logging.info(f"Lookup: {name} (Scope: {self.scope_name})")
+        if tracer.symbol:
+            tracer.record(SYMBOL, 'lookup', name, self.scope_name)
         # 'symbol' is either an instance of the Symbol class or None
         symbol = self._symbols.get(name)
 
@@ -145,6 +163,7 @@ class ScopedSymbolTable(object):
 class SemanticAnalyzer(NodeVisitor):
     def __init__(self):
         self.current_scope = None
+        self.scope_levels = 0  # deepest scope level seen
 
     # Visit functions for semantic analyzer
     # Funzioni di visita per nodi  AST
@@ -162,7 +181,8 @@ class SemanticAnalyzer(NodeVisitor):
         self.visit(node.compound_statement)
 
     def visit_Program(self, node):
-        logging.info("Entered global scope")
+        if tracer.scope:
+            tracer.record(SCOPE, 'enter', 'global', 1)
         global_scope = ScopedSymbolTable(
             scope_name='global',
             scope_level=1,
@@ -170,14 +190,18 @@ class SemanticAnalyzer(NodeVisitor):
         )
         global_scope._init_builtins()
         self.current_scope = global_scope
+        self.scope_levels = global_scope.scope_level
+        node.slot_names = global_scope.slot_names
 
         # visit subtree
         self.visit(node.block)
+        node.scope_levels = self.scope_levels
 
         logging.debug(global_scope)
 
         self.current_scope = self.current_scope.enclosing_scope
-        logging.info("Leaving global scope")
+        if tracer.scope:
+            tracer.record(SCOPE, 'leave', 'global', 1)
 
     def visit_Compound(self, node):
         for child in node.children:
@@ -195,14 +219,17 @@ class SemanticAnalyzer(NodeVisitor):
         proc_symbol = ProcedureSymbol(proc_name)
         self.current_scope.insert(proc_symbol)
 
-        logging.info("Entered procedure scope {name}".format(name=proc_name))
-
         procedure_scope = ScopedSymbolTable(
             scope_name=proc_name,
             scope_level=self.current_scope.scope_level + 1,
             enclosing_scope=self.current_scope
         )
         self.current_scope = procedure_scope
+        if tracer.scope:
+            tracer.record(SCOPE, 'enter', proc_name, procedure_scope.scope_level)
+        self.scope_levels = max(self.scope_levels, procedure_scope.scope_level)
+        proc_symbol.slot_names = procedure_scope.slot_names
+        node.slot_names = procedure_scope.slot_names
 
         # Insert parameters into the procedure scope
         for param in node.formal_params:
@@ -215,8 +242,9 @@ class SemanticAnalyzer(NodeVisitor):
         self.visit(node.block_node)
         self.current_scope = self.current_scope.enclosing_scope
 
-        logging.info("Exiting procedure scope {name}".format(name=proc_name))
-        logging.info("Procedure scope {scope}".format(scope=procedure_scope))
+        if tracer.scope:
+            tracer.record(SCOPE, 'leave', proc_name, procedure_scope.scope_level)
+        logging.debug(procedure_scope)
 
         # accessed by the interpreter when executing procedure call
         proc_symbol.block_ast = node.block_node
@@ -225,16 +253,19 @@ class SemanticAnalyzer(NodeVisitor):
 
         if hasattr(node.type_node, 'low_range'):
             type_name = 'ARRAY'
+            if node.type_node.path is not None and node.type_node.token.value not in MAPPED_TYPECODES:
+                self.error(error_code=ErrorCode.UNSUPPORTED_TYPE, token=node.var_node.token)
         else:
             type_name = node.type_node.value
 
         type_symbol = self.current_scope.lookup(type_name)
-        logging.info("Found symbol: {name}".format(name=type_symbol))
 
         # We have all the information we need to create a variable symbol.
         # Create the symbol and insert it into the symbol table.
         var_name = node.var_node.value
         var_symbol = VarSymbol(var_name, type_symbol)
+        if type_name == 'ARRAY':
+            var_symbol.element_type = node.type_node.token.value
 
         # Signal error if the table has a symbol  with the same name
 
@@ -245,6 +276,7 @@ class SemanticAnalyzer(NodeVisitor):
             )
 
         self.current_scope.insert(var_symbol)
+        node.var_node.slot = var_symbol.slot
 
     def visit_Assign(self, node):
         self.visit(node.right)
@@ -255,18 +287,28 @@ class SemanticAnalyzer(NodeVisitor):
         var_symbol = self.current_scope.lookup(var_name)
         if var_symbol is None:
             self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token)
+        self.resolve(node, var_symbol)
 
     def visit_IndexVar(self, node):
         var_name = node.value
         var_symbol = self.current_scope.lookup(var_name)
         if var_symbol is None:
             self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token)
+        self.resolve(node, var_symbol)
+        self.visit(node.index)
+
+    def resolve(self, node, var_symbol):
+        # A reference is the slot of the variable in the frame of its scope, plus how many
+        # scope levels separate that scope from the current one (0 for local variables)
+        if not isinstance(var_symbol, VarSymbol):
+            self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token)
+        node.slot = var_symbol.slot
+        node.scope_distance = self.current_scope.scope_level - var_symbol.scope_level
 
     def visit_ProcedureCall(self, node):
 
         proc_symbol = self.current_scope.lookup(node.proc_name)
 
-        logging.info("Procedure call:{name}".format(name=proc_symbol))
         # accessed by the interpreter when executing procedure call
         node.proc_symbol = proc_symbol
 
@@ -276,11 +318,88 @@ class SemanticAnalyzer(NodeVisitor):
     def visit_Num(self, node):
         pass
 
-    def visit_UnaryOp(self, node):
+    def visit_Boolean(self, node):
         pass
 
-    def visit_Writeln(self, node):
+    def visit_String(self, node):
         pass
 
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+
+    def visit_Condition(self, node):
+        self.visit(node.condition_node)
+        self.visit(node.then_node)
+        if node.else_node is not None:
+            self.visit(node.else_node)
+
+    def visit_While(self, node):
+        self.visit(node.condition_node)
+        self.visit(node.do_node)
+
+    def visit_Repeat(self, node):
+        self.visit(node.repeat_node)
+        self.visit(node.condition_node)
+
+    def visit_Do(self, node):
+        self.visit(node.child)
+
+    def visit_Then(self, node):
+        self.visit(node.child)
+
+    def visit_Else(self, node):
+        self.visit(node.child)
+
+    def visit_Setlength(self, node):
+        self.visit(node.var_node)
+        self.visit(node.length_node)
+
+    def visit_Writeln(self, node):
+        for subnode in node.node_list:
+            if subnode.token.type != TokenType.STRING:  # String literals are parsed as Var nodes
+                self.visit(subnode)
+        node.has_file = self.is_file(node.node_list[0])
+
     def visit_Readln(self, node):
-        pass
+        read_types = []
+        for subnode in node.node_list:
+            read_type = None
+            if subnode.token.type != TokenType.STRING:
+                self.visit(subnode)
+                read_type = self.read_type(subnode)
+            read_types.append(read_type)
+        # A first argument of type TEXT is the file read from, not a target
+        node.has_file = self.is_file(node.node_list[0])
+        if node.has_file:
+            read_types[0] = None
+        node.read_types = read_types
+
+    def visit_FileProcedure(self, node):
+        self.visit_file(node.var_node)
+        if node.name_node is not None:
+            self.visit(node.name_node)
+
+    def visit_Eof(self, node):
+        self.visit_file(node.var_node)
+
+    def visit_file(self, node):
+        if node.token.type != TokenType.STRING:
+            self.visit(node)
+        if not self.is_file(node):
+            self.error(error_code=ErrorCode.FILE_EXPECTED, token=node.token)
+
+    def is_file(self, node):
+        if node.token.type == TokenType.STRING or hasattr(node, 'index'):
+            return False
+        var_symbol = self.current_scope.lookup(node.value)
+        return isinstance(var_symbol, VarSymbol) and var_symbol.type is not None and var_symbol.type.name == 'TEXT'
+
+    def read_type(self, node):
+        # Values are read as the declared type of the variable, arrays as their element type;
+        # a whole array (no index) is filled
+        var_symbol = self.current_scope.lookup(node.value)
+        if var_symbol.element_type is not None:
+            return var_symbol.element_type if hasattr(node, 'index') else READ_ARRAY
+        if var_symbol.type is None:
+            return None
+        return var_symbol.type.name
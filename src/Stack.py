@@ -11,23 +11,36 @@ class ARType(Enum):
 
 
 class Frame(object):
-    def __init__(self, name: str, type: ARType, nesting_level):
-        # Change: nesting_level not set in new version
+    # Variables live in 'slots', a list preallocated from the scope of the frame:
+    # SemanticAnalyzer gives every variable and parameter a fixed slot index
+    # and stores it on the Var and IndexVar nodes that reference it
+    __slots__ = ('name', 'type', 'nesting_level', 'return_value', 'slot_names', 'slots')
+
+    def __init__(self, name: str, type: ARType, nesting_level, slot_names=()):
         # Change: add enclosing frame
         self.name = name
         self.type = type
         self.nesting_level = nesting_level
         self.return_value = None
-        self.members = {}
+        self.slot_names = slot_names  # variable names, by slot index
+        self.slots = [None] * len(slot_names)
+
+    # Access by name, for debugging only
 
     def __setitem__(self, key, value):
-        self.members[key] = value
+        self.slots[self.slot_names.index(key)] = value
 
     def __getitem__(self, key):
-        return self.members[key]
+        return self.slots[self.slot_names.index(key)]
 
     def get(self, key):
-        return self.members.get(key)
+        if key in self.slot_names:
+            return self[key]
+        return None
+
+    @property
+    def members(self):
+        return dict(zip(self.slot_names, self.slots))
 
     def __str__(self):
         lines = [
@@ -58,7 +71,7 @@ class CallStack(object):
         return self.frames.pop()
 
     def peek(self):
-        if len(self.frames) is 0:
+        if len(self.frames) == 0:
             return None
         return self.frames[-1]
 
@@ -0,0 +1,226 @@
+from SPI import build, ENGINES
+from Output import OutputStream
+import contextlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+
+###################
+#  TESTS          #
+###################
+
+LEVELS = (0, 1, 2)
+
+# Compile on the first call and iteration, so the jit engine runs its compiled code
+ENGINE_OPTIONS = {'jit': dict(call_threshold=1, loop_threshold=1)}
+
+# Programs run by every engine at every level: name -> (source, expected output, expected error)
+CORPUS = {
+    'booleans': ('''PROGRAM Booleans;
+VAR t, u, v : BOOL; r, s : INTEGER;
+BEGIN
+    t := TRUE;
+    r := t * 1;
+    s := 0 + t;
+    u := NOT NOT t;
+    v := (r = 1) AND (s < 2);
+    writeln(r, " ", s, " ", u, " ", v)
+END.
+''', '1 1 True True\n', None),
+
+    'division': ('''PROGRAM Division;
+VAR a, z : INTEGER;
+BEGIN
+    writeln("start");
+    z := 0;
+    a := 5 DIV z;
+    a := 1;
+    writeln(a)
+END.
+''', 'start\n', ZeroDivisionError),
+
+    'recursion': ('''PROGRAM Recursion;
+VAR total, calls : INTEGER;
+PROCEDURE Sum(n : INTEGER);
+BEGIN
+    calls := calls + 1;
+    IF n > 0 THEN
+    BEGIN
+        total := total + n;
+        Sum(n - 1)
+    END
+END;
+BEGIN
+    total := 0;
+    calls := 0;
+    Sum(30);
+    writeln(total, " ", calls)
+END.
+''', '465 31\n', None),
+
+    'arrays': ('''PROGRAM Arrays;
+VAR i : INTEGER;
+ints : ARRAY [1..100] OF INTEGER;
+reals : ARRAY [0..2] OF REAL;
+flags : ARRAY [1..3] OF BOOL;
+names : ARRAY [1..2] OF STRING;
+dyn : ARRAY OF INTEGER;
+BEGIN
+    i := 1;
+    WHILE (i <= 100) DO
+    BEGIN
+        ints[i] := i * i;
+        i := i + 1;
+    END;
+    reals[1] := 3;
+    flags[2] := TRUE;
+    names[1] := "hi";
+    setlength(dyn, 5);
+    dyn[5] := ints[10];
+    writeln(ints[1], " ", ints[100], " ", reals[1], " ", reals[2]);
+    writeln(flags[1], " ", flags[2], " ", names[1], "|", names[2], "|");
+    writeln(dyn[5], " ", dyn[0])
+END.
+''', '1 10000 3.0 0.0\nFalse True hi||\n100 0\n', None),
+
+    'bounds': ('''PROGRAM Bounds;
+VAR i, a : INTEGER;
+ints : ARRAY [1..3] OF INTEGER;
+BEGIN
+    writeln("start");
+    i := 4;
+    a := ints[i];
+    a := 1;
+    writeln(a)
+END.
+''', 'start\n', SystemExit),
+
+    'errors order': ('''PROGRAM ErrorsOrder;
+VAR a, c, x, y, z : INTEGER;
+arr : ARRAY [1..3] OF INTEGER;
+BEGIN
+    writeln("start");
+    x := 6;
+    y := 0;
+    z := 5;
+    c := arr[z] + (x DIV y);
+    a := (x DIV y) + 1;
+    writeln(c, " ", a)
+END.
+''', 'start\n', SystemExit),
+
+    'uncompiled': ('''PROGRAM Uncompiled;
+VAR i, s : INTEGER;
+PROCEDURE Add(k : INTEGER);
+BEGIN
+    s := s + k;
+    IF k > 100 THEN Missing(k)
+END;
+BEGIN
+    writeln("start");
+    i := 0;
+    s := 0;
+    WHILE (i < 5) DO
+    BEGIN
+        IF i > 100 THEN Undeclared(1);
+        Add(i);
+        i := i + 1;
+    END;
+    writeln(s)
+END.
+''', 'start\n10\n', None),
+
+    'files': ('''PROGRAM Files;
+VAR f : TEXT;
+i, n, total : INTEGER;
+name : STRING;
+BEGIN
+    assign(f, "TMPDIR/numbers.txt");
+    rewrite(f);
+    i := 1;
+    WHILE (i <= 5) DO
+    BEGIN
+        writeln(f, i);
+        i := i + 1;
+    END;
+    writeln(f, "end");
+    close(f);
+    reset(f);
+    total := 0;
+    i := 1;
+    WHILE (i <= 5) DO
+    BEGIN
+        readln(f, n);
+        total := total + n;
+        i := i + 1;
+    END;
+    readln(f, name);
+    close(f);
+    writeln(total, " ", name)
+END.
+''', '15 end\n', None),
+
+    'mapped': ('''PROGRAM MappedFile;
+VAR unused : ARRAY [1..4] OF INTEGER MAPPED "TMPDIR/unused.bin";
+f : TEXT;
+b : BOOL;
+BEGIN
+    assign(f, "TMPDIR/unused.bin");
+    reset(f);
+    b := Eof(f);
+    close(f);
+    writeln(b)
+END.
+''', 'False\n', None),
+}
+
+
+def run(source, engine, level):
+    """ (output, type of the exception raised or None) of a run of source """
+    text = io.StringIO()
+    output = OutputStream(text)
+    error = None
+    # The parser prints debug lines on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            build(source, engine=engine, optimization_level=level, output=output,
+                  **ENGINE_OPTIONS.get(engine, {}))
+        except (Exception, SystemExit) as e:
+            error = type(e)
+    output.flush()
+    return text.getvalue(), error
+
+
+class DifferentialTest(unittest.TestCase):
+    """ Every engine at every optimization level prints the same output and raises
+    the same errors as the tree walking interpreter without optimization """
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.directory)
+
+    def in_new_directory(self, source):
+        # Files written by a run must not be seen by the next ones
+        directory = tempfile.mkdtemp(dir=self.directory)
+        return source.replace('TMPDIR', directory.replace(os.sep, '/'))
+
+    def test_engines_agree(self):
+        for name, (source, expected, error) in CORPUS.items():
+            with self.subTest(program=name):
+                self.assertEqual(run(self.in_new_directory(source), 'tree', 0), (expected, error))
+            for engine in ENGINES:
+                for level in LEVELS:
+                    with self.subTest(program=name, engine=engine, level=level):
+                        self.assertEqual(run(self.in_new_directory(source), engine, level), (expected, error))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,60 @@
 # Token types / tipologie di Token
 
 from enum import Enum
+from array import array
+from bisect import bisect_right
+import re
+
+
+class LineIndex(object):
+    """ Offsets of the first character of every line of a source.
+
+    Built once per source, it turns an offset into a line and a column by bisection,
+    so tokens only store their offset. Works on str and on bytes-like sources.
+    """
+
+    __slots__ = ('starts',)
+
+    def __init__(self, text):
+        newline = '\n' if isinstance(text, str) else b'\n'
+        self.starts = array('q', [0])
+        self.starts.extend(match.end() for match in re.finditer(re.escape(newline), text))
+
+    def lineno(self, offset):
+        return bisect_right(self.starts, offset)
+
+    def column(self, offset):
+        return offset - self.starts[self.lineno(offset) - 1] + 1
 
 
 class Token(object):
-    def __init__(self, type, value, lineno=None, column=None):
+    __slots__ = ('type', 'value', 'offset', 'lines')
+
+    def __init__(self, type, value, offset=None, lines=None):
         self.type = type
         self.value = value
-        self.lineno = lineno
-        self.column = column
+        self.offset = offset    # position in the source
+        self.lines = lines      # LineIndex of the source
+
+    # Line and column are only needed by error messages, they are computed on demand
+
+    @property
+    def lineno(self):
+        if self.lines is None:
+            return None
+        return self.lines.lineno(self.offset)
+
+    @property
+    def column(self):
+        if self.lines is None:
+            return None
+        return self.lines.column(self.offset)
+
+    def __reduce__(self):
+        # Shared tokens are still shared in unpickled trees
+        if SHARED_TOKENS.get(self.type) is self:
+            return shared_token, (self.type,)
+        return Token, (self.type, self.value, self.offset, self.lines)
 
     def __str__(self):
 
@@ -79,9 +125,17 @@ class TokenType(Enum):
     REPEAT = 'REPEAT'
     UNTIL = 'UNTIL'
     SETLENGTH = 'SETLENGTH'
+    TEXT = 'TEXT'  # Text files and their procedures
+    ASSIGN_FILE = 'ASSIGN'
+    RESET = 'RESET'
+    REWRITE = 'REWRITE'
+    CLOSE = 'CLOSE'
+    MAPPED = 'MAPPED'  # Arrays stored in a file
     DO = 'DO'
     END = 'END'
     EOF = 'EOF'
+    # Eof(f), its keyword 'EOF' is the value of the end of input token
+    EOF_FUNCTION = 'EOF_FUNCTION'
     # Other keywords
     INTEGER_CONST = 'INTEGER_CONST'  # Tokens of variables of type INT and REAL
     REAL_CONST = 'REAL_CONST'
@@ -104,7 +158,16 @@ def _build_reserved_keywords():
         token_type.value: token_type
         for token_type in token_type_list[start_index:end_index + 1]
     }
+    keyword_dict[TokenType.EOF.value] = TokenType.EOF_FUNCTION
     return keyword_dict
 
 
 RESERVED_KEYWORDS = _build_reserved_keywords()
+
+# One shared Token per type, for the tokens whose value is the type value (keywords and
+# operators) and for the nodes whose tokens are dropped after the semantic analysis
+SHARED_TOKENS = {token_type: Token(token_type, token_type.value) for token_type in TokenType}
+
+
+def shared_token(token_type):
+    return SHARED_TOKENS[token_type]
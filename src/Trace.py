@@ -0,0 +1,76 @@
+from collections import deque
+import sys
+import time
+
+
+###################
+#  TRACE          #
+###################
+
+# Event categories
+FRAME = 'frame'     # frame pushed and popped by a procedure call: name, nesting level, depth
+SYMBOL = 'symbol'   # symbol inserted and looked up by the semantic analyzer: name, scope
+SCOPE = 'scope'     # scope entered and left by the semantic analyzer: name, level
+TOKEN = 'token'     # token eaten by the parser: type, value
+CATEGORIES = (FRAME, SYMBOL, SCOPE, TOKEN)
+
+DEFAULT_CAPACITY = 10000
+
+
+class Tracer(object):
+    """ Records of the events of the enabled categories in a ring buffer.
+
+    Every category is a boolean attribute tested by the call sites before recording,
+    so a disabled category costs an attribute lookup and nothing is formatted:
+
+        if tracer.frame:
+            tracer.record(FRAME, 'push', name, level, depth)
+
+    A record is a tuple (time in ns, category, event, fields). Only the last capacity
+    records are kept; dump() writes them, for instance after an error.
+    """
+
+    def __init__(self):
+        for category in CATEGORIES:
+            setattr(self, category, False)
+        self.records = deque(maxlen=DEFAULT_CAPACITY)
+        self.start = time.perf_counter_ns()
+
+    def enable(self, categories=CATEGORIES, capacity=None):
+        unknown = set(categories) - set(CATEGORIES)
+        if unknown:
+            raise ValueError(f"Unknown trace categories {', '.join(sorted(unknown))}")
+        if capacity is not None:
+            self.records = deque(self.records, maxlen=capacity)
+        for category in categories:
+            setattr(self, category, True)
+
+    def disable(self):
+        for category in CATEGORIES:
+            setattr(self, category, False)
+
+    @property
+    def enabled(self):
+        return any(getattr(self, category) for category in CATEGORIES)
+
+    def record(self, category, event, *fields):
+        self.records.append((time.perf_counter_ns(), category, event, fields))
+
+    def clear(self):
+        self.records.clear()
+        self.start = time.perf_counter_ns()
+
+    def format(self, record):
+        timestamp, category, event, fields = record
+        fields = ' '.join(str(field) for field in fields)
+        return f'{(timestamp - self.start) / 1000:12.1f}us {category:<6} {event:<6} {fields}'
+
+    def dump(self, file=None):
+        """ Writes the records, oldest first, to file (stderr by default) """
+        file = sys.stderr if file is None else file
+        for record in self.records:
+            file.write(self.format(record) + '\n')
+        file.flush()
+
+
+tracer = Tracer()
@@ -0,0 +1,345 @@
+from SemanticAnalysis import NodeVisitor
+from Interpreter import Interpreter
+from Errors import ErrorCode, CompilerError
+from Token import TokenType
+from Nodes import *
+from Input import READ_ARRAY
+from Files import TextFile, close_files
+from src.ConstraintDict import CDict
+import logging
+
+
+##################
+#  TRANSPILER    #
+##################
+
+_BINARY_OPERATORS = {
+    TokenType.PLUS: '+',
+    TokenType.MINUS: '-',
+    TokenType.MUL: '*',
+    TokenType.INTEGER_DIV: '//',
+    TokenType.AND: 'and',
+    TokenType.OR: 'or',
+    TokenType.EQUAL: '==',
+    TokenType.NOT_EQ: '!=',
+    TokenType.LESSER: '<',
+    TokenType.GREATER: '>',
+    TokenType.LESS_EQ: '<=',
+    TokenType.GREAT_EQ: '>=',
+}
+
+_UNARY_OPERATORS = {
+    TokenType.PLUS: '+',
+    TokenType.MINUS: '-',
+    TokenType.NOT: 'not ',
+}
+
+# TextFile methods of the file procedures
+_FILE_METHODS = {
+    TokenType.ASSIGN_FILE: 'assign',
+    TokenType.RESET: 'reset',
+    TokenType.REWRITE: 'rewrite',
+    TokenType.CLOSE: 'close',
+}
+
+PROGRAM_FUNCTION = '_program'
+# Methods of the OutputStream of the engine, in the namespace of the generated code
+WRITE_FUNCTION = '_write'
+NEWLINE_FUNCTION = '_newline'
+# Methods of its InputStream
+READ_FUNCTION = '_read'
+FILL_FUNCTION = '_fill'
+# Returns a new TextFile of the engine
+TEXT_FILE_FUNCTION = '_text_file'
+# Interpreter.mapped_array
+MAPPED_ARRAY_FUNCTION = '_mapped_array'
+
+
+class Transpiler(NodeVisitor):
+    """ Translates the analysed AST into Python source code.
+
+    The program block and every procedure become Python functions (procedures nested
+    where they are declared), Pascal variables become local variables of the function
+    declaring them and enclosing-scope variables are reached through Python closures
+    (with nonlocal when assigned), loops become native while loops and arrays stay
+    CDict objects. Statement visits append lines,
+    expression visits return the Python expression as a string.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.level = 0
+        self.scopes = []  # (declared names, assigned outer names) of each function being generated
+        self.temporaries = 0
+
+    def generic_visit(self, node):
+        raise CompilerError(
+            error_code=ErrorCode.UNSUPPORTED_NODE,
+            message=f'{ErrorCode.UNSUPPORTED_NODE.value} -> {type(node).__name__}',
+        )
+
+    def transpile(self, tree: Program) -> str:
+        self.visit(tree)
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, line):
+        self.lines.append('    ' * self.level + line)
+
+    def temporary(self):
+        self.temporaries += 1
+        return f'_t{self.temporaries}'
+
+    @staticmethod
+    def variable(name):
+        return 'v_' + name
+
+    @staticmethod
+    def procedure(name):
+        return 'p_' + name
+
+    def function(self, name, params, block):
+        """ Emits a Python function for a program or procedure block """
+        self.emit(f'def {name}({", ".join(self.variable(param) + "=None" for param in params)}):')
+        self.level += 1
+        header = len(self.lines)
+        self.scopes.append((set(), set()))
+
+        self.visit(block)
+
+        declared, outer = self.scopes.pop()
+        indent = '    ' * self.level
+        header_lines = []
+        if outer:
+            header_lines.append(indent + 'nonlocal ' + ', '.join(self.variable(name) for name in sorted(outer)))
+        # Variables not assigned yet read as None, like an empty Frame slot
+        names = sorted(declared - set(params))
+        if names:
+            header_lines.append(indent + ' = '.join(self.variable(name) for name in names) + ' = None')
+        self.lines[header:header] = header_lines
+        if len(self.lines) == header:
+            self.emit('pass')
+        self.level -= 1
+
+    def body(self, node):
+        # Emits a nested statement, making sure the suite is never empty
+        start = len(self.lines)
+        self.visit(node)
+        if len(self.lines) == start:
+            self.emit('pass')
+
+    # Statements
+
+    def visit_Program(self, node):
+        self.emit('# Generated from PROGRAM ' + node.name)
+        self.function(PROGRAM_FUNCTION, [], node.block)
+
+    def visit_Block(self, node):
+        for declaration in node.declarations:
+            self.visit(declaration)
+        self.visit(node.compound_statement)
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_NoOp(self, node):
+        pass
+
+    def visit_VarDecl(self, node):
+        name = node.var_node.value
+        self.scopes[-1][0].add(name)
+        if hasattr(node.type_node, 'low_range') and node.type_node.path is not None:
+            type_node = node.type_node
+            self.emit(f'{self.variable(name)} = {MAPPED_ARRAY_FUNCTION}({type_node.path!r}, {type_node.low_range!r}, '
+                      f'{type_node.high_range!r}, {type_node.token.value!r})')
+        elif hasattr(node.type_node, 'low_range'):
+            type_node = node.type_node
+            self.emit(f'{self.variable(name)} = CDict({type_node.low_range!r}, {type_node.high_range!r}, {type_node.token.value!r})')
+        elif node.type_node.value == 'TEXT':
+            self.emit(f'{self.variable(name)} = {TEXT_FILE_FUNCTION}()')
+
+    def visit_ProcedureDecl(self, node):
+        params = [param.var_node.value for param in node.formal_params]
+        self.function(self.procedure(node.proc_name), params, node.block_node)
+
+    def visit_Setlength(self, node):
+        self.emit(f'{self.visit(node.var_node)}.set_length({node.length_node.value!r})')
+
+    def visit_Assign(self, node):
+        value = self.visit(node.right)
+        if hasattr(node.left, 'index'):
+            # The value is evaluated before the index, like in the interpreter
+            temporary = self.temporary()
+            self.emit(f'{temporary} = {value}')
+            self.emit(f'{self.variable(node.left.value)}.add({self.visit(node.left.index)}, {temporary})')
+        else:
+            self.store(node.left)
+            self.emit(f'{self.visit(node.left)} = {value}')
+
+    def visit_Condition(self, node):
+        self.emit(f'if {self.visit(node.condition_node)} is True:')
+        self.level += 1
+        self.body(node.then_node)
+        self.level -= 1
+        if node.else_node is not None:
+            self.emit('else:')
+            self.level += 1
+            self.body(node.else_node)
+            self.level -= 1
+
+    def visit_While(self, node):
+        self.emit(f'while {self.visit(node.condition_node)} is True:')
+        self.level += 1
+        self.body(node.do_node)
+        self.level -= 1
+
+    def visit_Repeat(self, node):
+        self.emit('while True:')
+        self.level += 1
+        self.visit(node.repeat_node)
+        self.emit(f'if {self.visit(node.condition_node)} is not False:')
+        self.emit('    break')
+        self.level -= 1
+
+    def visit_Do(self, node):
+        self.visit(node.child)
+
+    def visit_Then(self, node):
+        self.visit(node.child)
+
+    def visit_Else(self, node):
+        self.visit(node.child)
+
+    def visit_Writeln(self, node):
+        write, newline = WRITE_FUNCTION, NEWLINE_FUNCTION
+        node_list = node.node_list
+        if node.has_file:
+            output = self.temporary()
+            self.emit(f'{output} = {self.visit(node_list[0])}.writing()')
+            write, newline = f'{output}.write', f'{output}.newline'
+            node_list = node_list[1:]
+        for subnode in node_list:
+            self.emit(f'{write}(str({self.visit(subnode)}))')
+        self.emit(f'{newline}()')
+
+    def visit_Readln(self, node):
+        read, fill = READ_FUNCTION, FILL_FUNCTION
+        targets = zip(node.node_list, node.read_types)
+        if node.has_file:
+            input = self.temporary()
+            self.emit(f'{input} = {self.visit(node.node_list[0])}.reading()')
+            read, fill = f'{input}.read', f'{input}.fill'
+            next(targets)
+        for subnode, read_type in targets:
+            if subnode.token.type == TokenType.STRING:
+                self.emit(f'{WRITE_FUNCTION}({subnode.value!r})')
+            elif hasattr(subnode, 'index'):
+                temporary = self.temporary()
+                self.emit(f'{temporary} = {self.visit(subnode.index)}')
+                self.emit(f'{self.variable(subnode.value)}.add({temporary}, {read}({read_type!r}))')
+            elif read_type == READ_ARRAY:
+                self.emit(f'{fill}({self.visit(subnode)})')
+            else:
+                self.store(subnode)
+                self.emit(f'{self.visit(subnode)} = {read}({read_type!r})')
+
+    def visit_FileProcedure(self, node):
+        arguments = '' if node.name_node is None else self.visit(node.name_node)
+        self.emit(f'{self.visit(node.var_node)}.{_FILE_METHODS[node.token.type]}({arguments})')
+
+    def store(self, node):
+        # Assigning a variable of an enclosing procedure needs a nonlocal declaration
+        if node.scope_distance:
+            self.scopes[-1][1].add(node.value)
+
+    def visit_ProcedureCall(self, node):
+        proc_symbol = node.proc_symbol
+        if proc_symbol is None:
+            raise CompilerError(
+                error_code=ErrorCode.ID_NOT_FOUND,
+                token=node.token,
+                message=f'{ErrorCode.ID_NOT_FOUND.value} -> {node.token}',
+            )
+        # Only the arguments matched by a formal parameter are evaluated
+        arguments = [
+            self.visit(argument_node)
+            for param_symbol, argument_node in zip(proc_symbol.formal_params, node.actual_params)
+        ]
+        self.emit(f'{self.procedure(node.proc_name)}({", ".join(arguments)})')
+
+    # Expressions
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        if node.op.type == TokenType.FLOAT_DIV:
+            return f'(float({left}) / float({right}))'
+        return f'({left} {_BINARY_OPERATORS[node.op.type]} {right})'
+
+    def visit_UnaryOp(self, node):
+        return f'({_UNARY_OPERATORS[node.op.type]}{self.visit(node.expr)})'
+
+    def visit_Num(self, node):
+        return repr(node.value)
+
+    def visit_Boolean(self, node):
+        return repr(node.value)
+
+    def visit_String(self, node):
+        return repr(node.value)
+
+    def visit_Var(self, node):
+        if node.token.type is TokenType.STRING:  # Used by the print function
+            return repr(node.value)
+        return self.variable(node.value)
+
+    def visit_IndexVar(self, node):
+        return f'{self.variable(node.value)}.get({self.visit(node.index)})'
+
+    def visit_Eof(self, node):
+        return f'{self.visit(node.var_node)}.eof()'
+
+
+class PythonInterpreter(Interpreter):
+    """ Runs a program by transpiling it to Python and letting CPython execute it """
+
+    def __init__(self, tree, output=None, input=None):
+        super().__init__(tree, output, input)
+        self.source = None
+        self.code = None
+
+    def compile(self):
+        self.source = Transpiler().transpile(self.tree)
+        try:
+            self.code = compile(self.source, f'<pascal {self.tree.name}>', 'exec')
+        except SyntaxError as e:
+            raise CompilerError(
+                error_code=ErrorCode.UNSUPPORTED_NODE,
+                message=f'Generated Python is not valid: {e}',
+            )
+        logging.info(f"Transpiled program {self.tree.name} to {len(self.source.splitlines())} lines of Python")
+        return self.code
+
+    def prepare(self):
+        if self.code is None and self.tree is not None:
+            self.compile()
+
+    def interpret(self):
+        if self.tree is None:
+            return ''
+        self.prepare()
+        namespace = {
+            'CDict': CDict,
+            WRITE_FUNCTION: self.output.write,
+            NEWLINE_FUNCTION: self.output.newline,
+            READ_FUNCTION: self.input.read,
+            FILL_FUNCTION: self.input.fill,
+            TEXT_FILE_FUNCTION: lambda: TextFile(self.open_files),
+            MAPPED_ARRAY_FUNCTION: self.mapped_array,
+        }
+        exec(self.code, namespace)
+        try:
+            return namespace[PROGRAM_FUNCTION]()
+        finally:
+            close_files(self.open_files)
+            self.output.flush()
@@ -0,0 +1,282 @@
+from Interpreter import Interpreter
+from Bytecode import BytecodeCompiler, Opcode
+from Stack import Frame, ARType
+from src.ConstraintDict import CDict
+from Files import close_files
+from Trace import tracer, FRAME
+
+
+#######################
+#  VIRTUAL MACHINE    #
+#######################
+
+
+class VirtualMachine(Interpreter):
+    """ Stack based virtual machine running the Bytecode produced by BytecodeCompiler.
+
+    The dispatch loop keeps its own operand stack and a stack of return addresses, so
+    procedure calls do not recurse in Python. Variables still live in Frame objects
+    pushed on the call stack, like in the tree walking Interpreter.
+    """
+
+    def __init__(self, tree, output=None, input=None):
+        super().__init__(tree, output, input)
+        self.bytecode = None
+
+    def compile(self):
+        self.bytecode = BytecodeCompiler().compile(self.tree)
+        return self.bytecode
+
+    def prepare(self):
+        if self.bytecode is None and self.tree is not None:
+            self.compile()
+
+    def interpret(self):
+        if self.tree is None:
+            return ''
+        self.prepare()
+        try:
+            return self.run(self.bytecode)
+        finally:
+            close_files(self.open_files)
+            self.output.flush()
+
+    def run(self, bytecode):
+        ops = bytecode.ops
+        args = bytecode.args
+        consts = bytecode.consts
+        call_sites = bytecode.call_sites
+        call_stack = self.call_stack
+        output = self.output
+        write = output.write
+        newline = output.newline
+        read = self.input.read
+        trace_frames = tracer.frame  # read once, a local is the cheapest test in the loop
+        record = tracer.record
+
+        # Opcodes as locals: comparing against a local is the cheapest dispatch available
+        LOAD_CONST = Opcode.LOAD_CONST.value
+        LOAD_VAR = Opcode.LOAD_VAR.value
+        STORE_VAR = Opcode.STORE_VAR.value
+        LOAD_INDEX = Opcode.LOAD_INDEX.value
+        STORE_INDEX = Opcode.STORE_INDEX.value
+        BINARY_ADD = Opcode.BINARY_ADD.value
+        BINARY_SUB = Opcode.BINARY_SUB.value
+        BINARY_MUL = Opcode.BINARY_MUL.value
+        BINARY_INT_DIV = Opcode.BINARY_INT_DIV.value
+        BINARY_FLOAT_DIV = Opcode.BINARY_FLOAT_DIV.value
+        COMPARE_EQ = Opcode.COMPARE_EQ.value
+        COMPARE_NE = Opcode.COMPARE_NE.value
+        COMPARE_LT = Opcode.COMPARE_LT.value
+        COMPARE_GT = Opcode.COMPARE_GT.value
+        COMPARE_LE = Opcode.COMPARE_LE.value
+        COMPARE_GE = Opcode.COMPARE_GE.value
+        UNARY_POS = Opcode.UNARY_POS.value
+        UNARY_NEG = Opcode.UNARY_NEG.value
+        UNARY_NOT = Opcode.UNARY_NOT.value
+        JUMP = Opcode.JUMP.value
+        JUMP_IF_NOT_TRUE = Opcode.JUMP_IF_NOT_TRUE.value
+        JUMP_IF_FALSE = Opcode.JUMP_IF_FALSE.value
+        JUMP_IF_FALSY_OR_POP = Opcode.JUMP_IF_FALSY_OR_POP.value
+        JUMP_IF_TRUTHY_OR_POP = Opcode.JUMP_IF_TRUTHY_OR_POP.value
+        WRITELN = Opcode.WRITELN.value
+        PRINT_CONST = Opcode.PRINT_CONST.value
+        READ_VAR = Opcode.READ_VAR.value
+        READ_INDEX = Opcode.READ_INDEX.value
+        DECLARE_ARRAY = Opcode.DECLARE_ARRAY.value
+        SET_LENGTH = Opcode.SET_LENGTH.value
+        CALL = Opcode.CALL.value
+        RETURN = Opcode.RETURN.value
+        BINARY_ADD_CONST = Opcode.BINARY_ADD_CONST.value
+        BINARY_SUB_CONST = Opcode.BINARY_SUB_CONST.value
+        BINARY_MUL_CONST = Opcode.BINARY_MUL_CONST.value
+        LOAD_OUTER = Opcode.LOAD_OUTER.value
+        STORE_OUTER = Opcode.STORE_OUTER.value
+        READ_OUTER = Opcode.READ_OUTER.value
+        GET_ITEM = Opcode.GET_ITEM.value
+        SET_ITEM = Opcode.SET_ITEM.value
+        READ_ITEM = Opcode.READ_ITEM.value
+        READ_ARRAY = Opcode.READ_ARRAY.value
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        returns = []  # (return pc, caller frame, display entry replaced by the callee)
+        display = self.display
+
+        ar = Frame(
+            name=bytecode.name,
+            type=ARType.PROGRAM,
+            nesting_level=1,
+            slot_names=bytecode.slot_names,
+        )
+        call_stack.push(ar)
+        display[:] = [None] * (bytecode.scope_levels + 1)
+        display[ar.nesting_level] = ar
+        if trace_frames:
+            record(FRAME, 'push', ar.name, 1, 1)
+        slots = ar.slots
+        pc = 0
+
+        while True:
+            op = ops[pc]
+            arg = args[pc]
+            pc += 1
+
+            if op == LOAD_VAR:
+                push(slots[arg])
+            elif op == LOAD_CONST:
+                push(consts[arg])
+            elif op == STORE_VAR:
+                slots[arg] = pop()
+            elif op == JUMP_IF_NOT_TRUE:
+                if pop() is not True:
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == BINARY_ADD_CONST:
+                stack[-1] = stack[-1] + consts[arg]
+            elif op == BINARY_SUB_CONST:
+                stack[-1] = stack[-1] - consts[arg]
+            elif op == BINARY_MUL_CONST:
+                stack[-1] = stack[-1] * consts[arg]
+            elif op == BINARY_ADD:
+                right = pop()
+                stack[-1] = stack[-1] + right
+            elif op == BINARY_SUB:
+                right = pop()
+                stack[-1] = stack[-1] - right
+            elif op == BINARY_MUL:
+                right = pop()
+                stack[-1] = stack[-1] * right
+            elif op == COMPARE_LT:
+                right = pop()
+                stack[-1] = stack[-1] < right
+            elif op == COMPARE_GT:
+                right = pop()
+                stack[-1] = stack[-1] > right
+            elif op == COMPARE_LE:
+                right = pop()
+                stack[-1] = stack[-1] <= right
+            elif op == COMPARE_GE:
+                right = pop()
+                stack[-1] = stack[-1] >= right
+            elif op == COMPARE_EQ:
+                right = pop()
+                stack[-1] = stack[-1] == right
+            elif op == COMPARE_NE:
+                right = pop()
+                stack[-1] = stack[-1] != right
+            elif op == LOAD_INDEX:
+                stack[-1] = slots[arg].get(stack[-1])
+            elif op == STORE_INDEX:
+                index = pop()
+                slots[arg].add(index, pop())
+            elif op == BINARY_INT_DIV:
+                right = pop()
+                stack[-1] = stack[-1] // right
+            elif op == BINARY_FLOAT_DIV:
+                right = pop()
+                stack[-1] = float(stack[-1]) / float(right)
+            elif op == JUMP_IF_FALSE:
+                if pop() is False:
+                    pc = arg
+            elif op == JUMP_IF_FALSY_OR_POP:
+                if stack[-1]:
+                    pop()
+                else:
+                    pc = arg
+            elif op == JUMP_IF_TRUTHY_OR_POP:
+                if stack[-1]:
+                    pc = arg
+                else:
+                    pop()
+            elif op == UNARY_NEG:
+                stack[-1] = -stack[-1]
+            elif op == UNARY_NOT:
+                stack[-1] = not stack[-1]
+            elif op == UNARY_POS:
+                stack[-1] = +stack[-1]
+            elif op == CALL:
+                call_site = call_sites[arg]
+                frame = Frame(
+                    name=call_site.name,
+                    type=ARType.PROCEDURE,
+                    nesting_level=call_site.nesting_level,
+                    slot_names=call_site.slot_names,
+                )
+                params = call_site.params
+                if params:
+                    count = len(params)
+                    values = stack[-count:]
+                    del stack[-count:]
+                    frame_slots = frame.slots
+                    for slot, value in zip(params, values):
+                        frame_slots[slot] = value
+                level = call_site.nesting_level
+                returns.append((pc, ar, display[level]))
+                display[level] = frame
+                call_stack.push(frame)
+                if trace_frames:
+                    record(FRAME, 'push', frame.name, level, len(call_stack.frames))
+                ar = frame
+                slots = frame.slots
+                pc = call_site.entry
+            elif op == RETURN:
+                if trace_frames:
+                    record(FRAME, 'pop', ar.name, ar.nesting_level, len(call_stack.frames))
+                call_stack.pop()
+                if not returns:
+                    break
+                level = ar.nesting_level
+                pc, ar, display[level] = returns.pop()
+                slots = ar.slots
+            elif op == WRITELN:
+                values = stack[-arg:]
+                del stack[-arg:]
+                for value in values:
+                    write(str(value))
+                newline()
+            elif op == PRINT_CONST:
+                write(consts[arg])
+            elif op == READ_VAR:
+                slot, read_type = consts[arg]
+                slots[slot] = read(read_type)
+            elif op == READ_INDEX:
+                index = pop()
+                array = slots[arg]
+                array.add(index, read(array.element_type))
+            elif op == LOAD_OUTER:
+                distance, slot = consts[arg]
+                push(display[ar.nesting_level - distance].slots[slot])
+            elif op == STORE_OUTER:
+                distance, slot = consts[arg]
+                display[ar.nesting_level - distance].slots[slot] = pop()
+            elif op == GET_ITEM:
+                index = pop()
+                stack[-1] = stack[-1].get(index)
+            elif op == SET_ITEM:
+                index = pop()
+                array = pop()
+                array.add(index, pop())
+            elif op == READ_OUTER:
+                distance, slot, read_type = consts[arg]
+                display[ar.nesting_level - distance].slots[slot] = read(read_type)
+            elif op == READ_ITEM:
+                index = pop()
+                array = pop()
+                array.add(index, read(array.element_type))
+            elif op == READ_ARRAY:
+                distance, slot = consts[arg]
+                self.input.fill(display[ar.nesting_level - distance].slots[slot])
+            elif op == DECLARE_ARRAY:
+                slot, min_range, max_range, element_type, path = consts[arg]
+                if path is None:
+                    slots[slot] = CDict(min_range, max_range, element_type)
+                else:
+                    slots[slot] = self.mapped_array(path, min_range, max_range, element_type)
+            elif op == SET_LENGTH:
+                distance, slot, length = consts[arg]
+                display[ar.nesting_level - distance].slots[slot].set_length(length)
+            else:
+                raise RuntimeError(f'Unknown opcode {op} at pc {pc - 1}')